@@ -37,32 +37,6 @@ struct HistoryManager {
             }
     }
 
-    /// The list of habits with the histories trimmed for the last month is returned.
-    @MainActor static func habitsWithLastMonthSubmissions(
-        habits names: [String]? = nil
-    ) -> [Habit] {
-        guard let allHabits = UserCache.shared.habits else { return [] }
-        let now = Date()
-        let oneMonthAgo = Calendar.current.date(
-            byAdding: .day, value: -30, to: now)!
-
-        return
-            allHabits
-            .filter { names?.contains($0.name) ?? true }
-            .compactMap { habit in
-                let trimmedHistory = habit.history?.filter {
-                    $0.timestamp >= oneMonthAgo && $0.timestamp <= now
-                }
-                return Habit(
-                    name: habit.name,
-                    description: habit.description,
-                    goal: habit.goal,
-                    metrics: habit.metrics,
-                    history: trimmedHistory
-                )
-            }
-    }
-
     /// Given an habit and one of its metric, all its submissions made in the current week are retrieved.
     /// Then, they are aggregated by the day following the aggregation functions defined in the ``HistoryManager``.
     /// In the returned list there are 7 elements, corresponding to the days of that week.
@@ -149,22 +149,8 @@ enum Request {
             ]
             return body as NSDictionary
         case .generateReport(let habitNames):
-            let lastMonthHabits: [String: NSDictionary] =
-                HistoryManager
-                .habitsWithLastMonthSubmissions(habits: habitNames)
-                .reduce(into: [:]) { result, record in
-                    result[record.name] = record.asDBDict
-                }
-            var body: [String: Any] = [
-                "habits": lastMonthHabits
-            ]
-            if let name = UserCache.shared.name {
-                body["name"] = name
-            }
-            if let bio = UserCache.shared.bio {
-                body["bio"] = bio
-            }
-            return body as NSDictionary
+            // The server loads name, bio and habit data from the database
+            return ["habitNames": habitNames]
         case .createHabit(let habit):
             return ["habit": habit.asDBDict]
         case .createSubmission(_, let submission):
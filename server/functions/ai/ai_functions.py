@@ -1,24 +1,105 @@
+import asyncio
 import json
 import logging
-from typing import Union
+from concurrent.futures import TimeoutError
+from typing import Optional, Union
 
-from firebase_admin import auth, db
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 from flask import Response
 from pydantic import ValidationError
 
-from ai.ai_setup.graph_logic import run_graph
+# Imported for its side effect of setting the global function options (region, memory)
+import ai.ai_setup.llm_setup  # noqa: F401
+from ai.ai_setup.fast_path import parse_simple_logging
+from ai.auxiliary.event_loop import run_async
+from ai.auxiliary.context_cache import get_context_manager
+from ai.auxiliary.usage_limit_cache import over_limit_users
 from ai.dto.speech_client_to_server import HabitInputDTO
 from ai.dto.speech_server_to_client import HabitOutputDTO
-from ai.report.report_llm import generate_structured_report
 from db.db_functions import get_authenticated_user_id
+from db.token_cache import verify_id_token
+from db.usage import get_usage, TOKENS_KEY
 
 # Define a constant for the token usage limit per user.
 TOKEN_USAGE_LIMIT = 100000
+# Requests served at the same time by one instance, they mostly wait on the LLM.
+# Concurrency needs at least one full vCPU, the gcf_gen1 default CPU of 1 GB instances only serves one at a time.
+SPEECH_CONCURRENCY = 40
+# Time limit of the speech function, and of its processing, which stops early enough to answer within the limit
+SPEECH_FUNCTION_TIMEOUT_SECONDS = 60
+SPEECH_TIMEOUT_SECONDS = 50
+
+
+def exceeds_token_limit(usage: dict) -> bool:
+    token_count = usage[TOKENS_KEY]
+    return bool(token_count and token_count > TOKEN_USAGE_LIMIT)
+
+
+async def handle_speech(dto_input: HabitInputDTO) -> Optional[HabitOutputDTO]:
+    """
+    Produces the validated output of a speech request, or None if the user exceeded their token limit.
+    The usage read runs alongside the graph, which is cancelled if the user turns out to be over the limit,
+    and the write of the tokens spent runs alongside the output validation.
+    Users already found over the limit by this instance are refused before the graph starts.
+    """
+    input_dict = dto_input.model_dump()
+    user_id = dto_input.user_id
+    if over_limit_users.contains(user_id):
+        return None
+
+    # Built once per habit definitions and shared by the fast path, the graph prompt and the tools
+    context_manager = get_context_manager(input_dict)
+
+    # --- Fast Path ---
+    # Simple logging commands of an existing habit are parsed without the LLM.
+    out = parse_simple_logging(dto_input.speech, context_manager)
+
+    # --- Usage Limit Check ---
+    # Read today's token count, counters of a previous day are reported as zero.
+    usage_read = asyncio.create_task(asyncio.to_thread(get_usage, user_id))
+    graph_run = None
+    if out is None:
+        # The graph modules (LangChain, LangGraph, Vertex AI) are imported on first use to keep cold starts light.
+        from ai.ai_setup.graph_logic import arun_graph
+
+        graph_run = asyncio.create_task(arun_graph(input_dict, context_manager))
+
+    over_limit = True
+    try:
+        over_limit = exceeds_token_limit(await usage_read)
+    finally:
+        # Stop the LLM work of users over the limit, or whose usage could not be read
+        if over_limit and graph_run is not None:
+            graph_run.cancel()
+    if over_limit:
+        over_limit_users.add(user_id)
+        return None
+
+    usage_write = None
+    if graph_run is not None:
+        from ai.ai_setup.graph_components import total_tokens, update_db_token_count
+
+        response = await graph_run
+        out = response.get('out', {})
+
+        # Charge the user once for all the model calls of this request
+        request_tokens = total_tokens(response.get('usage_metadata', {}))
+        if request_tokens:
+            usage_write = asyncio.create_task(asyncio.to_thread(update_db_token_count, request_tokens, user_id))
+    print(out)
+
+    # --- Output Validation ---
+    # Validate the structure of the output from the core logic.
+    try:
+        return HabitOutputDTO(**out)
+    finally:
+        if usage_write is not None:
+            await usage_write
+
 
 # This decorator registers the function as an HTTP-triggered Cloud Function.
 # It will execute whenever a request is made to its public URL.
-@https_fn.on_request()
+@https_fn.on_request(cpu=1, concurrency=SPEECH_CONCURRENCY, timeout_sec=SPEECH_FUNCTION_TIMEOUT_SECONDS)
 def process_speech(request: https_fn.Request) -> Union[Response, tuple[Response, int]]:
     """
     Handles speech processing requests. It validates user input, checks token usage,
@@ -36,15 +117,6 @@ def process_speech(request: https_fn.Request) -> Union[Response, tuple[Response,
 
         print(input_data)
 
-        # --- Usage Limit Check ---
-        # Get a reference to the user's token count in the Firebase database.
-        token_count_ref = db.reference(f'users/{input_data['user_id']}/usage/tokens')
-        token_count = token_count_ref.get()
-
-        if token_count and token_count > TOKEN_USAGE_LIMIT:
-            return Response(json.dumps({"error": "Exceeded token limit"}), status=429,
-                            mimetype='application/json; charset=utf-8')
-        
         # --- Data Validation using Pydantic ---
         # Validate the structure and types of the input data against the DTO.
         try:
@@ -54,20 +126,19 @@ def process_speech(request: https_fn.Request) -> Union[Response, tuple[Response,
                             mimetype='application/json; charset=utf-8')
 
         # --- Core Logic ---
-        # Execute the main application logic (e.g., an AI graph) with the validated data.
-        response = run_graph(dto_input.model_dump())
-
-        # --- Output Validation ---
-        # Extract the primary output from the response.
-        out = response.get('out', {})
-        print(out)
-
-        # Validate the structure of the output from the core logic.
+        # Runs on the event loop shared by the instance, overlapping the usage reads and writes with the LLM calls.
         try:
-            dto_out = HabitOutputDTO(**out)
+            dto_out = run_async(handle_speech(dto_input), timeout=SPEECH_TIMEOUT_SECONDS)
         except ValidationError as e:
             return Response(json.dumps({"error": "Invalid output format"}), status=400,
                             mimetype='application/json; charset=utf-8')
+        except TimeoutError:
+            return Response(json.dumps({"error": "Speech processing timed out"}), status=504,
+                            mimetype='application/json; charset=utf-8')
+
+        if dto_out is None:
+            return Response(json.dumps({"error": "Exceeded token limit"}), status=429,
+                            mimetype='application/json; charset=utf-8')
 
         # --- Success Response ---
         # On success, return the validated output as a JSON response.
@@ -88,25 +159,20 @@ def generate_report(request: https_fn.Request) -> Union[Response, tuple[Response
     """
     try:
         # --- Authentication ---
-        # Get the 'Authorization' header from the request.
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
+        user_id = get_report_user_id(request)
+        if user_id is None:
             return https_fn.Response(
                 json.dumps({"error": "Missing or invalid Authorization header."}),
                 status=401,
                 mimetype='application/json'
             )
-
-        # Extract the token from the "Bearer <token>" string.
-        id_token = auth_header.split("Bearer ")[1]
-        # Verify the Firebase ID token to authenticate the user.
-        decoded_token = auth.verify_id_token(id_token)
-        # Get the user's unique ID from the decoded token.
-        user_id = decoded_token['uid']
         print("User ID:", user_id)
 
-        # Get the user data payload from the request body.
-        data = request.get_json()
+        # The report module (GenAI, embeddings, sklearn) is imported on first use to keep cold starts light.
+        from ai.report.report_llm import generate_structured_report
+
+        # Get the user data from the request body, or from the database if the body only names the habits.
+        data = get_report_data(request, user_id)
         print("Received data:", data)
 
         # Call the function to generate the report, passing the user data and ID.
@@ -122,3 +188,93 @@ def generate_report(request: https_fn.Request) -> Union[Response, tuple[Response
         logging.exception("Error in generate_report")
         error_payload = {"error": f"An internal error occurred: {str(e)}"}
         return https_fn.Response(json.dumps(error_payload), status=500, mimetype='application/json')
+
+
+# This decorator registers the function as an HTTP-triggered Cloud Function.
+# It will execute whenever a request is made to its public URL.
+@https_fn.on_request()
+def generate_report_stream(request: https_fn.Request) -> Union[Response, tuple[Response, int]]:
+    """
+    Streaming variant of generate_report. The report is sent as newline-delimited JSON:
+    {"field": "title" | "content", "delta": ...} fragments while the model generates,
+    then {"done": true, "report": {...}} once the report has been saved, or {"error": ...}.
+    """
+    try:
+        # --- Authentication ---
+        user_id = get_report_user_id(request)
+        if user_id is None:
+            return https_fn.Response(
+                json.dumps({"error": "Missing or invalid Authorization header."}),
+                status=401,
+                mimetype='application/json'
+            )
+        print("User ID:", user_id)
+
+        # The report module (GenAI, embeddings, sklearn) is imported on first use to keep cold starts light.
+        from ai.report.report_llm import generate_structured_report_stream
+
+        # Get the user data from the request body, or from the database if the body only names the habits.
+        data = get_report_data(request, user_id)
+
+    except Exception as e:
+        logging.exception("Error in generate_report_stream")
+        error_payload = {"error": f"An internal error occurred: {str(e)}"}
+        return https_fn.Response(json.dumps(error_payload), status=500, mimetype='application/json')
+
+    def events():
+        # Headers are already sent once streaming starts, so errors are reported as a final event.
+        try:
+            for event in generate_structured_report_stream(data, user_id):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            logging.exception("Error in generate_report_stream")
+            yield json.dumps({"error": f"An internal error occurred: {str(e)}"}) + "\n"
+
+    # --- Streaming Response ---
+    return https_fn.Response(events(), mimetype='application/x-ndjson')
+
+
+# This decorator registers the function as a Cloud Scheduler-triggered Cloud Function.
+# It runs every 30 minutes during the night, so report generation happens off-peak.
+@scheduler_fn.on_schedule(schedule="*/30 1-5 * * *", timezone=scheduler_fn.Timezone("Europe/Rome"), timeout_sec=540)
+def generate_scheduled_reports(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Pre-generates the reports of the users whose next report date has passed,
+    so that their report is ready when they open the app.
+    """
+    # The report module (GenAI, embeddings, sklearn) is imported on first use to keep cold starts light.
+    from ai.report.report_scheduler import generate_due_reports
+
+    generate_due_reports()
+
+
+def get_report_user_id(request: https_fn.Request) -> str | None:
+    """
+    Returns the ID of the user authenticated by the Bearer token of the request,
+    or None if the Authorization header is missing or malformed.
+    """
+    # Get the 'Authorization' header from the request.
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+
+    # Extract the token from the "Bearer <token>" string.
+    id_token = auth_header.split("Bearer ")[1]
+    # Verify the Firebase ID token to authenticate the user, reusing recent verifications.
+    decoded_token = verify_id_token(id_token)
+    # Get the user's unique ID from the decoded token.
+    return decoded_token['uid']
+
+
+def get_report_data(request: https_fn.Request, user_id: str) -> dict:
+    """
+    Returns the report data of the user.
+    Clients may still upload their habits with history in the body, otherwise the body is
+    at most {"habitNames": [...]} and the data is loaded from the database.
+    """
+    data = request.get_json(silent=True) or {}
+    if isinstance(data.get("habits"), dict):
+        return data
+
+    from ai.report.report_llm import load_user_report_data
+    return load_user_report_data(user_id, data.get("habitNames"))
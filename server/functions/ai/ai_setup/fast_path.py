@@ -0,0 +1,235 @@
+import re
+from datetime import datetime
+from typing import Dict, Optional
+
+import pytz
+
+from ai.auxiliary.json_keys import ActionKeys, JsonKeys
+from ai.auxiliary.utils import ContextInfoManager
+from ai.ui_schema.dispacher import validate_input
+from ai.ui_schema.schemas import InputTypeKeys
+
+TIMEZONE = pytz.timezone('Europe/Rome')
+
+# Words that make an utterance more than a single log of the current moment, left to the LLM:
+# creation requests, intentions and commands, time references, negations, and several actions in one sentence
+CREATION_WORDS = {"create", "new", "track", "tracking", "start", "habit", "crea", "nuovo", "nuova", "aggiungi"}
+TIME_REFERENCE_WORDS = {
+    "yesterday", "tomorrow", "ago", "last", "morning", "afternoon", "evening", "night", "tonight", "at",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "week", "month",
+    "ieri", "domani", "fa", "scorso", "scorsa", "stamattina", "stamani", "stasera", "stanotte", "pomeriggio",
+    "mattina", "sera", "notte", "alle", "settimana", "mese",
+}
+INTENT_WORDS = {
+    "want", "wanna", "would", "should", "shall", "must", "need", "will", "i'll", "we'll", "going", "gonna", "goal",
+    "goals", "plan", "planning", "aim", "target", "try", "remind", "reminder", "delete", "remove", "change", "set",
+    "update", "edit", "modify", "rename", "cancel", "undo", "reset",
+    "voglio", "vorrei", "devo", "dovrei", "obiettivo", "programma", "ricordami", "ricorda", "promemoria", "elimina",
+    "cancella", "rimuovi", "cambia", "modifica", "imposta", "aggiorna", "annulla", "farò", "andrò",
+}
+NEGATION_WORDS = {"not", "no", "never", "didn't", "didnt", "don't", "dont", "haven't", "skipped", "non", "mai"}
+CONJUNCTION_WORDS = {"and", "then", "also", "plus", "e", "poi", "anche"}
+
+# Units a number may come with, each with its aliases: a slider value given in a unit is only taken
+# when the name or the description of the metric mentions the same unit, e.g. not minutes for a distance.
+# Any other word right after the number (bottles, times) is an unknown unit, and also left to the LLM
+UNIT_ALIASES = [
+    {"second", "seconds", "sec", "secs", "s", "secondi", "secondo"},
+    {"minute", "minutes", "min", "mins", "minuti", "minuto"},
+    {"hour", "hours", "hr", "hrs", "h", "ore", "ora"},
+    {"day", "days", "giorni", "giorno"},
+    {"km", "kms", "kilometer", "kilometers", "kilometre", "kilometres", "chilometri", "chilometro"},
+    {"meter", "meters", "metre", "metres", "metri", "metro"},
+    {"mile", "miles", "miglia", "miglio"},
+    {"step", "steps", "passi", "passo"},
+    {"l", "liter", "liters", "litre", "litres", "litri", "litro"},
+    {"ml", "milliliter", "milliliters", "millilitre", "millilitres", "millilitri"},
+    {"glass", "glasses", "bicchieri", "bicchiere"},
+    {"cup", "cups", "tazze", "tazza"},
+    {"kg", "kgs", "kilo", "kilos", "kilogram", "kilograms", "chili", "chilo"},
+    {"g", "gram", "grams", "grammi", "grammo"},
+    {"lb", "lbs", "pound", "pounds", "libbre"},
+    {"kcal", "cal", "calorie", "calories"},
+    {"page", "pages", "pagine", "pagina"},
+    {"rep", "reps", "ripetizioni"},
+]
+UNITS = {alias: aliases for aliases in UNIT_ALIASES for alias in aliases}
+# Words that may follow a number without being its unit, e.g. once the metric name is removed from "2 glasses of water"
+UNIT_CONNECTOR_WORDS = {"of", "di", "today", "oggi", "now", "adesso"}
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "fifteen": 15, "twenty": 20, "thirty": 30, "forty": 40,
+    "fifty": 50, "sixty": 60, "ninety": 90, "hundred": 100,
+}
+NUMBER = r"\d+(?:[.,]\d+)?|" + "|".join(NUMBER_WORDS)
+
+CLOCK_PATTERN = re.compile(r"\b(\d{1,2}):([0-5]\d)(?::([0-5]\d))?\b")
+DURATION_PATTERN = re.compile(
+    rf"\b(half an hour|an hour|({NUMBER})\s*(hours?|hrs?|h|ore|ora|minutes?|mins?|m|minuti|minuto|seconds?|secs?|s|secondi))\b"
+)
+DURATION_JOIN_PATTERN = re.compile(r"@\s+(?:and|e)\s+(?=@)")
+RATING_PATTERN = re.compile(r"\b([1-5])\s*(?:/\s*5|out of 5|su 5|stars?|stelle)\b")
+NUMBER_PATTERN = re.compile(rf"(?<![\w.,:])({NUMBER})(?![\w:]|[.,]\d)")
+UNIT_PATTERN = re.compile(rf"(?<![\w.,:])(?:{NUMBER})(?![\w:]|[.,]\d)\s*([^\W\d]+)")
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def _number(token: str) -> float:
+    return NUMBER_WORDS.get(token, None) or float(token.replace(",", "."))
+
+
+def _find(phrase: str, text: str) -> Optional[re.Match]:
+    """Finds a name as whole words, also in its simple plural form."""
+    return re.search(rf"\b{re.escape(phrase.lower())}(?:s|es)?\b", text)
+
+
+def _duration_seconds(text: str) -> tuple[Optional[int], str]:
+    """Sums the durations in the text (clock times or e.g. '1 hour and 20 minutes'), returning the rest of the text."""
+    clocks = list(CLOCK_PATTERN.finditer(text))
+    durations = list(DURATION_PATTERN.finditer(text))
+    if clocks and durations or len(clocks) > 1:
+        return None, text
+
+    if clocks:
+        hours, minutes, seconds = clocks[0].groups()
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds or 0), CLOCK_PATTERN.sub(" ", text)
+
+    total = 0
+    for match in durations:
+        phrase, amount, unit = match.groups()
+        if phrase == "half an hour":
+            total += 1800
+        elif phrase == "an hour":
+            total += 3600
+        elif unit.startswith(("h", "or")):
+            total += _number(amount) * 3600
+        elif unit.startswith("m"):
+            total += _number(amount) * 60
+        else:
+            total += _number(amount)
+    if not durations:
+        return None, text
+    return int(round(total)), DURATION_PATTERN.sub(" ", text)
+
+
+def _unit_matches(text: str, metric_text: str) -> bool:
+    """
+    Checks that the word after the number in the text, if any, is a unit mentioned by the metric name or
+    description (or one of its aliases), or a connector word. Unknown words are taken as unknown units.
+    """
+    match = UNIT_PATTERN.search(text)
+    if match is None or match.group(1) in UNIT_CONNECTOR_WORDS:
+        return True
+    metric_words = set(WORD_PATTERN.findall(metric_text))
+    return bool(UNITS.get(match.group(1), {match.group(1)}) & metric_words)
+
+
+def _extract_value(input_type: str, config: Dict, text: str, metric_text: str = ""):
+    """
+    Extracts the value of a metric of the given input type from the text, with the habit and metric names removed.
+    The metric text (its name and description) tells which units a slider value may come with.
+    Returns None unless exactly one value is found, so that ambiguous utterances go to the LLM.
+    """
+    if input_type == InputTypeKeys.TIME.value:
+        seconds, text = _duration_seconds(text)
+        if seconds is None or not 0 < seconds < 24 * 3600 or NUMBER_PATTERN.search(text):
+            return None
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+    if input_type == InputTypeKeys.RATING.value:
+        ratings = RATING_PATTERN.findall(text)
+        numbers = NUMBER_PATTERN.findall(RATING_PATTERN.sub(" ", text))
+        candidates = [int(rating) for rating in ratings] + [_number(number) for number in numbers]
+        if len(candidates) != 1 or candidates[0] not in range(1, 6):
+            return None
+        return int(candidates[0])
+
+    if input_type == InputTypeKeys.SLIDER.value:
+        numbers = NUMBER_PATTERN.findall(text)
+        if len(numbers) != 1 or not _unit_matches(text, metric_text):
+            return None
+        value = _number(numbers[0])
+        if config.get(JsonKeys.CONFIG_MIN.value) is not None and value < config[JsonKeys.CONFIG_MIN.value]:
+            return None
+        if config.get(JsonKeys.CONFIG_MAX.value) is not None and value > config[JsonKeys.CONFIG_MAX.value]:
+            return None
+        if config.get(JsonKeys.CONFIG_TYPE.value) == "int" and value != int(value):
+            return None
+        return int(value) if value == int(value) else value
+
+    if input_type == InputTypeKeys.FORM.value:
+        boxes = [box for box in config.get(JsonKeys.CONFIG_BOXES.value) or [] if _find(box, text)]
+        return boxes[0] if len(boxes) == 1 else None
+
+    # Free text needs the LLM to decide what to keep
+    return None
+
+
+def parse_simple_logging(speech: str, context_manager: ContextInfoManager) -> Optional[Dict]:
+    """
+    Deterministic parser for utterances logging a single value of an existing habit, such as
+    "I drank 2 glasses of water" or "meditation for 15 minutes", which do not need the LLM.
+
+    Args:
+        speech: The transcribed utterance of the user.
+        context_manager: The context of the user's habits.
+
+    Returns:
+        The output in the same format as the graph (creation and logging), or None whenever the
+        utterance is not clearly a single log of one habit, in which case the graph has to handle it.
+    """
+    text = " ".join(speech.lower().split())
+    if not text or "?" in text or ";" in text:
+        return None
+
+    # Match habit names and metric names as whole words, a single habit must be referenced
+    habit_matches = {name: match for name in context_manager.habits_names_set if (match := _find(name, text))}
+    metric_matches = {(habit, metric): match for habit, metric in context_manager.metrics_names_set
+                      if (match := _find(metric, text))}
+    habits = set(habit_matches) | {habit for habit, _ in metric_matches}
+    if len(habits) != 1:
+        return None
+    habit_name = habits.pop()
+
+    # The metric is the only one of the habit, or the only one mentioned
+    habit_metrics = [metric for habit, metric in context_manager.metrics_names_set if habit == habit_name]
+    mentioned = [metric for habit, metric in metric_matches if habit == habit_name]
+    if len(habit_metrics) == 1:
+        metric_name = habit_metrics[0]
+    elif len(mentioned) == 1:
+        metric_name = mentioned[0]
+    else:
+        return None
+
+    # Remove the names, so digits inside them are not read as values
+    for match in [*habit_matches.values(), *metric_matches.values()]:
+        start, end = match.span()
+        text = text[:start] + " " * (end - start) + text[end:]
+
+    input_config = context_manager.input_config_map[(habit_name, metric_name)]
+    input_type, config = input_config['input_type'], input_config['config'] or {}
+    config = {key: value for key, value in config.items() if value is not None}
+
+    # Durations may contain conjunctions ("1 hour and 20 minutes"), so they are left out of the word checks
+    without_durations = DURATION_JOIN_PATTERN.sub("@ ", DURATION_PATTERN.sub(" @ ", text))
+    words = set(WORD_PATTERN.findall(without_durations))
+    if words & (CREATION_WORDS | INTENT_WORDS | TIME_REFERENCE_WORDS | NEGATION_WORDS | CONJUNCTION_WORDS):
+        return None
+
+    metric_text = f"{metric_name} {input_config.get('description') or ''}".lower()
+    value = _extract_value(input_type, config, text, metric_text)
+    if value is None:
+        return None
+    try:
+        value = validate_input(input_type=input_type, input_value=value, config=config)
+    except ValueError:
+        return None
+
+    out = {key.value: {} for key in ActionKeys}
+    out[ActionKeys.LOGGING.value][habit_name] = [{
+        JsonKeys.TIMESTAMP.value: datetime.now(TIMEZONE).strftime("%Y-%m-%dT%H:%M:%S"),
+        JsonKeys.NOTES.value: None,
+        JsonKeys.METRICS.value: {metric_name: value},
+    }]
+    return out
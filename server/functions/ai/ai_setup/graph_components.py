@@ -1,25 +1,67 @@
-import operator
-from datetime import datetime
 from typing import Annotated, Dict, TypedDict
 
-from langchain_core.messages import AnyMessage
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import AnyMessage, AIMessage, ToolMessage
+from langchain_core.messages.ai import add_usage
 from langgraph.graph import add_messages
 from langgraph.prebuilt import ToolNode
+from langgraph.types import Command
 
 from ai.ai_tools.tools.habit_tools import create_habit_tool, insert_habit_tool
 from ai.ai_tools.tools.utils import final_answer
-from firebase_admin import db, auth
+from ai.auxiliary.json_keys import JsonKeys
+from ai.auxiliary.context_cache import context_manager_from_state
+from db.usage import add_tokens
 
 tools = [create_habit_tool, insert_habit_tool, final_answer]
 tool_node = ToolNode(tools)
-memory = MemorySaver()
-
-
-def merge_dicts(current_dict: dict | None, new_dict: dict) -> dict:
-    if current_dict is None:
-        return new_dict
-    return {**current_dict, **new_dict}
+# Tools whose successful execution can complete a request without a final_answer turn
+ACTION_TOOL_NAMES = {create_habit_tool.name, insert_habit_tool.name}
+
+
+def merge_out(current: dict | None, new: dict) -> dict:
+    """Merges output updates: habits are added to each action, and log entries of the same habit are appended."""
+    if current is None:
+        return new
+    merged = {action: dict(habits) for action, habits in current.items()}
+    for action, habits in new.items():
+        target = merged.setdefault(action, {})
+        for habit_name, value in habits.items():
+            if isinstance(value, list) and isinstance(target.get(habit_name), list):
+                target[habit_name] = target[habit_name] + value
+            else:
+                target[habit_name] = value
+    return merged
+
+
+def merge_context(current: dict | None, new: dict) -> dict:
+    """Merges context updates field by field: sets are joined, lists extended and maps updated."""
+    if current is None:
+        return new
+    merged = dict(current)
+    for key, value in new.items():
+        existing = merged.get(key)
+        if isinstance(existing, set):
+            merged[key] = existing | set(value)
+        elif isinstance(existing, list):
+            merged[key] = existing + [item for item in value if item not in existing]
+        elif isinstance(existing, dict):
+            merged[key] = {**existing, **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_usage(current: dict | None, new: dict) -> dict:
+    """Sums the token usage of the model calls of a request, per model."""
+    merged = dict(current or {})
+    for model_name, usage in new.items():
+        merged[model_name] = add_usage(merged.get(model_name), usage)
+    return merged
+
+
+def total_tokens(usage_metadata: dict) -> int:
+    """Total tokens of a request across all the models it called."""
+    return sum(usage.get("total_tokens", 0) for usage in usage_metadata.values())
 
 
 class TokenUsage(TypedDict):
@@ -30,9 +72,10 @@ class TokenUsage(TypedDict):
 
 class MessagesState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
-    context: Annotated[Dict, operator.or_]
-    out: Annotated[Dict, operator.or_]
-    usage_metadata: Dict[str, TokenUsage]
+    context: Annotated[Dict, merge_context]
+    out: Annotated[Dict, merge_out]
+    # Request-scoped token usage per model, summed over the model calls of the run
+    usage_metadata: Annotated[Dict[str, TokenUsage], merge_usage]
 
 
 def should_use_tools(state: MessagesState) -> str:
@@ -45,48 +88,114 @@ def should_use_tools(state: MessagesState) -> str:
                 return "__end__"
 
     # Case 2: If there are tool calls, route to "tools" node
+    # (the state is injected into the calls by the tools node itself, on its own copies)
     if hasattr(last_message, "tool_calls") and len(last_message.tool_calls) > 0:
-        for call in last_message.tool_calls:
-            tool_node.inject_tool_args(call, state, store=None)
         return "tools"
 
     return "assistant"
 
 
-def update_db_token_count(total_tokens: int, user_id: str):
-    usage_ref = db.reference(f'users/{user_id}/usage')
-    usage_data = usage_ref.get()
-
-    now = datetime.now()
-    today_str = now.date().isoformat()  # '2025-05-23'
-    full_iso = now.isoformat(timespec='seconds')  # '2025-05-23T06:42:00'
-
-    # Check if existing usage is from a different day
-    if usage_data:
-        stored_today = usage_data.get("today", "")
-        stored_date = stored_today[:10]  # Extract 'YYYY-MM-DD'
-        if stored_date != today_str:
-            usage_ref.delete()
-            usage_data = None
-
-    # Initialize if new day or no data
-    if usage_data is None:
-        usage_ref.set({
-            "today": full_iso,  # save full datetime
-            "tokens": total_tokens
-        })
-        return
-
-    # If 'today' is missing, set it with full ISO timestamp
-    if "today" not in usage_data:
-        usage_ref.update({"today": full_iso})
-
-    # If 'tokens' is missing, initialize it
-    if "tokens" not in usage_data:
-        usage_ref.update({"tokens": total_tokens})
-    else:
-        # Otherwise, increment
-
-        current_tokens = usage_data["tokens"]
-        usage_ref.update({"tokens": current_tokens + total_tokens})
+def plan_tool_calls(tool_calls: list[dict], context: dict) -> list[list[dict]]:
+    """
+    Orders the tool calls of a turn in stages of independent calls.
+    Logs of habits created in the same turn depend on their creation, and run in a second stage,
+    all the other calls run together in the first one.
+    """
+    existing = context_manager_from_state(context).habits_names_set
+    created = {
+        habit.get(JsonKeys.HABIT_NAME.value)
+        for call in tool_calls if call["name"] == create_habit_tool.name
+        for habit in call["args"].get("creation") or [] if isinstance(habit, dict)
+    } - set(existing)
+
+    independent, dependent = [], []
+    for call in tool_calls:
+        logged = {
+            log.get(JsonKeys.HABIT_NAME.value)
+            for log in call["args"].get("logging") or [] if isinstance(log, dict)
+        } if call["name"] == insert_habit_tool.name else set()
+        (dependent if logged & created else independent).append(call)
+    return [stage for stage in (independent, dependent) if stage]
+
+
+def _stage_input(state: MessagesState, context: dict, stage: list[dict]) -> dict:
+    return {**state, "context": context, "messages": [AIMessage(content="", tool_calls=stage)]}
+
+
+def _merge_stage_result(update: dict, context: dict, result) -> dict:
+    """Adds the outputs of a stage to the update of the tools node, returning the context for the next stage."""
+    for output in result if isinstance(result, list) else [result]:
+        output = output.update if isinstance(output, Command) else output
+        update["messages"] += output.get("messages", [])
+        if "context" in output:
+            context = merge_context(context, output["context"])
+            update["context"] = merge_context(update["context"], output["context"])
+        if "out" in output:
+            update["out"] = merge_out(update["out"], output["out"])
+    return context
+
+
+def _sort_tool_messages(update: dict, tool_calls: list[dict]) -> dict:
+    # Tool results follow the order of the calls
+    order = {call["id"]: i for i, call in enumerate(tool_calls)}
+    update["messages"].sort(key=lambda message: order.get(getattr(message, "tool_call_id", None), len(order)))
+    return update
+
+
+def execute_tools(state: MessagesState) -> dict:
+    """
+    Runs the tool calls of the last turn, the calls of each stage in parallel (see plan_tool_calls).
+    Each stage sees the context updated by the previous one, so logs can target habits created in the same turn.
+    """
+    tool_calls = state["messages"][-1].tool_calls
+    context = state["context"]
+    update = {"messages": [], "context": {}, "out": {}}
+
+    for stage in plan_tool_calls(tool_calls, context):
+        result = tool_node.invoke(_stage_input(state, context, stage))
+        context = _merge_stage_result(update, context, result)
+    return _sort_tool_messages(update, tool_calls)
+
+
+async def aexecute_tools(state: MessagesState) -> dict:
+    """Async variant of execute_tools, used when the graph runs with ainvoke."""
+    tool_calls = state["messages"][-1].tool_calls
+    context = state["context"]
+    update = {"messages": [], "context": {}, "out": {}}
+
+    for stage in plan_tool_calls(tool_calls, context):
+        result = await tool_node.ainvoke(_stage_input(state, context, stage))
+        context = _merge_stage_result(update, context, result)
+    return _sort_tool_messages(update, tool_calls)
+
+
+def after_tools(state: MessagesState) -> str:
+    """
+    Routes to the end once the tool calls of the last turn completed the request, saving the final_answer turn.
+    That is the case when they all succeeded and the model flagged one of them as its last action,
+    otherwise the model may still have actions left, e.g. logging more data of the habits it created.
+    """
+    messages = state["messages"]
+    tool_messages = []
+    for message in reversed(messages):
+        if isinstance(message, AIMessage):
+            break
+        if isinstance(message, ToolMessage):
+            tool_messages.append(message)
+
+    # Failed calls go back to the model, which can fix their arguments
+    if not isinstance(message, AIMessage) or any(msg.status == "error" for msg in tool_messages):
+        return "assistant"
+
+    calls = message.tool_calls
+    names = {call["name"] for call in calls}
+    if not calls or not names <= ACTION_TOOL_NAMES:
+        return "assistant"
+    if any(call["args"].get("last_action") for call in calls):
+        return "__end__"
+    return "assistant"
+
 
+def update_db_token_count(total_tokens: int, user_id: str):
+    # Day rollover and increment happen in a single transaction on users/{uid}/usage
+    add_tokens(user_id, total_tokens)
@@ -1,74 +1,118 @@
+import asyncio
 import datetime
 import json
-from typing import TypedDict, Dict, Any
-from uuid import uuid4
+from typing import TypedDict, Dict, Any, Optional
 
-from langchain_core.callbacks import UsageMetadataCallbackHandler
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
 
-from ai.ai_setup.graph_components import tool_node, should_use_tools, memory, MessagesState, update_db_token_count
-from ai.ai_setup.llm_setup import llm
+from ai.ai_setup.graph_components import execute_tools, aexecute_tools, should_use_tools, after_tools, \
+    MessagesState, update_db_token_count, total_tokens
+from ai.ai_setup.llm_setup import get_llm
 from ai.auxiliary.json_keys import ActionKeys
+from ai.auxiliary.lazy import lazy_resource
+from ai.auxiliary.context_cache import get_context_manager
 from ai.auxiliary.utils import ContextInfoManager
 from ai.dto.speech_client_to_server import HabitInputDTO
 
-token_callback = UsageMetadataCallbackHandler()
+def model_update(response) -> dict:
+    # The usage of this call only, the state reducer sums it with the other calls of the same request
+    usage = {}
+    if response.usage_metadata:
+        usage[response.response_metadata.get("model_name") or "unknown"] = response.usage_metadata
+    return {"messages": [response], "usage_metadata": usage}
 
 
 def call_model(state: MessagesState):
     # print(state["messages"][-1])
-    response = llm.invoke(state["messages"], config={"callbacks": [token_callback]})
+    response = get_llm().invoke(state["messages"])
     # print(response)
-    return {"messages": [response], "usage_metadata": token_callback.usage_metadata}
+    return model_update(response)
 
 
-def innit_graph():
+async def acall_model(state: MessagesState):
+    # Building the LLM blocks for seconds, so it is kept off the event loop shared by the other requests
+    llm = get_llm() if get_llm.initialized else await asyncio.to_thread(get_llm)
+    response = await llm.ainvoke(state["messages"])
+    return model_update(response)
+
+
+def innit_graph(end_after_tools: bool = True, checkpointer=None):
+    """
+    Compiles the habit graph. With end_after_tools, successful action tool calls can end the run
+    directly instead of waiting for a final_answer call from the model.
+    Requests are single-shot and never resumed, so by default the graph runs without a checkpointer,
+    and nothing of a request outlives it.
+    The nodes have both a sync and an async implementation, so the graph runs with invoke and ainvoke alike.
+    """
     workflow = StateGraph(MessagesState)
 
     # NODES
-    workflow.add_node("assistant", call_model)
-    workflow.add_node("tools", tool_node)
+    workflow.add_node("assistant", RunnableLambda(call_model, afunc=acall_model))
+    workflow.add_node("tools", RunnableLambda(execute_tools, afunc=aexecute_tools))
 
     # EDGES
     workflow.add_edge(START, "assistant")
     workflow.add_conditional_edges("assistant", should_use_tools, ["assistant", "tools", END])
-    workflow.add_edge("tools", "assistant")
+    if end_after_tools:
+        workflow.add_conditional_edges("tools", after_tools, ["assistant", END])
+    else:
+        workflow.add_edge("tools", "assistant")
 
-    graph = workflow.compile(checkpointer=memory)
+    graph = workflow.compile(checkpointer=checkpointer)
     return graph
 
 
-graph = innit_graph()
+# Compiled on the first speech request instead of at import time
+get_graph = lazy_resource(innit_graph)
+GRAPH_CONFIG = {"recursion_limit": 10}
 
 
-def run_graph(data: Dict[str, Any]):
+def graph_input(data: Dict[str, Any], context_manager: Optional[ContextInfoManager] = None) -> dict:
+    """
+    Builds the initial state of the graph from the validated speech request. The context manager is the cached one
+    of the user's habit definitions, so the system prompt is identical across the requests of the same definitions,
+    and can be served from the provider's prompt cache.
+    """
     out = {key.value: {} for key in ActionKeys}
 
     context = {"habits": data.get("habits", {})}
     user_input = data.get("speech", [])
-    user_id = data['user_id']
 
-    context_manager = ContextInfoManager.from_context(context)
+    if context_manager is None:
+        context_manager = get_context_manager(context)
     print("Context Manager Initialized")
 
     innit_prompt = SystemMessage(f"""
     If instructions or parameters are not clear feel free to generate them yourself.
+    Do every action in as few turns as possible: call the tools in parallel in the same turn,
+    also to log data of habits you are creating, and set last_action on the call that completes the request.
     Currently available habits, choose from these to insert data:
     {context_manager.habits_descriptions}
     """)
 
-    response = graph.invoke(
-        {"messages": [innit_prompt, HumanMessage(user_input)],
-         "context": context_manager.model_dump(), "out": out, "usage_metadata": {}},
-        config={"configurable": {"thread_id": uuid4()}, "recursion_limit": 10})
+    return {"messages": [innit_prompt, HumanMessage(user_input)],
+            "context": context_manager.model_dump(), "out": out, "usage_metadata": {}}
+
 
-    metadata = response.get('usage_metadata', {})
-    model_key = next(iter(metadata), None)
-    token_usage = metadata.get(model_key, {})
-    total_tokens = token_usage.get("total_tokens", 0)
-    update_db_token_count(total_tokens, user_id)
+def run_graph(data: Dict[str, Any], context_manager: Optional[ContextInfoManager] = None):
+    response = get_graph().invoke(graph_input(data, context_manager), config=GRAPH_CONFIG)
+
+    # Charge the user once for all the model calls of this request
+    request_tokens = total_tokens(response.get('usage_metadata', {}))
+    if request_tokens:
+        update_db_token_count(request_tokens, data['user_id'])
 
     return response
 
+
+async def arun_graph(data: Dict[str, Any], context_manager: Optional[ContextInfoManager] = None):
+    """
+    Async variant of run_graph. The tokens are not charged here: the caller charges
+    total_tokens(response["usage_metadata"]), so that the write can overlap with its own work.
+    """
+    graph = get_graph() if get_graph.initialized else await asyncio.to_thread(get_graph)
+    return await graph.ainvoke(graph_input(data, context_manager), config=GRAPH_CONFIG)
+
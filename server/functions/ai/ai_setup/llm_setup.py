@@ -1,28 +1,40 @@
-import vertexai
 from firebase_functions import options
-from langchain_google_vertexai import ChatVertexAI
 
-from ai.ai_setup.graph_components import tools
+from ai.auxiliary.lazy import lazy_resource
 
 
 options.set_global_options(region="europe-west1", memory=options.MemoryOption.GB_1)
 
+# Project and region of every Vertex AI call, the chat model as well as the report embeddings
+VERTEXAI_PROJECT = "well-meing"
+VERTEXAI_LOCATION = "europe-west1"
 
 
+@lazy_resource
+def init_vertexai() -> None:
+    """
+    Initializes the Vertex AI SDK once per instance. Every entry point using a Vertex AI model calls it first,
+    otherwise instances only serving reports would load the models from the default project and region.
+    """
+    import vertexai
+
+    vertexai.init(project=VERTEXAI_PROJECT, location=VERTEXAI_LOCATION)
+    print(f"Vertex AI initialized with project: {VERTEXAI_PROJECT}, location: {VERTEXAI_LOCATION}")
+
+
+@lazy_resource
+def get_llm():
+    """
+    Builds the tool-bound LLM on first use. Vertex AI and LangChain are imported here
+    so that instances only serving the db functions never pay for them at cold start.
+    """
+    from langchain_google_vertexai import ChatVertexAI
+
+    from ai.ai_setup.graph_components import tools
 
-def initialize_llm():
     print("Initializing LLM and Langgraph workflow...")
     try:
-        # Initialize vertexai and LLM inside this function
-        # This function will be called from within the handler,
-        # so runtime environment variables should be available.
-        project_id = "well-meing"
-        location = "europe-west1"  # **Specify your function's region**
-
-        # It's often good practice to call vertexai.init() explicitly
-        # before using Vertex AI models, even if env vars are set.
-        vertexai.init(project=project_id, location=location)
-        print(f"Vertex AI initialized with project: {project_id}, location: {location}")
+        init_vertexai()
 
         llm = ChatVertexAI(model_name="gemini-2.0-flash-lite", temperature=0)
         print("ChatVertexAI initialized.")
@@ -33,8 +45,3 @@ def initialize_llm():
     except Exception as e:
         print(f"Error initializing LLM: {e}")
         raise
-
-
-llm = initialize_llm()
-
-
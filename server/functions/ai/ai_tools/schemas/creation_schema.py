@@ -4,6 +4,7 @@ from langchain_core.tools import InjectedToolCallId
 from langgraph.prebuilt import InjectedState
 from pydantic import BaseModel, Field, model_validator, ConfigDict
 
+from ai.auxiliary.context_cache import context_manager_from_state
 from ai.auxiliary.utils import generate_enum_docs, ContextInfoManager
 from ai.ui_schema.dispacher import validate_input
 from ai.ui_schema.schemas import InputTypeKeys
@@ -46,13 +47,15 @@ class Habit(BaseModel):
 
 class HabitCreation(BaseModel):
     creation: List[Habit] = Field(..., description="List of habits to be created")
+    last_action: bool = Field(default=False,
+                              description="True if this call completes the user's request and no other tool call is needed")
     state: Annotated[Dict, InjectedState] = Field(..., description="Context for the tool")
     tool_call_id: Annotated[str, InjectedToolCallId]
 
     @model_validator(mode="after")
     def validate_names(self) -> Self:
         context = self.state.get("context")
-        context_manager = ContextInfoManager.construct(**context)
+        context_manager = context_manager_from_state(context)
 
         for habit in self.creation:
             validate_habit_metric_names(habit.name, habit.metrics, context_manager)
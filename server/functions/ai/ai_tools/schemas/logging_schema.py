@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime
 from typing import Optional, Union, List, Dict, Annotated
 
@@ -7,11 +8,14 @@ from langchain_core.tools import InjectedToolCallId
 from langgraph.prebuilt import InjectedState
 from pydantic import BaseModel, Field, model_validator
 
+from ai.auxiliary.context_cache import context_manager_from_state
 from ai.auxiliary.utils import generate_enum_docs, ContextInfoManager
 from ai.ui_schema.dispacher import validate_input
 from ai.ui_schema.schemas import InputTypeKeys
 
 TIMEZONE = pytz.timezone('Europe/Rome')
+# dateparser builds its language and locale data lazily in shared caches, concurrent requests parse one at a time
+_dateparser_lock = threading.Lock()
 
 
 class Metric(BaseModel):
@@ -48,10 +52,11 @@ class LogEntry(BaseModel):
             self.timestamp = datetime.now(TIMEZONE).strftime("%Y-%m-%dT%H:%M:%S")
         else:
             # Parse the natural language expression
-            parsed_date = dateparser.parse(
-                self.timestamp,
-                settings={'TIMEZONE': 'Europe/Rome', 'RETURN_AS_TIMEZONE_AWARE': True}
-            )
+            with _dateparser_lock:
+                parsed_date = dateparser.parse(
+                    self.timestamp,
+                    settings={'TIMEZONE': 'Europe/Rome', 'RETURN_AS_TIMEZONE_AWARE': True}
+                )
             if parsed_date:
                 self.timestamp = parsed_date.astimezone(TIMEZONE).strftime("%Y-%m-%dT%H:%M:%S")
             else:
@@ -70,13 +75,15 @@ class LogEntry(BaseModel):
 
 class LoggingData(BaseModel):
     logging: List[LogEntry] = Field(..., description="List of logs")
+    last_action: bool = Field(default=False,
+                              description="True if this call completes the user's request and no other tool call is needed")
     state: Annotated[Dict, InjectedState] = Field(..., description="Context for the tool")
     tool_call_id: Annotated[str, InjectedToolCallId]
 
     @model_validator(mode='after')
     def validate_metrics(self):
         context = self.state.get("context")
-        context_manager = ContextInfoManager.construct(**context)
+        context_manager = context_manager_from_state(context)
 
         for i, log in enumerate(self.logging):
             if log.name not in context_manager.habits_names_set:
@@ -15,9 +15,9 @@ from ai.auxiliary.json_building import process_creation, process_logging
       description="Use this tool to create new habit(s) and their metric(s).",
       args_schema=HabitCreation)
 def create_habit_tool(tool_call_id: Annotated[str, InjectedToolCallId], creation: List[Habit],
-                      state: Annotated[Dict, InjectedState]) -> Command:
+                      state: Annotated[Dict, InjectedState], last_action: bool = False) -> Command:
     creation_dict = [habit.model_dump(mode='json') for habit in creation]
-    creation_out, updated_context = process_creation(creation_dict, state.get("out"), state.get("context"))
+    creation_out, updated_context = process_creation(creation_dict)
 
     return Command(
         update={
@@ -33,9 +33,9 @@ def create_habit_tool(tool_call_id: Annotated[str, InjectedToolCallId], creation
                   "If the habit is not present in the context create it first using create_habit tool",
       args_schema=LoggingData)
 def insert_habit_tool(tool_call_id: Annotated[str, InjectedToolCallId], logging: List[LogEntry],
-                      state: Annotated[Dict, InjectedState]) -> Command:
+                      state: Annotated[Dict, InjectedState], last_action: bool = False) -> Command:
     logging_dict = [data_point.model_dump() for data_point in logging]
-    logging_out, _ = process_logging(logging_dict, state.get("out"), state.get("context"))
+    logging_out = process_logging(logging_dict)
 
     return Command(
         update={
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from ai.auxiliary.json_keys import JsonKeys
+from ai.auxiliary.utils import ContextInfoManager
+
+# Distinct habit definitions kept per instance, a warm instance serves the same users over and over
+CONTEXT_CACHE_MAX_ENTRIES = 1024
+
+
+def habits_fingerprint(habits: dict) -> str:
+    """
+    Stable hash of the habit definitions, covering only what ContextInfoManager is built from:
+    the history of the habits and the order of the keys do not change it.
+    """
+    definitions = {
+        habit_name: {
+            JsonKeys.HABIT_DESCRIPTION.value: habit_data.get(JsonKeys.HABIT_DESCRIPTION.value, ""),
+            JsonKeys.METRICS.value: habit_data.get(JsonKeys.METRICS.value, {}),
+        }
+        for habit_name, habit_data in habits.items()
+    }
+    serialized = json.dumps(definitions, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ContextManagerCache:
+    """
+    Thread-safe LRU cache of ContextInfoManager instances keyed by the fingerprint of the habit definitions.
+    Entries depend on the definitions only, so users with the same habits share them,
+    and a user editing their habits gets a new entry. Cached managers are shared between requests
+    and must not be mutated: habits created during a request go to the graph state instead.
+    """
+
+    def __init__(self, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint: str) -> Optional[ContextInfoManager]:
+        with self._lock:
+            context_manager = self._entries.get(fingerprint)
+            if context_manager is not None:
+                self._entries.move_to_end(fingerprint)
+            return context_manager
+
+    def get_or_build(self, habits: dict) -> ContextInfoManager:
+        """Returns the manager of the given habit definitions, building it on a miss."""
+        fingerprint = habits_fingerprint(habits)
+        context_manager = self.get(fingerprint)
+        if context_manager is not None:
+            return context_manager
+
+        # Built outside the lock, two requests missing together build the same manager twice, harmlessly
+        context_manager = ContextInfoManager.from_context({JsonKeys.HABITS.value: habits})
+        context_manager.fingerprint = fingerprint
+        with self._lock:
+            self._entries[fingerprint] = context_manager
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return context_manager
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+context_cache = ContextManagerCache()
+
+
+def get_context_manager(context: dict) -> ContextInfoManager:
+    """Returns the (shared, read-only) manager of the habits of a speech request."""
+    return context_cache.get_or_build(context.get(JsonKeys.HABITS.value) or {})
+
+
+def context_manager_from_state(context: dict) -> ContextInfoManager:
+    """
+    Returns the manager of the context in the graph state. The cached one is reused while the context still
+    matches its fingerprint, once habits have been created in the request it is rebuilt from the state.
+    """
+    fingerprint = context.get("fingerprint")
+    if fingerprint is not None:
+        context_manager = context_cache.get(fingerprint)
+        if context_manager is not None:
+            return context_manager
+    return ContextInfoManager.construct(**context)
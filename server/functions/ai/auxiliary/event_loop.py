@@ -0,0 +1,40 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Coroutine, TypeVar
+
+from ai.auxiliary.lazy import lazy_resource
+
+T = TypeVar("T")
+
+# Threads of the loop running blocking calls (RTDB, tools), the asyncio default of a single vCPU would be 5
+ASYNC_EXECUTOR_WORKERS = 32
+
+
+@lazy_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop shared by the whole instance, running in a daemon thread.
+    Async clients (e.g. the gRPC channels of Vertex AI) are bound to the loop that created them,
+    so every request runs its coroutines on this loop, instead of a loop of its own per request,
+    and the in-flight LLM calls of all the requests are multiplexed on it.
+    """
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="async-io"))
+    threading.Thread(target=loop.run_forever, name="async-loop", daemon=True).start()
+    return loop
+
+
+def run_async(coroutine: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """
+    Runs a coroutine on the shared event loop from synchronous code (e.g. a request handler), waiting for its result.
+
+    Raises:
+        TimeoutError: If the coroutine did not complete in time, in which case it is cancelled.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
@@ -4,8 +4,12 @@ from ai.auxiliary.json_keys import ActionKeys, JsonKeys
 from ai.auxiliary.utils import ContextInfoManager
 
 
-def process_creation(creation_data: list[dict[str, Any]], state_out: Dict, state_context: Dict) -> (Dict, Dict):
-    context_manager = ContextInfoManager.construct(**state_context)
+# Helper function to process the creation data
+# Returns only what the call adds to the output and to the context, so that calls running in parallel never
+# write to the same state, and the graph reducers merge their results
+def process_creation(creation_data: list[dict[str, Any]]) -> (Dict, Dict):
+    state_out = {key.value: {} for key in ActionKeys}
+    context_manager = ContextInfoManager()
     for habit in creation_data:
         habit_name = habit[JsonKeys.HABIT_NAME.value]
         habit_dict = {
@@ -31,8 +35,8 @@ def process_creation(creation_data: list[dict[str, Any]], state_out: Dict, state
 
 
 # Helper function to process the logging data
-def process_logging(logging_data: list[dict[str, Any]], state_out: Dict, state_context: Dict) -> (Dict, Dict):
-    # context_manager = ContextInfoManager.construct(**state_context) #TODO ensure no context update is needed
+def process_logging(logging_data: list[dict[str, Any]]) -> Dict:
+    state_out = {key.value: {} for key in ActionKeys}
     for log in logging_data:
         habit_name = log[JsonKeys.HABIT_NAME.value]
         timestamp = log[JsonKeys.TIMESTAMP.value]
@@ -48,4 +52,4 @@ def process_logging(logging_data: list[dict[str, Any]], state_out: Dict, state_c
             JsonKeys.NOTES.value: notes,
             JsonKeys.METRICS.value: metrics
         })
-    return state_out, state_context
+    return state_out
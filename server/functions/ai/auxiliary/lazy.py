@@ -0,0 +1,46 @@
+import functools
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+_UNSET = object()
+
+
+class LazyResource(Generic[T]):
+    """
+    Thread-safe memoized accessor for expensive process-wide resources (LLM clients, compiled graphs).
+    The factory runs on first call only, so cold starts of instances that never use the resource stay cheap.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = _UNSET
+        functools.update_wrapper(self, factory)
+
+    def __call__(self) -> T:
+        # Fast path without locking once the resource has been built
+        value = self._value
+        if value is not _UNSET:
+            return value
+
+        with self._lock:
+            # Another thread may have built the resource while waiting on the lock
+            if self._value is _UNSET:
+                self._value = self._factory()
+            return self._value
+
+    @property
+    def initialized(self) -> bool:
+        return self._value is not _UNSET
+
+    def reset(self) -> None:
+        """Drops the memoized value, the next call rebuilds it"""
+        with self._lock:
+            self._value = _UNSET
+
+
+def lazy_resource(factory: Callable[[], T]) -> LazyResource[T]:
+    """Decorator turning a zero-argument factory into a lazily initialized, memoized accessor"""
+    return LazyResource(factory)
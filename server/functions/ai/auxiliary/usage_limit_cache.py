@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Users remembered per instance as over their token limit
+OVER_LIMIT_MAX_USERS = 1024
+# How long a user stays remembered, the usage counters only grow until they roll over at midnight
+OVER_LIMIT_TTL_SECONDS = 600
+
+
+class OverLimitCache:
+    """
+    Thread-safe LRU set of the users found over their daily token limit, so that their following requests
+    are refused before any model call. Entries expire after the TTL, and never outlive the day of the counters.
+    """
+
+    def __init__(self, max_users: int = OVER_LIMIT_MAX_USERS, ttl_seconds: float = OVER_LIMIT_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, user_id: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(user_id)
+            if expires_at is None:
+                return False
+            if time.time() >= expires_at:
+                del self._entries[user_id]
+                return False
+            return True
+
+    def add(self, user_id: str):
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        expires_at = min(now.timestamp() + self.ttl_seconds, midnight.timestamp())
+        with self._lock:
+            self._entries[user_id] = expires_at
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+over_limit_users = OverLimitCache()
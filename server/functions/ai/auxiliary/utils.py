@@ -1,5 +1,5 @@
 import json
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -22,6 +22,8 @@ class ContextInfoManager(BaseModel):
     habits_names_set: Set[str] = Field(default_factory=set)
     metrics_names_set: Set[Tuple[str, str]] = Field(default_factory=set)
     input_config_map: Dict[Tuple[str, str], Dict] = Field(default_factory=dict)
+    # Fingerprint of the habit definitions the manager was built from (see context_cache), None once habits are added
+    fingerprint: Optional[str] = None
 
     @staticmethod
     def format_metric(metric_name: str, metric_desc: str, input_type: str) -> dict[str, str]:
@@ -49,14 +51,15 @@ class ContextInfoManager(BaseModel):
         input_config_map = {}
         habits_dict = context.get(JsonKeys.HABITS.value, {})
 
-        for habit_name, habit_data in habits_dict.items():
+        # Sorted, so the same definitions always give the same descriptions, and the same prompt
+        for habit_name, habit_data in sorted(habits_dict.items()):
             habit_desc = habit_data.get(JsonKeys.HABIT_DESCRIPTION.value, "")
             metrics_dict = habit_data.get(JsonKeys.METRICS.value, {})
 
             formatted_metrics = []
             habits_names_set.add(habit_name)
 
-            for metric_name, metric_data in metrics_dict.items():
+            for metric_name, metric_data in sorted(metrics_dict.items()):
                 input_type = metric_data.get(JsonKeys.INPUT_TYPE.value)
                 metric_desc = metric_data.get(JsonKeys.METRIC_DESCRIPTION.value, "")
 
@@ -70,7 +73,8 @@ class ContextInfoManager(BaseModel):
 
                 input_config_map[(habit_name, metric_name)] = {
                     'input_type': input_type,
-                    'config': metric_data.get(JsonKeys.CONFIG.value, {})
+                    'config': metric_data.get(JsonKeys.CONFIG.value, {}),
+                    'description': metric_desc
                 }
 
             habit_description = cls.format_habit_description(habit_name, habit_desc, formatted_metrics)
@@ -88,6 +92,7 @@ class ContextInfoManager(BaseModel):
         metrics_dict = habit_data.get("metrics", {})
         formatted_metrics = []
         self.habits_names_set.add(habit_name)
+        self.fingerprint = None
 
         for metric_name, metric_data in metrics_dict.items():
             input_type = metric_data.get("input")
@@ -104,7 +109,8 @@ class ContextInfoManager(BaseModel):
             self.metrics_names_set.add((habit_name, metric_name))
             self.input_config_map[(habit_name, metric_name)] = {
                 'input_type': input_type,
-                'config': config or {}
+                'config': config or {},
+                'description': metric_desc
             }
 
         habit_description = self.format_habit_description(habit_name, habit_desc, formatted_metrics)
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from firebase_admin import db
+
+# Number of vectors kept in the in-memory tier
+MEMORY_MAX_ENTRIES = 4096
+# Root of the persistent tier, vectors are stored per user under embeddingCache/{user_id}/{key}
+PERSISTENT_ROOT = "embeddingCache"
+# Number of vectors kept per user in the persistent tier, one report build needs one per habit plus the query
+PERSISTENT_MAX_ENTRIES = 64
+
+
+def embedding_key(text: str, model_name: str) -> str:
+    """
+    Content address of an embedding: SHA-256 of the model name and the embedded text.
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def encode_vector(vector) -> str:
+    """
+    Packs a vector into a compact base64 string of float32 values.
+    """
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(encoded: str) -> np.ndarray:
+    """
+    Unpacks a vector packed by encode_vector into a float32 array.
+    """
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+
+class EmbeddingCache:
+    """
+    Two-tier content-addressed cache of text embeddings.
+    The memory tier is a process-wide LRU, the persistent tier is a Realtime Database node per user,
+    read once and written once per batch, so habit chunks that did not change are never embedded again.
+    The persistent tier only keeps the vectors of the last batch, at most PERSISTENT_MAX_ENTRIES of them,
+    so the entries of chunks that changed since are dropped and the node never grows.
+    Vectors are kept as float32 arrays (3 KB for 768 dimensions, against about 25 KB as a list of floats),
+    and converted to lists on the way out.
+    """
+
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_array(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def get(self, key: str) -> list[float] | None:
+        vector = self._get_array(key)
+        return None if vector is None else vector.tolist()
+
+    def put(self, key: str, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def embed(self, texts: list[str], model_name: str, embed_fn, user_id: str | None = None) -> list[list[float]]:
+        """
+        Returns the embeddings of the texts, calling embed_fn only for the texts missing from both tiers.
+
+        Args:
+            texts: The texts to embed.
+            model_name: Name of the embedding model, part of the cache key.
+            embed_fn: Function embedding a list of texts into a list of vectors.
+            user_id: Owner of the persistent tier entries, the persistent tier is skipped if None.
+
+        Returns:
+            A list of embedding vectors, one per text.
+        """
+        keys = [embedding_key(text, model_name) for text in texts]
+        vectors = {key: self._get_array(key) for key in keys}
+
+        # Fall back to the persistent tier for texts missing from memory
+        stored = {}
+        if user_id is not None and any(vector is None for vector in vectors.values()):
+            stored = db.reference(f"{PERSISTENT_ROOT}/{user_id}").get() or {}
+            for key, vector in vectors.items():
+                if vector is None and isinstance(stored.get(key), str):
+                    vectors[key] = decode_vector(stored[key])
+                    self.put(key, vectors[key])
+
+        # Embed the remaining texts in a single batch
+        missing = list(dict.fromkeys(key for key in keys if vectors[key] is None))
+        if missing:
+            missing_texts = [texts[keys.index(key)] for key in missing]
+            for key, vector in zip(missing, embed_fn(missing_texts)):
+                vectors[key] = np.asarray(vector, dtype=np.float32)
+                self.put(key, vectors[key])
+
+        # Keep the persistent tier in sync with the current texts, dropping stale entries
+        if user_id is not None:
+            self._persist(user_id, keys, vectors, stored)
+
+        return [vectors[key].tolist() for key in keys]
+
+    @staticmethod
+    def _persist(user_id: str, keys: list[str], vectors: dict, stored: dict):
+        """Replaces the persistent entries of the user with the last vectors of the batch, if they differ."""
+        reference = db.reference(f"{PERSISTENT_ROOT}/{user_id}")
+        kept = list(dict.fromkeys(keys))[-PERSISTENT_MAX_ENTRIES:]
+        # Served from memory only, the stored keys were not read yet
+        stored_keys = set(stored) if stored else set(reference.get(shallow=True) or {})
+        if stored_keys != set(kept):
+            reference.set({key: encode_vector(vectors[key]) for key in kept})
+
+
+embedding_cache = EmbeddingCache()
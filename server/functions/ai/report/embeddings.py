@@ -2,6 +2,21 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from vertexai.language_models import TextEmbeddingModel
 
+from ai.ai_setup.llm_setup import init_vertexai
+from ai.auxiliary.lazy import lazy_resource
+from ai.report.embedding_cache import embedding_cache
+
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+
+
+@lazy_resource
+def get_embedding_model() -> TextEmbeddingModel:
+    """
+    Process-wide embedding model, loaded on first use.
+    """
+    init_vertexai()
+    return TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
+
 
 # --- Embedding and Helper Functions ---
 
@@ -24,15 +39,240 @@ def format_seconds_to_hms(seconds):
     """
     return str(datetime.timedelta(seconds=int(seconds)))
 
+def _parse_time_column(time_strings: np.ndarray) -> np.ndarray | None:
+    """
+    Parses a column of zero-padded 'HH:MM:SS' strings into total seconds at once,
+    reading the digits straight from the code points of the column.
+    Returns None if any string has a different shape.
+    """
+    if time_strings.size == 0 or not (np.strings.str_len(time_strings) == 8).all():
+        return None
+
+    chars = time_strings.astype("U8").view(np.uint32).reshape(-1, 8).astype(np.int64)
+    if not ((chars[:, 2] == ord(":")) & (chars[:, 5] == ord(":"))).all():
+        return None
+
+    digits = chars[:, [0, 1, 3, 4, 6, 7]] - ord("0")
+    if ((digits < 0) | (digits > 9)).any():
+        return None
+
+    hours = digits[:, 0] * 10 + digits[:, 1]
+    minutes = digits[:, 2] * 10 + digits[:, 3]
+    seconds = digits[:, 4] * 10 + digits[:, 5]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def split_metric_values(values: list) -> tuple[np.ndarray, np.ndarray, list]:
+    """
+    Splits the history of a metric into numeric values, time values (in seconds) and other values,
+    following the same rules as float() and parse_time_string, but converting whole columns at once.
+    Columns that are neither fully numeric nor fully 'HH:MM:SS' are classified one distinct value at a time.
+    """
+    value_types = set(map(type, values))
+    if not value_types <= {int, float, bool, str, type(None)}:
+        # Unusual types keep the scalar parsing, so that the order of other values is preserved
+        return _split_metric_values_scalar(values)
+
+    numbers = [v for v in values if type(v) in (int, float, bool)] if value_types - {str, type(None)} else []
+    strings = [v for v in values if type(v) is str] if str in value_types else []
+
+    numeric = np.array(numbers, dtype=np.float64)
+    if not strings:
+        return numeric, np.empty(0, dtype=np.int64), []
+
+    string_column = np.array(strings, dtype=np.str_)
+
+    # Fast path: the whole string column is numeric
+    try:
+        return np.concatenate([numeric, string_column.astype(np.float64)]), np.empty(0, dtype=np.int64), []
+    except ValueError:
+        pass
+
+    # Fast path: the whole string column is made of times
+    times = _parse_time_column(string_column)
+    if times is not None:
+        return numeric, times, []
+
+    # Mixed or textual column: parse each distinct value once
+    kinds = {}
+    for v in dict.fromkeys(strings):
+        try:
+            kinds[v] = (0, float(v))
+            continue
+        except ValueError:
+            pass
+        seconds = parse_time_string(v)
+        kinds[v] = (1, seconds) if seconds is not None else (2, v)
+
+    classified = [kinds[v] for v in strings]
+    string_numbers = np.array([x for kind, x in classified if kind == 0], dtype=np.float64)
+    times = np.array([x for kind, x in classified if kind == 1], dtype=np.int64)
+    others = [x for kind, x in classified if kind == 2]
+    return np.concatenate([numeric, string_numbers]), times, others
+
+
+def _split_metric_values_scalar(values: list) -> tuple[np.ndarray, np.ndarray, list]:
+    """
+    Value by value version of split_metric_values, used when the columns cannot be converted at once.
+    """
+    numeric_values = []
+    time_values = []
+    non_numeric_values = []
+
+    for v in values:
+        if v is None:
+            continue
+
+        # Try to parse as float
+        try:
+            numeric_values.append(float(v))
+            continue
+        except (ValueError, TypeError):
+            pass
+
+        # Try to parse as time string
+        seconds = parse_time_string(str(v))
+        if seconds is not None:
+            time_values.append(seconds)
+        else:
+            non_numeric_values.append(v)
+
+    return np.array(numeric_values, dtype=np.float64), np.array(time_values, dtype=np.int64), non_numeric_values
+
+
+def summarize_metric_values(values: list) -> str | None:
+    """
+    Summarizes the history of a metric: average, min and max of numeric or time values,
+    otherwise the most recent distinct values.
+    """
+    numeric_values, time_values, non_numeric_values = split_metric_values(values)
+
+    if numeric_values.size:
+        if np.isnan(numeric_values).any():
+            # NaN ("nan" strings) makes numpy propagate it, while min() and max() skip it depending on its position
+            values_list = numeric_values.tolist()
+            return f"avg {numeric_values.mean():.2f}, min {min(values_list)}, max {max(values_list)}"
+        return f"avg {numeric_values.mean():.2f}, min {float(numeric_values.min())}, max {float(numeric_values.max())}"
+    if time_values.size:
+        return (
+            f"avg {format_seconds_to_hms(time_values.mean())}, "
+            f"min {format_seconds_to_hms(time_values.min())}, max {format_seconds_to_hms(time_values.max())}"
+        )
+    if non_numeric_values:
+        unique_values = list(dict.fromkeys(non_numeric_values))
+        return f"recent values: {', '.join(unique_values[-3:])}"
+    return None
+
+def summarize_history(history: list[dict]) -> tuple[str, str]:
+    """
+    Summarizes a list of history records of a habit.
+
+    Args:
+        history: The history records, each with its metrics and optional notes.
+
+    Returns:
+        The summary of each metric and the last few notes, as text.
+    """
+    # Gather the notes and one column of values per metric from the history.
+    notes_list = [notes for record in history if (notes := record.get("notes", ""))]
+    records_metrics = [record.get("metrics", {}) for record in history]
+    metric_names = dict.fromkeys(k for metrics in records_metrics for k in metrics)
+    metrics_accum = {
+        k: [metrics[k] for metrics in records_metrics if k in metrics]
+        for k in metric_names
+    }
+
+    # Calculate summary statistics (average, min, max) for each metric.
+    metric_summaries = []
+    for k, v_list in metrics_accum.items():
+        summary = summarize_metric_values(v_list)
+        if summary:
+            metric_summaries.append(f"{k}: {summary}")
+
+    metrics_summary = ", ".join(metric_summaries)
+
+    # Get the last few notes to provide recent context.
+    recent_notes = "; ".join(notes_list[-3:])  # last few notes
+
+    return metrics_summary, recent_notes
+
+
+def summarize_rollup(rollup: dict) -> tuple[str, str]:
+    """
+    Summarizes a habit from its rollup statistics, without reading its history.
+
+    Args:
+        rollup: The rollup of the habit, as maintained on submission writes.
+
+    Returns:
+        The summary of each metric and the last few notes, as text, in the same format as summarize_history.
+    """
+    metric_summaries = []
+    for k, metric in (rollup.get("metrics") or {}).items():
+        numeric = metric.get("numeric") or {}
+        time = metric.get("time") or {}
+
+        if numeric.get("count"):
+            metric_summaries.append(
+                f"{k}: avg {numeric['sum'] / numeric['count']:.2f}, min {float(numeric['min'])}, max {float(numeric['max'])}"
+            )
+        elif time.get("count"):
+            metric_summaries.append(
+                f"{k}: avg {format_seconds_to_hms(time['sum'] / time['count'])}, "
+                f"min {format_seconds_to_hms(time['min'])}, max {format_seconds_to_hms(time['max'])}"
+            )
+        else:
+            # Metrics without numeric or time values only keep their last values
+            values = [str(item.get("value")) for item in metric.get("last") or [] if item.get("value") is not None]
+            if values:
+                unique_values = list(dict.fromkeys(values))
+                metric_summaries.append(f"{k}: recent values: {', '.join(unique_values[-3:])}")
+
+    metrics_summary = ", ".join(metric_summaries)
+
+    # Get the last few notes to provide recent context.
+    recent_notes = "; ".join(str(item.get("value")) for item in (rollup.get("notes") or [])[-3:])
+
+    return metrics_summary, recent_notes
+
+
+def build_habit_chunk(habit_name: str, habit: dict, metrics_summary: str, recent_notes: str,
+                      window: str | None = None, extra_lines: list[str] | None = None) -> str:
+    """
+    Assembles the text chunk of a habit with all the relevant information.
+
+    Args:
+        habit_name: The name of the habit.
+        habit: The habit definition, providing goal and description.
+        metrics_summary: The summary of the metrics, as returned by summarize_history.
+        recent_notes: The last few notes, as returned by summarize_history.
+        window: An optional label of the time window the summary refers to.
+        extra_lines: Optional additional lines, such as trends.
+
+    Returns:
+        The text chunk.
+    """
+    lines = [
+        f"Habit: {habit_name}" + (f" ({window})" if window else ""),
+        f"Goal: {habit.get('goal', '')}",
+        f"Description: {habit.get('description', '')}",
+        f"Summary of metrics: {metrics_summary}",
+        *(extra_lines or []),
+        f"Recent notes: {recent_notes}",
+    ]
+    return "\n".join(lines)
+
+
 # This function processes raw user data to create summarized, structured text chunks for each habit.
 # These chunks are optimized for embedding and later retrieval.
 def extract_habit_chunks(user_data: dict) -> list[str]:
     """
     Takes user data, extracts habit information, and converts it into
     descriptive text chunks suitable for embedding.
+    Habits with a rollup are summarized from it instead of their history.
 
     Args:
-        user_data: A dictionary containing user habits and their history.
+        user_data: A dictionary containing user habits and their history or rollup.
 
     Returns:
         A list of strings, where each string is a summarized chunk of a habit's data.
@@ -41,121 +281,62 @@ def extract_habit_chunks(user_data: dict) -> list[str]:
     chunks = []
     # Loop through each habit in the user's data.
     for habit_name, habit in user_data.get("habits", {}).items():
-        goal = habit.get("goal", "")
-        desc = habit.get("description", "")
+        rollup = habit.get("rollup")
         history = habit.get("history", [])
 
-        # Skip habits that have no recorded history.
-        if not history:
+        if rollup:
+            metrics_summary, recent_notes = summarize_rollup(rollup)
+        elif history:
+            metrics_summary, recent_notes = summarize_history(history)
+        else:
+            # Skip habits that have no recorded history.
             continue
 
-        # Prepare to accumulate metrics and notes from the history.
-        metrics_accum = {}
-        notes_list = []
-
-        # Iterate through each historical record of the habit.
-        for record in history:
-            notes = record.get("notes", "")
-            for k, v in record.get("metrics", {}).items():
-                metrics_accum.setdefault(k, []).append(v)
-            if notes:
-                notes_list.append(notes)
-
-        # Calculate summary statistics (average, min, max) for each metric.
-        metric_summaries = []
-        for k, v_list in metrics_accum.items():
-            v_list = [v for v in v_list if v is not None]
-
-            numeric_values = []
-            time_values = []
-            non_numeric_values = []
-
-            for v in v_list:
-                # Try to parse as float
-                try:
-                    numeric_values.append(float(v))
-                    continue
-                except (ValueError, TypeError):
-                    pass
-
-                # Try to parse as time string
-                seconds = parse_time_string(str(v))
-                if seconds is not None:
-                    time_values.append(seconds)
-                else:
-                    non_numeric_values.append(v)
-
-            if numeric_values:
-                metric_summaries.append(
-                    f"{k}: avg {np.mean(numeric_values):.2f}, min {min(numeric_values)}, max {max(numeric_values)}"
-                )
-            elif time_values:
-                avg_sec = np.mean(time_values)
-                min_sec = min(time_values)
-                max_sec = max(time_values)
-                metric_summaries.append(
-                    f"{k}: avg {format_seconds_to_hms(avg_sec)}, min {format_seconds_to_hms(min_sec)}, max {format_seconds_to_hms(max_sec)}"
-                )
-            elif non_numeric_values:
-                unique_values = list(dict.fromkeys(non_numeric_values))
-                metric_summaries.append(
-                    f"{k}: recent values: {', '.join(unique_values[-3:])}"
-                )
-
-        metrics_summary = ", ".join(metric_summaries)
-
-        # Get the last few notes to provide recent context.
-        recent_notes = "; ".join(notes_list[-3:])  # last few notes
-
-        # Assemble the final text chunk with all the relevant information.
-        chunk = (
-            f"Habit: {habit_name}\n"
-            f"Goal: {goal}\n"
-            f"Description: {desc}\n"
-            f"Summary of metrics: {metrics_summary}\n"
-            f"Recent notes: {recent_notes}"
-        )
-        chunks.append(chunk)
+        chunks.append(build_habit_chunk(habit_name, habit, metrics_summary, recent_notes))
     return chunks
 
 
-def embed_chunks(chunks: list[str], model=None) -> list[list[float]]:
+def embed_texts(texts: list[str], user_id: str | None = None) -> list[list[float]]:
     """
-    Converts a list of text chunks into numerical embeddings using a pre-trained model.
+    Converts a list of texts into numerical embeddings with the process-wide model.
+    Texts already embedded are served from the embedding cache, and all the others
+    are embedded together in a single request.
 
     Args:
-        chunks: The list of text chunks to embed.
-        model: An optional pre-initialized embedding model.
+        texts: The list of texts (e.g. habit chunks and the retrieval query) to embed.
+        user_id: An optional user ID, enabling the persistent tier of the cache for that user.
 
     Returns:
-        A list of embedding vectors, where each vector corresponds to a chunk.
+        A list of embedding vectors, where each vector corresponds to a text.
     """
-    # Initialize the embedding model if one isn't provided.
-    if model is None:
-        model = TextEmbeddingModel.from_pretrained("text-embedding-004")
+    def embed(missing_texts: list[str]) -> list[list[float]]:
+        # Generate embeddings for the texts missing from the cache.
+        embeddings = get_embedding_model().get_embeddings(missing_texts)
 
-    # Generate embeddings for the provided text chunks.
-    embeddings = model.get_embeddings(chunks)
+        # Return the numerical values of the embeddings.
+        return [e.values for e in embeddings]
 
-    # Return the numerical values of the embeddings.
-    return [e.values for e in embeddings]
+    return embedding_cache.embed(texts, EMBEDDING_MODEL_NAME, embed, user_id=user_id)
 
-def get_top_chunks(query: str, chunks: list[str], chunk_embeddings: list[list[float]], embed_model, top_k: int = 3) -> list[str]:
+def get_top_chunks(query_embedding: list[float], chunks: list[str], chunk_embeddings: list[list[float]], top_k: int = 3) -> list[str]:
     """
     Finds the most relevant text chunks for a given query using cosine similarity.
 
     Args:
-        query: The input query string to find relevant chunks for.
+        query_embedding: The pre-computed embedding of the query to find relevant chunks for.
         chunks: The original list of text chunks.
         chunk_embeddings: The pre-computed embeddings for the chunks.
-        embed_model: The embedding model to use for the query.
         top_k: The number of top chunks to return.
 
     Returns:
         A list containing the top_k most relevant chunks.
     """
-    # Embed the query to get its vector representation.
-    query_embedding = np.array(embed_model.get_embeddings([query])[0].values).reshape(1, -1)
+    # Nothing to rank if the user has no habit with history.
+    if not chunks:
+        return []
+
+    # Reshape the query vector for the similarity computation.
+    query_embedding = np.array(query_embedding).reshape(1, -1)
 
     # Convert the list of chunk embeddings into a NumPy array for efficient computation.
     chunk_embeddings_array = np.array(chunk_embeddings)
@@ -0,0 +1,165 @@
+import bisect
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from ai.report.embeddings import summarize_history, summarize_rollup, build_habit_chunk, parse_time_string, \
+    format_seconds_to_hms
+
+TIMEZONE = ZoneInfo("Europe/Rome")
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+WINDOW_DAYS = 7
+
+LAST_WINDOW = f"last {WINDOW_DAYS} days"
+PREVIOUS_WINDOW = f"previous {WINDOW_DAYS} days"
+ALL_TIME_WINDOW = "all time"
+
+
+def history_start(now: datetime | None = None) -> str:
+    """
+    Returns the timestamp of the oldest record the windows need, i.e. the start of the previous window.
+    """
+    if now is None:
+        now = datetime.now(TIMEZONE).replace(tzinfo=None)
+    return (now - timedelta(days=2 * WINDOW_DAYS)).strftime(TIMESTAMP_FORMAT)
+
+
+def _timestamp(record: dict) -> str:
+    return str(record.get("timestamp") or "")
+
+
+def _numeric_value(value) -> float | None:
+    """
+    Converts a metric value to a number, reading 'HH:MM:SS' times as seconds.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return parse_time_string(str(value))
+
+
+def _format_value(value: float, is_time: bool) -> str:
+    return format_seconds_to_hms(value) if is_time else f"{value:.2f}"
+
+
+def metric_trends(previous: list[dict], last: list[dict], now: datetime) -> list[str]:
+    """
+    Compares the numeric and time metrics of the two most recent windows in a single pass.
+
+    Args:
+        previous: The records of the previous window, sorted by timestamp.
+        last: The records of the last window, sorted by timestamp.
+        now: The end of the last window.
+
+    Returns:
+        One description per metric with the change of the average and the daily slope over both windows.
+    """
+    series = {}
+    for in_previous, records in ((True, previous), (False, last)):
+        for record in records:
+            try:
+                day = (datetime.fromisoformat(_timestamp(record)).replace(tzinfo=None) - now).total_seconds() / 86400
+            except ValueError:
+                continue
+            for metric, raw_value in (record.get("metrics") or {}).items():
+                value = _numeric_value(raw_value)
+                if value is None:
+                    continue
+                entry = series.setdefault(metric, {"days": [], "values": [], "previous": 0, "time": False})
+                entry["days"].append(day)
+                entry["values"].append(value)
+                entry["previous"] += in_previous
+                entry["time"] = entry["time"] or (isinstance(raw_value, str) and ":" in raw_value)
+
+    trends = []
+    for metric, entry in series.items():
+        is_time = entry["time"]
+        values = np.array(entry["values"], dtype=np.float64)
+        previous_values, last_values = values[:entry["previous"]], values[entry["previous"]:]
+        if not last_values.size:
+            continue
+
+        parts = []
+        last_avg = last_values.mean()
+        if previous_values.size:
+            previous_avg = previous_values.mean()
+            change = f"avg {_format_value(previous_avg, is_time)} -> {_format_value(last_avg, is_time)}"
+            if previous_avg:
+                change += f" ({(last_avg - previous_avg) / abs(previous_avg) * 100:+.1f}%)"
+            parts.append(change)
+
+        days = np.array(entry["days"], dtype=np.float64)
+        if np.unique(days).size >= 2:
+            slope = np.polyfit(days, values, 1)[0]
+            parts.append(f"trend {slope / 60:+.1f} min/day" if is_time else f"trend {slope:+.2f}/day")
+
+        if parts:
+            trends.append(f"{metric}: {', '.join(parts)}")
+    return trends
+
+
+def extract_windowed_habit_chunks(user_data: dict, now: datetime | None = None) -> list[str]:
+    """
+    Converts user data into text chunks per habit and time window: the last 7 days with the trends
+    against the previous 7 days, the previous 7 days, and the whole history.
+    Records are sorted once and the windows are located by bisection, so the recent chunks only
+    touch recent records, while the all-time chunk is built from the habit rollup when available.
+
+    Args:
+        user_data: A dictionary containing user habits with their recent history and rollup.
+        now: The end of the last window, defaults to the current time.
+
+    Returns:
+        A list of strings, where each string is a summarized chunk of a habit's data in a window.
+    """
+    if now is None:
+        now = datetime.now(TIMEZONE).replace(tzinfo=None)
+    last_start = (now - timedelta(days=WINDOW_DAYS)).strftime(TIMESTAMP_FORMAT)
+    previous_start = history_start(now)
+
+    chunks = []
+    for habit_name, habit in user_data.get("habits", {}).items():
+        history = habit.get("history", [])
+        rollup = habit.get("rollup")
+
+        # Skip habits that have no recorded history.
+        if not history and not rollup:
+            continue
+
+        # ISO timestamps sort chronologically as strings
+        records = sorted(history, key=_timestamp)
+        previous_index = bisect.bisect_left(records, previous_start, key=_timestamp)
+        last_index = bisect.bisect_left(records, last_start, key=_timestamp, lo=previous_index)
+        previous, last = records[previous_index:last_index], records[last_index:]
+
+        if last:
+            metrics_summary, recent_notes = summarize_history(last)
+            extra_lines = [f"Entries: {len(last)} (previous {WINDOW_DAYS} days: {len(previous)})"]
+            trends = metric_trends(previous, last, now)
+            if trends:
+                extra_lines.append(f"Change vs previous {WINDOW_DAYS} days: {'; '.join(trends)}")
+            chunks.append(build_habit_chunk(habit_name, habit, metrics_summary, recent_notes,
+                                            LAST_WINDOW, extra_lines))
+
+        if previous:
+            metrics_summary, recent_notes = summarize_history(previous)
+            chunks.append(build_habit_chunk(habit_name, habit, metrics_summary, recent_notes,
+                                            PREVIOUS_WINDOW, [f"Entries: {len(previous)}"]))
+
+        # The all-time chunk comes from the rollup, maintained on every submission write
+        if rollup:
+            metrics_summary, recent_notes = summarize_rollup(rollup)
+            entries = rollup.get("count", 0)
+        elif previous_index == 0 and not previous:
+            # Without a rollup, the all-time chunk would repeat the last window if the whole history is recent
+            continue
+        else:
+            metrics_summary, recent_notes = summarize_history(records)
+            entries = len(records)
+
+        chunks.append(build_habit_chunk(habit_name, habit, metrics_summary, recent_notes,
+                                        ALL_TIME_WINDOW, [f"Entries: {entries}"]))
+    return chunks
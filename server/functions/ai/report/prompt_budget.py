@@ -0,0 +1,95 @@
+import math
+
+# Rough ratio of characters per token of Gemini models on English text, used instead of a tokenizer round trip
+CHARS_PER_TOKEN = 4
+# Tokens of user context (habit chunks and user info) sent with each report request
+REPORT_CONTEXT_TOKEN_BUDGET = 1500
+# Tokens of the bio, which is free text written by the user
+USER_BIO_TOKEN_BUDGET = 150
+
+NOTES_PREFIX = "\nRecent notes: "
+NOTES_SEPARATOR = "; "
+ELLIPSIS = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text from its length.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """
+    Cuts a text to the given number of tokens, marking the cut with an ellipsis.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= len(ELLIPSIS):
+        return ""
+    return text[:max_chars - len(ELLIPSIS)].rstrip() + ELLIPSIS
+
+
+def truncate_chunk_notes(chunk: str, max_tokens: int) -> str | None:
+    """
+    Fits a habit chunk into the given number of tokens by shortening its notes, the newest notes are kept first.
+
+    Args:
+        chunk: A habit chunk, whose last line holds the recent notes (see build_habit_chunk).
+        max_tokens: The number of tokens the chunk may take.
+
+    Returns:
+        The chunk with its notes shortened or removed, or None if it does not fit even without notes.
+    """
+    if estimate_tokens(chunk) <= max_tokens:
+        return chunk
+
+    head, prefix, notes = chunk.rpartition(NOTES_PREFIX)
+    if not prefix:
+        return None
+    available_chars = (max_tokens - estimate_tokens(head + prefix)) * CHARS_PER_TOKEN
+    if available_chars <= 0:
+        return head if estimate_tokens(head) <= max_tokens else None
+
+    # Keep whole notes from the newest one, then the tail of the next one if nothing fits whole
+    kept = []
+    for note in reversed(notes.split(NOTES_SEPARATOR)):
+        length = sum(len(item) + len(NOTES_SEPARATOR) for item in kept) + len(note)
+        if length <= available_chars:
+            kept.append(note)
+            continue
+        if not kept:
+            kept.append(truncate_text(note, available_chars // CHARS_PER_TOKEN))
+        break
+
+    kept = [note for note in kept if note]
+    if not kept:
+        return head
+    return head + prefix + NOTES_SEPARATOR.join(reversed(kept))
+
+
+def pack_chunks(ranked_chunks: list[str], budget: int = REPORT_CONTEXT_TOKEN_BUDGET) -> list[str]:
+    """
+    Packs the chunks into the token budget, in order of relevance.
+    A chunk that does not fit whole loses its oldest notes first, and is skipped if it does not fit at all,
+    so the notes of the most relevant habits are the last to go.
+
+    Args:
+        ranked_chunks: The habit chunks, the most relevant first.
+        budget: The number of tokens the packed chunks may take, separators included.
+
+    Returns:
+        The chunks that fit, in order of relevance.
+    """
+    packed = []
+    remaining = budget
+    for chunk in ranked_chunks:
+        # Chunks are joined by a blank line
+        separator_tokens = 1 if packed else 0
+        fitted = truncate_chunk_notes(chunk, remaining - separator_tokens)
+        if fitted is None:
+            continue
+        packed.append(fitted)
+        remaining -= estimate_tokens(fitted) + separator_tokens
+    return packed
@@ -4,14 +4,61 @@ from datetime import datetime, timedelta
 from firebase_admin import db
 from google.genai import types
 from pydantic import BaseModel
-from vertexai.language_models import TextEmbeddingModel
 
 from google import genai
 
-from ai.report.embeddings import extract_habit_chunks, embed_chunks, get_top_chunks
+from ai.auxiliary.lazy import lazy_resource
+from ai.report.embeddings import embed_texts, get_top_chunks
+from ai.report.habit_windows import extract_windowed_habit_chunks, history_start
+from ai.report.prompt_budget import REPORT_CONTEXT_TOKEN_BUDGET, USER_BIO_TOKEN_BUDGET, estimate_tokens, \
+    pack_chunks, truncate_text
+from ai.report.report_stream import ReportStreamParser
+from db.report_data import load_report_data
+from db.report_schedule import schedule_updates
+from db.rollups import get_rollups
+
+REPORT_MODEL = 'gemini-2.5-flash-preview-05-20'
+
+# The instruction is the same for every report, the user context is sent as the contents of the request.
+REPORT_SYSTEM_INSTRUCTION = """
+Generate a concise, engaging wellness report based on the user's recent habits and goals,
+described by the user info and habits context provided by the user.
+
+### Format and Style Guidelines:
+
+- **Title**:
+- Must summarize the main insight or change.
+- Max 50 characters.
+- Avoid generic phrases like "wellness journey", "progress", or "snapshot".
+- Do **not** include the user's name.
+- Be specific (e.g., "Sleep Hours Improved by 20%", "High Water Intake But Low Activity").
+
+- **Sections (Use Markdown and Apple Emojis for better readability)**:
+- **Overview**: A DETAILED summary of key trends using also bullet points.
+- **Insights**:
+    - Use 4-8 bullet points.
+- **Suggestions**:
+    - 4-8 actionable tips.
+    - Use simple sentences or bullet format.
+
+- **Tone**:
+- Friendly, professional, and supportive.
+- Use **bold** for important metrics or alerts.
+- Prefer short paragraphs or bullets over long text.
+- Important points should be bolded.
+
+- If data is missing, make helpful assumptions but mention them gently.
+- Don't repeat the title in the content.
+"""
+
+
+@lazy_resource
+def get_client() -> genai.Client:
+    """
+    Initializes the Generative AI client with project and location details on first use.
+    """
+    return genai.Client(vertexai=True, project='well-meing', location='us-central1')
 
-# Initialize the Generative AI client with project and location details.
-client = genai.Client(vertexai=True, project='well-meing', location='us-central1')
 
 # Defines the expected structure of the generated report using Pydantic for validation.
 class ReportStructure(BaseModel):
@@ -32,51 +79,60 @@ def save_report_to_db(timestamp, report, user_id):
         A dictionary indicating success or failure.
     """
     try:
-        # Create a database reference to the specific path for the new report.
-        report_ref = db.reference(f'users/{user_id}/reports/{timestamp}')
-
-        # Save the report data at that location.
-        report_ref.set(report)
-
         # Calculate the date for the next report (7 days from now, at midnight).
         next_week = (datetime.now() + timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
         next_report_date_str = next_week.isoformat()
 
-        # Update the 'newReportDate' field
-        user_ref = db.reference(f'users/{user_id}')
-        user_ref.update({"newReportDate": next_report_date_str})
+        # Save the report and update the 'newReportDate' field and its schedule index in a single write.
+        updates = {f'users/{user_id}/reports/{timestamp}': report}
+        updates.update(schedule_updates(user_id, next_report_date_str))
+        db.reference().update(updates)
 
         return {"success": True, "report_id": timestamp}
     except Exception as e:
         print("Error saving report to DB:", e)
         return {"success": False, "error": str(e)}
 
-def generate_structured_report(data, user_id):
+def load_user_report_data(user_id: str, habit_names=None) -> dict:
     """
-    Main function to generate a personalized wellness report for a user.
-    It extracts data, finds relevant context using embeddings, calls the Gemini API,
-    and saves the result to the database.
+    Loads the report data of a user from the database, reading only the history the time windows need.
 
     Args:
-        data: A dictionary containing the user's name, bio, and habits data.
         user_id: The unique identifier for the user.
+        habit_names: The habits to include in the report, all of them if None.
 
     Returns:
-        A dictionary containing the structured report (date, title, content).
-    
-    Raises:
-        RuntimeError: If saving the report to the database fails.
+        A dictionary containing the user's name, bio, and habits data.
     """
-    print("Received data:", data)
+    return load_report_data(user_id, history_start(), habit_names)
+
 
-    # Extract basic user information.
+def build_report_context(data, user_id=None) -> str:
+    """
+    Builds the user context of a report, bounded by the context token budget.
+    It extracts data and finds relevant context using embeddings.
+
+    Args:
+        data: A dictionary containing the user's name, bio, and habits data.
+        user_id: The unique identifier for the user, used to persist the chunk embeddings.
+
+    Returns:
+        The user context, sent as the contents of the request.
+    """
+    # Extract basic user information, cutting the bio to its share of the budget.
     user_name = data.get("name", "User")
-    user_bio = data.get("bio", "No bio provided")
+    user_bio = truncate_text(data.get("bio", "No bio provided"), USER_BIO_TOKEN_BUDGET)
+    user_info = f"Name: {user_name}\nBio: {user_bio}"
+
+    # Attach the stored rollups, so the all-time summaries do not need the whole history.
+    if user_id is not None:
+        habits = data.get("habits") or {}
+        missing = [habit_name for habit_name, habit in habits.items() if "rollup" not in habit]
+        for habit_name, rollup in get_rollups(user_id, missing).items():
+            habits[habit_name]["rollup"] = rollup
 
-    # Process user data into summarized chunks.
-    chunks = extract_habit_chunks(data)
-    embed_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-    chunk_embeddings = embed_chunks(chunks)
+    # Process user data into summarized chunks per habit and time window.
+    chunks = extract_windowed_habit_chunks(data)
 
     # Define a query to find the most relevant habit data from the past week.
     query = (
@@ -84,72 +140,57 @@ def generate_structured_report(data, user_id):
                 "(improvement, decline, or consistency) in the past week across all tracked metrics."
                 " Prioritize habits with user notes or significant metric changes."
             )
-    top_chunks = get_top_chunks(query, chunks, chunk_embeddings, embed_model)
-    history_summary = "\n\n".join(top_chunks)
 
-    context = {
-        "history_summary": history_summary,
-        "user_info": f"Name: {user_name}\nBio: {user_bio}"
-    }
+    # Embed the chunks and the query together, in one request for whatever is not cached.
+    ranked_chunks = []
+    if chunks:
+        embeddings = embed_texts(chunks + [query], user_id=user_id)
+        chunk_embeddings, query_embedding = embeddings[:-1], embeddings[-1]
+        ranked_chunks = get_top_chunks(query_embedding, chunks, chunk_embeddings, top_k=len(chunks))
 
-    # Make a request to the Gemini model to generate the report.
-    response = client.models.generate_content(
-        model='gemini-2.5-flash-preview-05-20',
-        contents='high',
-        config=types.GenerateContentConfig(
-            system_instruction = f"""
-                Generate a concise, engaging wellness report based on the user's recent habits and goals.
-
-                ### Format and Style Guidelines:
-
-                - **Title**:
-                - Must summarize the main insight or change.
-                - Max 50 characters.
-                - Avoid generic phrases like "wellness journey", "progress", or "snapshot".
-                - Do **not** include the user's name.
-                - Be specific (e.g., "Sleep Hours Improved by 20%", "High Water Intake But Low Activity").
-
-                - **Sections (Use Markdown and Apple Emojis for better readability)**:
-                - **Overview**: A DETAILED summary of key trends using also bullet points.
-                - **Insights**:
-                    - Use 4-8 bullet points.
-                - **Suggestions**:
-                    - 4-8 actionable tips.
-                    - Use simple sentences or bullet format.
-
-                - **Tone**:
-                - Friendly, professional, and supportive.
-                - Use **bold** for important metrics or alerts.
-                - Prefer short paragraphs or bullets over long text.
-                - Important points should be bolded.
-
-                - If data is missing, make helpful assumptions but mention them gently.
-                - Don't repeat the title in the content.
-
-                Use the following context:
-                {context.get("history_summary", "No detailed context provided.")},
-                {context.get("user_info", "No user info provided.")}
-                """,
-            max_output_tokens=10000,
-            temperature=0.3, # A lower temperature for more predictable and less creative output.
-            response_mime_type='application/json', # Instruct the model to return a JSON object.
-            response_schema=ReportStructure, # Enforce the Pydantic schema on the output.
-            safety_settings=[
-                types.SafetySetting(
-                    category='HARM_CATEGORY_UNSPECIFIED',
-                    threshold='BLOCK_ONLY_HIGH',
-                )
-            ]
-        ),
+    # Pack the most relevant chunks into what is left of the budget after the user info.
+    header = f"User info:\n{user_info}\n\nHabits context:\n"
+    history_summary = "\n\n".join(pack_chunks(ranked_chunks, REPORT_CONTEXT_TOKEN_BUDGET - estimate_tokens(header)))
+
+    return header + (history_summary or "No detailed context provided.")
+
+
+def build_report_config() -> types.GenerateContentConfig:
+    """
+    Builds the Gemini request configuration for the reports, identical for every user.
+
+    Returns:
+        The generation config, including the static system instruction.
+    """
+    return types.GenerateContentConfig(
+        system_instruction=REPORT_SYSTEM_INSTRUCTION,
+        max_output_tokens=10000,
+        temperature=0.3, # A lower temperature for more predictable and less creative output.
+        response_mime_type='application/json', # Instruct the model to return a JSON object.
+        response_schema=ReportStructure, # Enforce the Pydantic schema on the output.
+        safety_settings=[
+            types.SafetySetting(
+                category='HARM_CATEGORY_UNSPECIFIED',
+                threshold='BLOCK_ONLY_HIGH',
+            )
+        ]
     )
 
-    print("response candidate 0: " + response.candidates[0].content.parts[0].text)
 
-    # Extract the JSON string from the model's response.
-    candidate = response.candidates[0]
-    report_json_string = candidate.content.parts[0].text
-    report_data = json.loads(report_json_string)
+def finalize_report(report_data, user_id):
+    """
+    Saves the report returned by the model and builds the object returned to the client.
+
+    Args:
+        report_data: The report parsed from the model's JSON output.
+        user_id: The unique identifier for the user.
+
+    Returns:
+        A dictionary containing the structured report (date, title, content).
 
+    Raises:
+        RuntimeError: If saving the report to the database fails.
+    """
     # Get title and content from the parsed JSON.
     report_title = report_data.get('title', 'Untitled Report')
     report_content = report_data.get('content', 'No content provided.')
@@ -181,4 +222,76 @@ def generate_structured_report(data, user_id):
     # Optionally attach report ID to the return value
     # structured_report["report_id"] = save_result["report_id"]
 
-    return structured_report
\ No newline at end of file
+    return structured_report
+
+
+def generate_structured_report(data, user_id):
+    """
+    Main function to generate a personalized wellness report for a user.
+    It extracts data, finds relevant context using embeddings, calls the Gemini API,
+    and saves the result to the database.
+
+    Args:
+        data: A dictionary containing the user's name, bio, and habits data.
+        user_id: The unique identifier for the user.
+
+    Returns:
+        A dictionary containing the structured report (date, title, content).
+    
+    Raises:
+        RuntimeError: If saving the report to the database fails.
+    """
+    print("Received data:", data)
+
+    # Make a request to the Gemini model to generate the report.
+    response = get_client().models.generate_content(
+        model=REPORT_MODEL,
+        contents=build_report_context(data, user_id),
+        config=build_report_config(),
+    )
+
+    print("response candidate 0: " + response.candidates[0].content.parts[0].text)
+
+    # Extract the JSON string from the model's response.
+    candidate = response.candidates[0]
+    report_json_string = candidate.content.parts[0].text
+    report_data = json.loads(report_json_string)
+
+    return finalize_report(report_data, user_id)
+
+
+def generate_structured_report_stream(data, user_id):
+    """
+    Streaming variant of generate_structured_report.
+    Yields the title and content fragments as the model generates them,
+    then saves the assembled report and yields it as the final event.
+
+    Args:
+        data: A dictionary containing the user's name, bio, and habits data.
+        user_id: The unique identifier for the user.
+
+    Yields:
+        Dictionaries, either {"field": ..., "delta": ...} fragments or {"done": True, "report": ...} at the end.
+
+    Raises:
+        RuntimeError: If saving the report to the database fails.
+    """
+    parser = ReportStreamParser()
+    report_parts = []
+
+    # Stream the response of the Gemini model, forwarding the decoded fragments of each field.
+    for chunk in get_client().models.generate_content_stream(
+            model=REPORT_MODEL,
+            contents=build_report_context(data, user_id),
+            config=build_report_config(),
+    ):
+        text = chunk.text
+        if not text:
+            continue
+        report_parts.append(text)
+        for field, fragment in parser.feed(text):
+            yield {"field": field, "delta": fragment}
+
+    # Parse the assembled JSON and save it, as in the non streaming path.
+    report_data = json.loads("".join(report_parts))
+    yield {"done": True, "report": finalize_report(report_data, user_id)}
@@ -0,0 +1,158 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from google.genai import errors
+
+from ai.report.habit_windows import history_start
+from ai.report.report_llm import generate_structured_report, load_user_report_data
+from db.report_data import has_history_since
+from db.report_schedule import backfill_schedule, get_due_users, postpone_report, unschedule_report
+
+# Reports generated at the same time, bounding the load on Gemini
+REPORT_BATCH_WORKERS = 4
+# Users read from the schedule per batch
+REPORT_BATCH_SIZE = 20
+# Attempts per user when Gemini is rate limiting or unavailable
+REPORT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 60
+# Delay before a user whose report failed is tried again by a later run
+RETRY_DELAY = timedelta(hours=6)
+# Time after which no new report is started and no failed call is retried, leaving the reports in progress
+# the rest of the 540 seconds of a scheduled function to complete
+RUN_BUDGET_SECONDS = 420
+
+# HTTP status codes of the Gemini API worth retrying
+RETRYABLE_CODES = {429, 500, 503, 504}
+
+
+class RateLimitBackoff:
+    """
+    Exponential backoff with jitter shared by all the workers of a run:
+    when Gemini rate limits one request, every worker waits before sending the next one.
+    """
+
+    def __init__(self, base_seconds: float = BACKOFF_BASE_SECONDS, max_seconds: float = BACKOFF_MAX_SECONDS):
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the shared backoff has elapsed."""
+        with self._lock:
+            delay = self._not_before - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, attempt: int):
+        """Pushes the shared backoff forward after the given failed attempt (starting from 0)."""
+        delay = min(self.max_seconds, self.base_seconds * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + delay)
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, errors.APIError) and error.code in RETRYABLE_CODES
+
+
+def generate_user_report(user_id: str, backoff: RateLimitBackoff, max_attempts: int = REPORT_MAX_ATTEMPTS,
+                         deadline: float | None = None) -> dict:
+    """
+    Loads the user's data and generates their report, retrying the Gemini call while it is rate limited
+    and the deadline (a time.monotonic() value) has not passed.
+
+    Returns:
+        A dictionary containing the structured report (date, title, content),
+        or None without calling Gemini if the user has no history in the report windows.
+    """
+    data = load_user_report_data(user_id)
+    if not has_history_since(data, history_start()):
+        return None
+    for attempt in range(max_attempts):
+        backoff.wait()
+        try:
+            return generate_structured_report(data, user_id)
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_attempts - 1:
+                raise
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            logging.warning(f"Report of user {user_id} rate limited ({e}), retrying")
+            backoff.penalize(attempt)
+
+
+def generate_due_reports(now: datetime | None = None, max_workers: int = REPORT_BATCH_WORKERS,
+                         batch_size: int = REPORT_BATCH_SIZE, budget_seconds: float = RUN_BUDGET_SECONDS) -> dict:
+    """
+    Generates the reports of every user whose next report date has passed, in bounded parallel batches.
+    Each saved report moves its user out of the due range, and failed users are postponed, so a run
+    that stops early (time budget, crash) is resumed by the next one. Users without history in the report
+    windows are dropped from the schedule instead. It can also be called directly, e.g. from a local script
+    against the emulator.
+
+    Args:
+        now: Reports due up to this time are generated, defaults to the current time.
+        max_workers: Reports generated at the same time.
+        batch_size: Users read from the schedule per batch.
+        budget_seconds: Time after which no new report is started, users left are skipped until the next run.
+
+    Returns:
+        A dictionary with the number of generated, failed and skipped reports, and of idle users dropped.
+    """
+    if now is None:
+        now = datetime.now()
+    due_before = now.replace(microsecond=0).isoformat()
+    retry_date = (now + RETRY_DELAY).replace(microsecond=0).isoformat()
+
+    deadline = time.monotonic() + budget_seconds
+    backoff = RateLimitBackoff()
+    stats = {"generated": 0, "failed": 0, "skipped": 0, "idle": 0}
+
+    # Users scheduled before the index existed are only due once they are in it
+    try:
+        backfilled = backfill_schedule()
+        if backfilled:
+            logging.info(f"Added {backfilled} users to the report schedule")
+    except Exception:
+        logging.exception("Error backfilling the report schedule")
+    # Failed users that could not be postponed, which would otherwise come back in every batch
+    stuck = set()
+
+    def run_user_report(user_id: str) -> str:
+        # Checked per user, as a batch can take longer than the whole budget
+        if time.monotonic() >= deadline:
+            return "skipped"
+        if generate_user_report(user_id, backoff, deadline=deadline) is None:
+            unschedule_report(user_id)
+            return "idle"
+        return "generated"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while time.monotonic() < deadline:
+            user_ids = [
+                user_id for user_id in get_due_users(due_before, batch_size + len(stuck)) if user_id not in stuck
+            ]
+            if not user_ids:
+                break
+
+            futures = {user_id: executor.submit(run_user_report, user_id) for user_id in user_ids}
+            for user_id, future in futures.items():
+                try:
+                    stats[future.result()] += 1
+                except Exception:
+                    logging.exception(f"Error generating the scheduled report of user {user_id}")
+                    stats["failed"] += 1
+                    # Keep the user out of the following batches and runs for a while
+                    try:
+                        postpone_report(user_id, retry_date)
+                    except Exception:
+                        logging.exception(f"Error postponing the scheduled report of user {user_id}")
+                        stuck.add(user_id)
+
+    print("Scheduled reports:", stats)
+    return stats
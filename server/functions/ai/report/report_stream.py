@@ -0,0 +1,101 @@
+import json
+
+# Parser states
+_EXPECT_KEY = 0
+_IN_KEY = 1
+_EXPECT_VALUE = 2
+_IN_VALUE = 3
+_AFTER_VALUE = 4
+
+
+class ReportStreamParser:
+    """
+    Incremental parser for the flat JSON object streamed by the model (e.g. {"title": "...", "content": "..."}).
+    Text chunks are fed as they arrive, and the decoded fragments of each string field are returned
+    as soon as they are complete, so they can be forwarded to the client before the JSON is closed.
+    """
+
+    def __init__(self):
+        self.state = _EXPECT_KEY
+        self.key = []
+        self.current_field = None
+        self.escape = None
+        self.pending_surrogate = None
+
+    def feed(self, text: str) -> list[tuple[str, str]]:
+        """
+        Consumes a chunk of the streamed JSON text.
+
+        Returns:
+            A list of (field, fragment) tuples with the string content decoded in this chunk.
+        """
+        fragments = []
+        buffer = []
+
+        for char in text:
+            if self.state == _EXPECT_KEY:
+                if char == '"':
+                    self.key = []
+                    self.state = _IN_KEY
+
+            elif self.state == _IN_KEY:
+                if char == '"':
+                    self.current_field = "".join(self.key)
+                    self.state = _EXPECT_VALUE
+                else:
+                    self.key.append(char)
+
+            elif self.state == _EXPECT_VALUE:
+                if char == '"':
+                    self.state = _IN_VALUE
+                elif char not in ' \t\r\n:':
+                    # Non-string values are not streamed
+                    self.state = _AFTER_VALUE
+
+            elif self.state == _IN_VALUE:
+                if self.escape is not None:
+                    self.escape += char
+                    if self._escape_complete():
+                        buffer.append(self._decode_escape())
+                        self.escape = None
+                elif char == '\\':
+                    self.escape = char
+                elif char == '"':
+                    self._flush(buffer, fragments)
+                    self.state = _AFTER_VALUE
+                else:
+                    buffer.append(char)
+
+            elif self.state == _AFTER_VALUE:
+                if char == ',':
+                    self.state = _EXPECT_KEY
+
+        if self.state == _IN_VALUE:
+            self._flush(buffer, fragments)
+        return fragments
+
+    def _escape_complete(self) -> bool:
+        if len(self.escape) < 2:
+            return False
+        if self.escape[1] == 'u':
+            return len(self.escape) == 6
+        return True
+
+    def _decode_escape(self) -> str:
+        decoded = json.loads(f'"{self.escape}"')
+
+        # Surrogate pairs arrive as two consecutive escapes, keep the high half until the low one
+        if '\ud800' <= decoded <= '\udbff':
+            self.pending_surrogate = decoded
+            return ""
+        if self.pending_surrogate is not None:
+            high, self.pending_surrogate = self.pending_surrogate, None
+            if '\udc00' <= decoded <= '\udfff':
+                return (high + decoded).encode('utf-16', 'surrogatepass').decode('utf-16')
+        return decoded
+
+    def _flush(self, buffer: list[str], fragments: list[tuple[str, str]]):
+        fragment = "".join(buffer)
+        buffer.clear()
+        if fragment:
+            fragments.append((self.current_field, fragment))
@@ -0,0 +1,234 @@
+"""
+In-memory stand-in for the Realtime Database used by the tests, patched over firebase_admin.db.reference.
+It covers the calls made by the db modules: shallow and etag reads, ordered queries, set, multi-path update
+with server-side increments, and transactions with the same optimistic compare-and-set retries as the SDK,
+so concurrent transactions really conflict and retry. Given the database rules, ordered queries on
+paths without a matching ".indexOn" fail like the real database does.
+"""
+import copy
+import hashlib
+import json
+import random
+import threading
+import time
+from unittest import mock
+
+from firebase_admin import db, exceptions
+
+# Same number of attempts as firebase_admin.db.Reference.transaction
+TRANSACTION_MAX_RETRIES = 25
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+def _etag(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _order_key(value):
+    # Ordering of the database: null, false, true, numbers, strings, objects
+    if value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 1, value
+    if isinstance(value, (int, float)):
+        return 2, value
+    if isinstance(value, str):
+        return 3, value
+    return 4, 0
+
+
+def _prune(value):
+    # The database does not store empty objects
+    if isinstance(value, dict):
+        value = {key: pruned for key, child in value.items() if (pruned := _prune(child)) is not None}
+        return value or None
+    return value
+
+
+class FakeDatabase:
+
+    def __init__(self, data: dict | None = None, rules: dict | None = None, latency: float = 0.0):
+        """
+        Args:
+            data: Initial content of the database.
+            rules: Database rules (as in database.rules.json), enabling the index checks of ordered queries.
+            latency: Maximum random delay of every operation, in seconds, to interleave concurrent requests.
+        """
+        self.data = copy.deepcopy(data) or {}
+        self.rules = rules
+        self.latency = latency
+        self.operations = []
+        self._lock = threading.Lock()
+
+    def reference(self, path: str = "/") -> "FakeReference":
+        return FakeReference(self, _segments(path))
+
+    def patch(self):
+        """Patches firebase_admin.db.reference for the duration of a with block."""
+        return mock.patch.object(db, "reference", self.reference)
+
+    def get(self, path: str):
+        """Returns a copy of the value at the given path."""
+        with self._lock:
+            return copy.deepcopy(self._read(_segments(path)))
+
+    # Internal helpers, called with the lock held
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(random.uniform(0, self.latency))
+
+    def _read(self, segments):
+        node = self.data
+        for segment in segments:
+            if not isinstance(node, dict) or segment not in node:
+                return None
+            node = node[segment]
+        return node
+
+    def _write(self, segments, value):
+        value = _prune(copy.deepcopy(value))
+        node = self.data
+        if not segments:
+            self.data = value if isinstance(value, dict) else {}
+            return
+        for segment in segments[:-1]:
+            if not isinstance(node.get(segment), dict):
+                node[segment] = {}
+            node = node[segment]
+        if value is None:
+            node.pop(segments[-1], None)
+        else:
+            node[segments[-1]] = value
+        # Drop the parents left empty
+        self.data = _prune(self.data) or {}
+
+    def _check_index(self, segments, index: str):
+        if self.rules is None:
+            return
+        node = self.rules.get("rules", {})
+        for segment in segments:
+            wildcard = next((key for key in node if key.startswith("$")), None) if isinstance(node, dict) else None
+            node = node.get(segment, node.get(wildcard)) if isinstance(node, dict) else None
+            if node is None:
+                break
+        indexed = node.get(".indexOn", []) if isinstance(node, dict) else []
+        if index not in ([indexed] if isinstance(indexed, str) else indexed):
+            path = "/" + "/".join(segments)
+            raise exceptions.InvalidArgumentError(
+                f'Index not defined, add ".indexOn": "{index}", for path "{path}", to the rules')
+
+
+class FakeReference:
+
+    def __init__(self, database: FakeDatabase, segments: list[str], query: dict | None = None):
+        self._database = database
+        self._segments = segments
+        self._query = query or {}
+
+    @property
+    def path(self) -> str:
+        return "/" + "/".join(self._segments)
+
+    @property
+    def key(self):
+        return self._segments[-1] if self._segments else None
+
+    def child(self, path: str) -> "FakeReference":
+        return FakeReference(self._database, self._segments + _segments(path))
+
+    # Queries
+
+    def _with(self, **query) -> "FakeReference":
+        return FakeReference(self._database, self._segments, {**self._query, **query})
+
+    def order_by_child(self, path: str) -> "FakeReference":
+        return self._with(order=path)
+
+    def order_by_value(self) -> "FakeReference":
+        return self._with(order=".value")
+
+    def start_at(self, value) -> "FakeReference":
+        return self._with(start=value)
+
+    def end_at(self, value) -> "FakeReference":
+        return self._with(end=value)
+
+    def limit_to_first(self, limit: int) -> "FakeReference":
+        return self._with(limit=limit)
+
+    def _apply_query(self, value):
+        order = self._query.get("order")
+        self._database._check_index(self._segments, order)
+        if not isinstance(value, dict):
+            return None
+
+        def ordered_value(child):
+            if order == ".value":
+                return child
+            return child.get(order) if isinstance(child, dict) else None
+
+        items = sorted(value.items(), key=lambda item: (_order_key(ordered_value(item[1])), item[0]))
+        if "start" in self._query:
+            start = _order_key(self._query["start"])
+            items = [item for item in items if _order_key(ordered_value(item[1])) >= start]
+        if "end" in self._query:
+            end = _order_key(self._query["end"])
+            items = [item for item in items if _order_key(ordered_value(item[1])) <= end]
+        if "limit" in self._query:
+            items = items[:self._query["limit"]]
+        return dict(items) or None
+
+    # Operations
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        self._database._delay()
+        with self._database._lock:
+            self._database.operations.append(("get", self.path))
+            value = copy.deepcopy(self._database._read(self._segments))
+        if self._query:
+            value = self._apply_query(value)
+        if shallow and isinstance(value, dict):
+            value = {key: True if isinstance(child, dict) else child for key, child in value.items()}
+        return (value, _etag(value)) if etag else value
+
+    def set(self, value):
+        self._database._delay()
+        with self._database._lock:
+            self._database.operations.append(("set", self.path))
+            self._database._write(self._segments, value)
+
+    def delete(self):
+        self.set(None)
+
+    def update(self, value: dict):
+        self._database._delay()
+        with self._database._lock:
+            self._database.operations.append(("update", self.path))
+            for path, child in value.items():
+                segments = self._segments + _segments(path)
+                if isinstance(child, dict) and ".sv" in child:
+                    child = (self._database._read(segments) or 0) + child[".sv"]["increment"]
+                self._database._write(segments, child)
+
+    def set_if_unchanged(self, expected_etag: str, value):
+        self._database._delay()
+        with self._database._lock:
+            self._database.operations.append(("set_if_unchanged", self.path))
+            current = copy.deepcopy(self._database._read(self._segments))
+            if _etag(current) != expected_etag:
+                return False, current, _etag(current)
+            self._database._write(self._segments, value)
+            return True, value, _etag(value)
+
+    def transaction(self, transaction_update):
+        data, etag = self.get(etag=True)
+        for _ in range(TRANSACTION_MAX_RETRIES):
+            new_data = transaction_update(data)
+            success, data, etag = self.set_if_unchanged(etag, new_data)
+            if success:
+                return new_data
+        raise db.TransactionAbortedError("Transaction aborted after failed retries.")
@@ -0,0 +1,182 @@
+"""
+Load test of process_speech: drives concurrent requests of several users through the whole function
+(fast path, graph, tools, output validation) against a stubbed LLM, and checks that every response only
+holds the habits and values of its own request and that every user is charged for their own requests only.
+Authentication, the usage counters and the LLM are stubbed, so it runs without Firebase or Vertex AI.
+
+    python -m ai.test.speech_load --requests 200 --concurrency 40 --db-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from flask import Request
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from werkzeug.test import EnvironBuilder
+
+from ai.ai_functions import process_speech
+from db.usage import TOKENS_KEY
+
+# Usage reported by the stub for each model call
+STUB_TOKENS_PER_CALL = 15
+STUB_MODEL_NAME = "gemini-2.0-flash-lite"
+
+
+class StubLLM:
+    """
+    Stateless stand-in for the chat model, shared by all the requests like the real one. The speech of each
+    request carries its index ("journal{i} entry token{i}"), which the stub answers with tool calls touching only
+    that request's habits: odd requests log their journal, even ones also create a habit and log it in the same turn.
+    The last call of the turn sets last_action, so every request ends after its action tools.
+    """
+
+    def __init__(self, max_latency: float):
+        self.max_latency = max_latency
+        self._ids = iter(range(sys.maxsize))
+        self._lock = threading.Lock()
+
+    def _call_id(self) -> str:
+        with self._lock:
+            return f"call_{next(self._ids)}"
+
+    def _tool_calls(self, index: int) -> list:
+        journal_log = {"timestamp": "", "name": f"journal{index}", "metrics": [
+            {"metric_name": "entry", "value": f"token{index}"}]}
+        if index % 2:
+            return [{"name": "insert_habit_data", "args": {"logging": [journal_log], "last_action": True}}]
+
+        habit = {"name": f"new{index}", "metrics": [{"name": "count", "input": "slider"}]}
+        new_log = {"timestamp": "", "name": f"new{index}", "metrics": [{"metric_name": "count", "value": index}]}
+        return [
+            {"name": "create_habit", "args": {"creation": [habit]}},
+            {"name": "insert_habit_data", "args": {"logging": [journal_log, new_log], "last_action": True}},
+        ]
+
+    def _respond(self, messages) -> AIMessage:
+        speech = next(message.content for message in messages if isinstance(message, HumanMessage))
+        index = int(speech.split()[-1].removeprefix("token"))
+
+        if any(isinstance(message, ToolMessage) for message in messages):
+            calls = [{"name": "final_answer", "args": {"answer": "done"}}]
+        else:
+            calls = self._tool_calls(index)
+        return AIMessage(
+            content="",
+            tool_calls=[{**call, "id": self._call_id()} for call in calls],
+            usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": STUB_TOKENS_PER_CALL},
+            response_metadata={"model_name": STUB_MODEL_NAME},
+        )
+
+    def invoke(self, messages, config=None):
+        time.sleep(random.uniform(0, self.max_latency))
+        return self._respond(messages)
+
+    async def ainvoke(self, messages, config=None):
+        await asyncio.sleep(random.uniform(0, self.max_latency))
+        return self._respond(messages)
+
+
+def build_request(index: int, users: int) -> Request:
+    body = {
+        # A text metric is never handled by the fast path, so every request goes through the graph
+        "speech": f"journal{index} entry token{index}",
+        "habits": {f"journal{index}": {"description": "Daily journal", "metrics": {"entry": {"input": "text"}}}},
+    }
+    environ = EnvironBuilder(method="POST", json=body,
+                             headers={"Authorization": f"Bearer user{index % users}"}).get_environ()
+    return Request(environ)
+
+
+def check_response(index: int, response) -> list[str]:
+    """Returns the isolation errors of the response of the given request."""
+    if response.status_code != 200:
+        return [f"request {index}: status {response.status_code} {response.get_data(as_text=True)}"]
+
+    out = json.loads(response.get_data(as_text=True))
+    expected_logging = {f"journal{index}"} | (set() if index % 2 else {f"new{index}"})
+    expected_creation = set() if index % 2 else {f"new{index}"}
+    errors = []
+    if set(out["logging"]) != expected_logging:
+        errors.append(f"request {index}: logged {sorted(out['logging'])}")
+    if set(out["creation"]) != expected_creation:
+        errors.append(f"request {index}: created {sorted(out['creation'])}")
+
+    journal = out["logging"].get(f"journal{index}") or [{}]
+    if len(journal) != 1 or journal[0].get("metrics") != {"entry": f"token{index}"}:
+        errors.append(f"request {index}: journal entries {journal}")
+    if not index % 2:
+        entries = out["logging"].get(f"new{index}") or [{}]
+        if len(entries) != 1 or entries[0].get("metrics") != {"count": index}:
+            errors.append(f"request {index}: new habit entries {entries}")
+    return errors
+
+
+def run_load_test(requests: int, concurrency: int, users: int, max_latency: float, db_latency: float) -> bool:
+    charged = Counter()
+    charged_lock = threading.Lock()
+
+    def get_usage(user_id):
+        time.sleep(db_latency)
+        return {TOKENS_KEY: 0}
+
+    def add_tokens(user_id, tokens):
+        time.sleep(db_latency)
+        with charged_lock:
+            charged[user_id] += tokens
+
+    def timed_request(index):
+        request = build_request(index, users)
+        request_started = time.monotonic()
+        response = process_speech(request)
+        return response, time.monotonic() - request_started
+
+    llm = StubLLM(max_latency)
+    with mock.patch("ai.ai_functions.get_authenticated_user_id",
+                    side_effect=lambda request: request.headers["Authorization"].removeprefix("Bearer ")), \
+            mock.patch("ai.ai_functions.get_usage", side_effect=get_usage), \
+            mock.patch("ai.ai_setup.graph_components.add_tokens", side_effect=add_tokens), \
+            mock.patch("ai.ai_setup.graph_logic.get_llm", return_value=llm), \
+            mock.patch("builtins.print"):
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses, latencies = zip(*executor.map(timed_request, range(requests)))
+        elapsed = time.monotonic() - started
+
+    errors = [error for index, response in enumerate(responses) for error in check_response(index, response)]
+
+    # Every request makes one model call, ending after its action tools
+    expected_charged = Counter()
+    for index in range(requests):
+        expected_charged[f"user{index % users}"] += STUB_TOKENS_PER_CALL
+    if charged != expected_charged:
+        errors.append(f"charged tokens {dict(charged)}, expected {dict(expected_charged)}")
+
+    for error in errors[:20]:
+        print(error)
+    print(f"{requests} requests, {concurrency} concurrent, {users} users: "
+          f"{elapsed:.2f}s ({requests / elapsed:.1f} req/s), "
+          f"mean latency {sum(latencies) / requests * 1000:.0f} ms, {len(errors)} errors")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--max-latency", type=float, default=0.05, help="Maximum stub LLM latency in seconds")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Latency of the stub usage reads and writes")
+    args = parser.parse_args()
+    passed = run_load_test(args.requests, args.concurrency, args.users, args.max_latency, args.db_latency)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
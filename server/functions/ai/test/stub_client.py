@@ -0,0 +1,41 @@
+import json
+
+from google.genai import types
+
+STUB_REPORT = {"title": "Stub Report", "content": "Report generated by the local stub client."}
+
+
+class _StubModels:
+    """In-memory stand-in for client.models, answering every request with a fixed report and recording it."""
+
+    def __init__(self, report: dict):
+        self.report = report
+        self.requests = []
+
+    def generate_content(self, model, contents, config=None):
+        self.requests.append({"model": model, "contents": contents, "config": config})
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(
+                role="model", parts=[types.Part(text=json.dumps(self.report))],
+            ))]
+        )
+
+    def generate_content_stream(self, model, contents, config=None):
+        self.requests.append({"model": model, "contents": contents, "config": config})
+        text = json.dumps(self.report)
+        for i in range(0, len(text), 16):
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(
+                    role="model", parts=[types.Part(text=text[i:i + 16])],
+                ))]
+            )
+
+
+class StubClient:
+    """
+    Local stand-in for genai.Client covering the calls made by the report path, injected by the tests
+    in place of report_llm.get_client, so reports can be exercised without Vertex AI.
+    """
+
+    def __init__(self, report: dict | None = None):
+        self.models = _StubModels(report or STUB_REPORT)
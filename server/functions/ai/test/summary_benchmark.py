@@ -0,0 +1,145 @@
+"""
+Benchmark of the metric summaries of the report (ai.report.embeddings.summarize_history) on synthetic histories,
+against the per-record implementation it replaced, checking that both produce the same summaries.
+
+    python -m ai.test.summary_benchmark --rows 10000 30000 100000
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from ai.report.embeddings import format_seconds_to_hms, parse_time_string, summarize_history
+
+HABITS = 10
+
+
+def summarize_history_per_record(history: list[dict]) -> tuple[str, str]:
+    """The summaries as computed before the vectorization, one record and one value at a time."""
+    metrics_accum = {}
+    notes_list = []
+    for record in history:
+        notes = record.get("notes", "")
+        for k, v in record.get("metrics", {}).items():
+            metrics_accum.setdefault(k, []).append(v)
+        if notes:
+            notes_list.append(notes)
+
+    metric_summaries = []
+    for k, v_list in metrics_accum.items():
+        v_list = [v for v in v_list if v is not None]
+
+        numeric_values = []
+        time_values = []
+        non_numeric_values = []
+
+        for v in v_list:
+            try:
+                numeric_values.append(float(v))
+                continue
+            except (ValueError, TypeError):
+                pass
+
+            seconds = parse_time_string(str(v))
+            if seconds is not None:
+                time_values.append(seconds)
+            else:
+                non_numeric_values.append(v)
+
+        if numeric_values:
+            metric_summaries.append(
+                f"{k}: avg {np.mean(numeric_values):.2f}, min {min(numeric_values)}, max {max(numeric_values)}"
+            )
+        elif time_values:
+            avg_sec = np.mean(time_values)
+            min_sec = min(time_values)
+            max_sec = max(time_values)
+            metric_summaries.append(
+                f"{k}: avg {format_seconds_to_hms(avg_sec)}, min {format_seconds_to_hms(min_sec)}, "
+                f"max {format_seconds_to_hms(max_sec)}"
+            )
+        elif non_numeric_values:
+            unique_values = list(dict.fromkeys(non_numeric_values))
+            metric_summaries.append(f"{k}: recent values: {', '.join(unique_values[-3:])}")
+
+    return ", ".join(metric_summaries), "; ".join(notes_list[-3:])
+
+
+def random_time(rng: random.Random) -> str:
+    return f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+
+
+# Value generators of the metric columns found in real histories, the mixed ones included
+METRIC_VALUES = {
+    "slider": lambda rng: rng.randrange(0, 100),
+    "float slider": lambda rng: round(rng.uniform(0, 10), 2),
+    "numeric text": lambda rng: str(rng.randrange(0, 50)),
+    "time": random_time,
+    "rating": lambda rng: rng.randrange(1, 6),
+    "form": lambda rng: rng.choice(["low", "medium", "high"]),
+    "text": lambda rng: rng.choice(["fine", "tired", "great day", "busy"]),
+    "mixed": lambda rng: rng.choice([rng.randrange(10), str(rng.randrange(10)), random_time(rng), "n/a", None]),
+    "unpadded time": lambda rng: f"{rng.randrange(3)}:{rng.randrange(60)}:{rng.randrange(60)}",
+}
+
+
+def synthetic_history(rows: int, metric_kinds: list[str], seed: int = 0) -> list[dict]:
+    """Generates a history of the given number of records, with one metric per kind and occasional notes."""
+    rng = random.Random(seed)
+    history = []
+    for _ in range(rows):
+        metrics = {kind: METRIC_VALUES[kind](rng) for kind in metric_kinds if rng.random() > 0.05}
+        record = {"timestamp": "2025-01-01T10:00:00", "metrics": metrics}
+        if rng.random() < 0.2:
+            record["notes"] = rng.choice(["slept badly", "good run", "rainy", "felt strong"])
+        history.append(record)
+    return history
+
+
+def synthetic_user_histories(rows: int, seed: int = 0) -> list[list[dict]]:
+    """Splits the rows across HABITS habits, each tracking two or three kinds of metrics."""
+    rng = random.Random(seed)
+    kinds = list(METRIC_VALUES)
+    return [
+        synthetic_history(rows // HABITS, rng.sample(kinds, rng.randint(2, 3)), seed=seed + habit)
+        for habit in range(HABITS)
+    ]
+
+
+def best_time(function, histories: list[list[dict]], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for history in histories:
+            function(history)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run_benchmark(rows_list: list[int], repeat: int) -> bool:
+    matches = True
+    print(f"{'rows':>8} {'per record':>12} {'vectorized':>12} {'speedup':>8}  same output")
+    for rows in rows_list:
+        histories = synthetic_user_histories(rows)
+        same = all(summarize_history(history) == summarize_history_per_record(history) for history in histories)
+        matches &= same
+        per_record = best_time(summarize_history_per_record, histories, repeat)
+        vectorized = best_time(summarize_history, histories, repeat)
+        print(f"{rows:>8} {per_record * 1000:>10.1f}ms {vectorized * 1000:>10.1f}ms "
+              f"{per_record / vectorized:>7.1f}x  {same}")
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 30000, 100000],
+                        help="Total history rows of the user, split across the habits")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.rows, args.repeat) else 1)
+
+
+if __name__ == "__main__":
+    main()
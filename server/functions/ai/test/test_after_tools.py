@@ -0,0 +1,35 @@
+"""
+Tests of the routing after the tool calls of the graph (ai.ai_setup.graph_components.after_tools):
+the run only ends early when the model flagged the last action and every call succeeded.
+"""
+import unittest
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from ai.ai_setup.graph_components import after_tools
+
+
+def turn(*calls: tuple[str, dict], status: str = "success") -> dict:
+    tool_calls = [{"name": name, "args": args, "id": f"call_{index}"} for index, (name, args) in enumerate(calls)]
+    tool_messages = [ToolMessage(content="ok", tool_call_id=call["id"], status=status) for call in tool_calls]
+    return {"messages": [AIMessage(content="", tool_calls=tool_calls), *tool_messages]}
+
+
+class AfterToolsTest(unittest.TestCase):
+
+    def test_last_action_ends_the_run(self):
+        state = turn(("insert_habit_data", {"last_action": True}))
+        self.assertEqual(after_tools(state), "__end__")
+
+    def test_creation_and_logging_without_last_action_continue(self):
+        state = turn(("create_habit", {}), ("insert_habit_data", {"last_action": False}))
+        self.assertEqual(after_tools(state), "assistant")
+        self.assertEqual(after_tools(turn(("create_habit", {}), ("insert_habit_data", {}))), "assistant")
+
+    def test_failed_calls_go_back_to_the_model(self):
+        state = turn(("insert_habit_data", {"last_action": True}), status="error")
+        self.assertEqual(after_tools(state), "assistant")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Tests of the access rules of the deployment (database.rules.json), evaluated with the cascading semantics of the
+Realtime Database: the paths the iOS client reads and writes directly must stay open to their owner, while the
+data only the functions write (usage, versions, rollups, schedule and caches) must not be writable by clients.
+"""
+import re
+import unittest
+from types import SimpleNamespace
+
+from ai.test.test_report_data import load_rules
+
+# Expressions of the rules, translated to Python
+EXPRESSION_TOKENS = {"===": "==", "!==": "!=", "&&": " and ", "||": " or ", "null": "None", "true": "True",
+                     "false": "False"}
+
+
+def evaluate(expression, variables: dict, auth) -> bool:
+    if isinstance(expression, bool):
+        return expression
+    python = re.sub(r"===|!==|&&|\|\||\bnull\b|\btrue\b|\bfalse\b", lambda match: EXPRESSION_TOKENS[match[0]],
+                    expression)
+    python = re.sub(r"\$\w+", lambda match: repr(variables[match[0]]), python)
+    return bool(eval(python, {"__builtins__": {}}, {"auth": auth}))
+
+
+def allowed(rules: dict, access: str, path: str, uid: str | None) -> bool:
+    """
+    Whether a client signed in as uid (None if signed out) may read or write the node at the path.
+    Grants cascade: access is allowed if any rule from the root down to the node allows it.
+    """
+    auth = None if uid is None else SimpleNamespace(uid=uid)
+    node, variables = rules["rules"], {}
+    for segment in [None] + path.strip("/").split("/"):
+        if segment is not None:
+            # Literal children take precedence over the wildcard
+            wildcard = next((key for key in node if key.startswith("$")), None)
+            if segment in node:
+                node = node[segment]
+            elif wildcard is not None:
+                variables[wildcard] = segment
+                node = node[wildcard]
+            else:
+                return False
+        if access in node and evaluate(node[access], variables, auth):
+            return True
+    return False
+
+
+class DatabaseRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = load_rules()
+
+    def test_client_paths(self):
+        # Request.swift reads the whole user node of the signed-in user
+        self.assertTrue(allowed(self.rules, ".read", "users/alice", "alice"))
+        self.assertTrue(allowed(self.rules, ".read", "users/alice/habits/run/history", "alice"))
+        self.assertTrue(allowed(self.rules, ".write", "users/alice/email", "alice"))
+        # The debug public login of LoginView.swift, signed out
+        self.assertTrue(allowed(self.rules, ".read", "users/publicData", None))
+        self.assertTrue(allowed(self.rules, ".write", "users/publicData/email", None))
+
+    def test_other_users_are_denied(self):
+        for access in (".read", ".write"):
+            with self.subTest(access=access):
+                self.assertFalse(allowed(self.rules, access, "users/alice", "bob"))
+                self.assertFalse(allowed(self.rules, access, "users/alice/email", None))
+
+    def test_server_owned_paths_are_not_client_writable(self):
+        for path in ["users/alice", "users/alice/usage", "users/alice/habitsVersion", "users/alice/habits",
+                     "users/alice/habits/run/history/id", "users/alice/newReportDate", "users/publicData/usage",
+                     "rollups/alice/run", "reportSchedule/alice", "embeddingCache/alice"]:
+            with self.subTest(path=path):
+                self.assertFalse(allowed(self.rules, ".write", path, "alice"))
+
+    def test_server_only_nodes_are_not_readable(self):
+        for path in ["rollups/alice", "reportSchedule", "embeddingCache/alice"]:
+            with self.subTest(path=path):
+                self.assertFalse(allowed(self.rules, ".read", path, "alice"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Tests of the persistent tier of the embedding cache (ai.report.embedding_cache): each user keeps only the
+vectors of their last batch, capped in number, whether the batch was served from memory or not.
+"""
+import unittest
+from unittest import mock
+
+from ai.report import embedding_cache as cache_module
+from ai.report.embedding_cache import PERSISTENT_ROOT, EmbeddingCache
+from ai.test.fake_rtdb import FakeDatabase
+
+MODEL = "model"
+
+
+def embed_fn(texts: list[str]) -> list[list[float]]:
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+class PersistentEmbeddingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase()
+        patcher = self.database.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = EmbeddingCache()
+
+    def stored(self) -> dict:
+        return self.database.get(f"{PERSISTENT_ROOT}/user") or {}
+
+    def test_changed_chunks_are_dropped(self):
+        for day in range(10):
+            texts = [f"running day {day}", "water", "query"]
+            self.cache.embed(texts, MODEL, embed_fn, user_id="user")
+            self.assertEqual(len(self.stored()), 3)
+
+    def test_stale_entries_are_dropped_when_served_from_memory(self):
+        self.cache.embed(["running", "water", "query"], MODEL, embed_fn, user_id="user")
+        # Every text of the next batch is in memory, but the stored entry of "running" is stale
+        self.cache.embed(["water", "query"], MODEL, embed_fn, user_id="user")
+        self.assertEqual(len(self.stored()), 2)
+
+        # A batch equal to the stored one writes nothing
+        self.database.operations.clear()
+        self.cache.embed(["water", "query"], MODEL, embed_fn, user_id="user")
+        self.assertNotIn("set", [operation for operation, _ in self.database.operations])
+
+    def test_entries_per_user_are_capped(self):
+        texts = [f"chunk {index}" for index in range(20)]
+        with mock.patch.object(cache_module, "PERSISTENT_MAX_ENTRIES", 8):
+            vectors = self.cache.embed(texts, MODEL, embed_fn, user_id="user")
+        self.assertEqual(len(vectors), 20)
+        self.assertEqual(len(self.stored()), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests of the shared fan-out pool (db.fanout): results keep the order of the operations, and fan-outs nested
+in pool operations still overlap their round trips without ever deadlocking a saturated pool.
+"""
+import time
+import unittest
+
+from db.fanout import FANOUT_MAX_WORKERS, map_all, run_all
+
+ROUND_TRIP_SECONDS = 0.05
+
+
+def round_trip(value):
+    time.sleep(ROUND_TRIP_SECONDS)
+    return value
+
+
+class FanoutTest(unittest.TestCase):
+
+    def test_results_keep_the_order_of_the_operations(self):
+        self.assertEqual(map_all(round_trip, range(40)), list(range(40)))
+
+    def test_first_exception_in_order_is_raised(self):
+        def fail(value):
+            round_trip(value)
+            if value in (3, 7):
+                raise ValueError(value)
+            return value
+
+        with self.assertRaisesRegex(ValueError, "3"):
+            map_all(fail, range(10))
+
+    def test_nested_fan_out_uses_the_pool(self):
+        # As create_submission reading the habit definitions, whose projections fan out again
+        started = time.perf_counter()
+        _, nested = run_all([lambda: round_trip(None), lambda: map_all(round_trip, range(8))])
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(nested, list(range(8)))
+        self.assertLess(elapsed, 4 * ROUND_TRIP_SECONDS)
+
+    def test_nested_fan_outs_do_not_deadlock_a_saturated_pool(self):
+        outer = 4 * FANOUT_MAX_WORKERS
+        results = map_all(lambda value: map_all(round_trip, range(value % 5 + 2)), range(outer), timeout=10)
+        self.assertEqual(results, [list(range(value % 5 + 2)) for value in range(outer)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Tests of the deterministic fast path of the speech processing (ai.ai_setup.fast_path): slider values given
+in a unit are only logged when the metric is measured in that unit, otherwise the utterance goes to the graph,
+as do intentions, commands and values in unknown units.
+"""
+import unittest
+
+from ai.ai_setup.fast_path import parse_simple_logging
+from ai.auxiliary.utils import ContextInfoManager
+
+HABITS = {
+    "Running": {"description": "Outdoor runs", "metrics": {
+        "Distance": {"input": "slider", "description": "Kilometers run", "config": {"min": 0, "max": 100}},
+    }},
+    "Water": {"description": "Hydration", "metrics": {
+        "Glasses": {"input": "slider", "description": "Glasses drunk", "config": {"min": 0, "max": 20}},
+    }},
+    "Meditation": {"description": "", "metrics": {
+        "Duration": {"input": "slider", "description": "Minutes of meditation", "config": {"min": 0, "max": 120}},
+    }},
+}
+
+
+class FastPathUnitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context_manager = ContextInfoManager.from_context({"habits": HABITS})
+
+    def logged(self, speech: str):
+        output = parse_simple_logging(speech, self.context_manager)
+        if output is None:
+            return None
+        (habit_name, [submission]), = output["logging"].items()
+        (metric_name, value), = submission["metrics"].items()
+        return habit_name, metric_name, value
+
+    def test_values_in_the_unit_of_the_metric(self):
+        self.assertEqual(self.logged("running 5 km"), ("Running", "Distance", 5))
+        self.assertEqual(self.logged("running 5 kilometers"), ("Running", "Distance", 5))
+        self.assertEqual(self.logged("meditation 15 minutes"), ("Meditation", "Duration", 15))
+        self.assertEqual(self.logged("I drank 2 glasses of water"), ("Water", "Glasses", 2))
+
+    def test_values_without_unit(self):
+        self.assertEqual(self.logged("water 3"), ("Water", "Glasses", 3))
+
+    def test_values_in_another_unit_go_to_the_graph(self):
+        for speech in ["I went running for 30 minutes", "running 5 miles", "water 1.5 liters", "meditation 1 hour"]:
+            with self.subTest(speech=speech):
+                self.assertIsNone(self.logged(speech))
+
+    def test_values_in_unknown_units_go_to_the_graph(self):
+        for speech in ["I drank 2 bottles of water", "water 3 times", "running 5 laps"]:
+            with self.subTest(speech=speech):
+                self.assertIsNone(self.logged(speech))
+
+    def test_intentions_and_commands_go_to_the_graph(self):
+        for speech in [
+            "my goal is to drink 8 glasses of water", "I want to drink 8 glasses of water",
+            "I should drink 8 glasses of water", "remind me to drink 2 glasses of water",
+            "I will go running 10 km", "I'll go running 10 km", "I'm going to run 10 km of running",
+            "delete water 3", "change water to 3", "set water to 3", "voglio bere 8 bicchieri di water",
+        ]:
+            with self.subTest(speech=speech):
+                self.assertIsNone(self.logged(speech))
+
+
+if __name__ == "__main__":
+    unittest.main()
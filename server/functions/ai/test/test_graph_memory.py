@@ -0,0 +1,66 @@
+"""
+Memory regression test of the habit graph (ai.ai_setup.graph_logic.run_graph): thousands of requests against the
+stub LLM of the load test must not leave their messages or states behind in the instance, e.g. in a checkpointer.
+"""
+import gc
+import tracemalloc
+import unittest
+import warnings
+from unittest import mock
+
+from ai.ai_setup.graph_logic import run_graph
+from ai.auxiliary.context_cache import ContextManagerCache
+from ai.test.speech_load import StubLLM
+
+WARMUP_REQUESTS = 100
+REQUESTS = 2000
+# Every request has its own habits, so the bounded cache of their managers is kept small enough to fill in the warmup
+CONTEXT_CACHE_ENTRIES = 16
+# Growth allowed over all the requests, a retained state costs about 20 KB per request
+MAX_GROWTH_BYTES = 2 * 1024 * 1024
+
+
+def graph_data(index: int) -> dict:
+    return {
+        "speech": f"journal{index} entry token{index}",
+        "habits": {f"journal{index}": {"description": "Daily journal", "metrics": {"entry": {"input": "text"}}}},
+        "user_id": f"user{index % 8}",
+    }
+
+
+class GraphMemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        for patcher in (
+            mock.patch("ai.ai_setup.graph_logic.get_llm", return_value=StubLLM(max_latency=0)),
+            mock.patch("ai.auxiliary.context_cache.context_cache", ContextManagerCache(CONTEXT_CACHE_ENTRIES)),
+            # Plain functions, as mocks would record every call
+            mock.patch("ai.ai_setup.graph_logic.update_db_token_count", lambda total_tokens, user_id: None),
+            mock.patch("builtins.print", lambda *args, **kwargs: None),
+            # The warnings recorded by the test runner would grow with the requests too
+            warnings.catch_warnings(),
+        ):
+            patcher.__enter__()
+            self.addCleanup(patcher.__exit__, None, None, None)
+        warnings.simplefilter("ignore", DeprecationWarning)
+
+    def test_requests_do_not_retain_memory(self):
+        # Lazy initializations (graph, schemas, caches) happen during the warmup
+        for index in range(WARMUP_REQUESTS):
+            run_graph(graph_data(index))
+
+        gc.collect()
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        before = tracemalloc.get_traced_memory()[0]
+        for index in range(WARMUP_REQUESTS, WARMUP_REQUESTS + REQUESTS):
+            response = run_graph(graph_data(index))
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - before
+
+        self.assertIn(f"journal{index}", response["out"]["logging"])
+        self.assertLess(growth, MAX_GROWTH_BYTES, f"{growth / REQUESTS:.0f} bytes retained per request")
+
+
+if __name__ == "__main__":
+    unittest.main()
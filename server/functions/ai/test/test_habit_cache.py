@@ -0,0 +1,69 @@
+"""
+Tests of the habit definitions cache (db.habit_cache): verified entries are served without any read
+for the check interval, then a single read of the version counter keeps them, and mutations refetch them.
+"""
+import unittest
+from unittest import mock
+
+from ai.test.fake_rtdb import FakeDatabase
+from db import habit_cache
+from db.habit_cache import HABITS_VERSION_KEY, commit_habit_changes, get_habit_definitions
+
+HABIT = {"description": "Running", "metrics": {"distance": {"input": "slider"}}}
+
+
+class HabitCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase({"users": {"user": {
+            HABITS_VERSION_KEY: 1,
+            "habits": {"running": {**HABIT, "history": {"a": {"timestamp": "2025-01-01T00:00:00"}}}},
+        }}})
+        self.clock = 1000.0
+        for patcher in (
+            self.database.patch(),
+            mock.patch.object(habit_cache.time, "monotonic", side_effect=lambda: self.clock),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        habit_cache.habit_cache.clear()
+        self.addCleanup(habit_cache.habit_cache.clear)
+
+    def reads(self) -> list:
+        operations = [path for operation, path in self.database.operations if operation == "get"]
+        self.database.operations.clear()
+        return operations
+
+    def test_verified_entries_are_served_without_reads(self):
+        self.assertEqual(get_habit_definitions("user"), {"running": HABIT})
+        self.reads()
+
+        self.clock += habit_cache.VERSION_CHECK_SECONDS / 2
+        self.assertEqual(get_habit_definitions("user"), {"running": HABIT})
+        self.assertEqual(self.reads(), [])
+
+    def test_version_is_checked_after_the_interval(self):
+        get_habit_definitions("user")
+        self.reads()
+
+        self.clock += habit_cache.VERSION_CHECK_SECONDS + 1
+        self.assertEqual(get_habit_definitions("user"), {"running": HABIT})
+        self.assertEqual(self.reads(), [f"/users/user/{HABITS_VERSION_KEY}"])
+        # The check renews the trust of the entry
+        get_habit_definitions("user")
+        self.assertEqual(self.reads(), [])
+
+        # A mutation by another instance is seen at the next check
+        self.database.reference(f"users/user/{HABITS_VERSION_KEY}").set(2)
+        self.database.reference("users/user/habits/running/description").set("Trail running")
+        self.clock += habit_cache.VERSION_CHECK_SECONDS + 1
+        self.assertEqual(get_habit_definitions("user")["running"]["description"], "Trail running")
+
+    def test_local_mutations_are_seen_at_once(self):
+        get_habit_definitions("user")
+        commit_habit_changes("user", {"running/description": "Trail running"})
+        self.assertEqual(get_habit_definitions("user")["running"]["description"], "Trail running")
+
+
+if __name__ == "__main__":
+    unittest.main()
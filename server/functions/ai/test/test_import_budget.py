@@ -0,0 +1,55 @@
+"""
+Import budget of the function entry points: the CRUD endpoints and the entry point of the deployment
+must not import the AI stack at cold start, it is built on first use (see ai.auxiliary.lazy).
+Each import runs in a fresh interpreter, so the modules loaded by other tests do not count.
+"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Top-level packages only the LLM, the graph and the reports need
+HEAVY_PACKAGES = {
+    "langchain",
+    "langchain_core",
+    "langchain_google_vertexai",
+    "langgraph",
+    "vertexai",
+    "sklearn",
+    "numpy",
+}
+# Submodules of shared namespaces (google.*) that belong to the AI stack
+HEAVY_MODULE_PREFIXES = ("google.genai", "google.cloud.aiplatform")
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def imported_modules(module: str) -> set[str]:
+    """Imports the module in a fresh interpreter and returns the names of all the modules it loaded."""
+    script = f"import json, sys\nimport {module}\nprint(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=FUNCTIONS_DIR, capture_output=True, text=True,
+                            timeout=120)
+    if result.returncode != 0:
+        raise AssertionError(f"Importing {module} failed:\n{result.stderr}")
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+
+def heavy_modules(modules: set[str]) -> list[str]:
+    return sorted(
+        name for name in modules
+        if name.split(".")[0] in HEAVY_PACKAGES or name.startswith(HEAVY_MODULE_PREFIXES)
+    )
+
+
+class ImportBudgetTest(unittest.TestCase):
+
+    def test_db_functions_do_not_import_ai_stack(self):
+        self.assertEqual(heavy_modules(imported_modules("db.db_functions")), [])
+
+    def test_entry_point_does_not_import_ai_stack(self):
+        self.assertEqual(heavy_modules(imported_modules("main")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
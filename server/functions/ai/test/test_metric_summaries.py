@@ -0,0 +1,43 @@
+"""
+The vectorized metric summaries must match the per-record implementation they replaced (see summary_benchmark).
+"""
+import random
+import unittest
+
+from ai.report.embeddings import summarize_history
+from ai.test.summary_benchmark import METRIC_VALUES, summarize_history_per_record, synthetic_history
+
+
+class MetricSummariesTest(unittest.TestCase):
+
+    def assertSameSummaries(self, history: list[dict]):
+        self.assertEqual(summarize_history(history), summarize_history_per_record(history))
+
+    def test_each_kind_of_metric(self):
+        for kind in METRIC_VALUES:
+            with self.subTest(kind=kind):
+                self.assertSameSummaries(synthetic_history(500, [kind], seed=len(kind)))
+
+    def test_random_combinations(self):
+        rng = random.Random(7)
+        kinds = list(METRIC_VALUES)
+        for seed in range(200):
+            history = synthetic_history(rng.randint(1, 60), rng.sample(kinds, rng.randint(1, 4)), seed=seed)
+            with self.subTest(seed=seed):
+                self.assertSameSummaries(history)
+
+    def test_edge_values(self):
+        values = [None, True, False, 0, -1.5, "1e3", " 7 ", "nan", "inf", "24:00:00", "1:02:03", "ab:cd:ef",
+                  "12:30", "", "x"]
+        for value in values:
+            with self.subTest(value=value):
+                self.assertSameSummaries([{"metrics": {"m": value}}, {"metrics": {"m": value}, "notes": "n"}])
+        self.assertSameSummaries([{"metrics": {"m": value}} for value in values])
+
+    def test_empty_history(self):
+        self.assertSameSummaries([])
+        self.assertSameSummaries([{"metrics": {}}, {"notes": "only notes"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Tests of the ordered queries of the reports against the database rules of the deployment (database.rules.json):
+each query must be indexed, and must fall back to a filtered read when it is rejected.
+"""
+import json
+import os
+import unittest
+
+from ai.test.fake_rtdb import FakeDatabase
+from db.report_data import get_recent_history
+from db.report_schedule import get_due_users
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "database.rules.json")
+
+HISTORY = {
+    "a": {"timestamp": "2025-01-03T09:00:00", "metrics": {"m": 3}},
+    "b": {"timestamp": "2025-01-01T09:00:00", "metrics": {"m": 1}},
+    "c": {"timestamp": "2025-01-05T09:00:00", "metrics": {"m": 5}},
+    "d": {"timestamp": "2025-01-04T09:00:00", "metrics": {"m": 4}},
+    "e": {"metrics": {"m": 0}},
+}
+DATA = {
+    "users": {"user": {"habits": {"habit": {"history": HISTORY}}}},
+    "reportSchedule": {"late": "2025-01-02T00:00:00", "later": "2025-01-01T00:00:00", "future": "2025-02-01T00:00:00"},
+}
+
+
+def load_rules() -> dict:
+    with open(RULES_PATH) as rules:
+        return json.load(rules)
+
+
+class ReportQueriesTest(unittest.TestCase):
+
+    def query(self, rules: dict | None):
+        database = FakeDatabase(DATA, rules=rules)
+        with database.patch():
+            return get_recent_history("user", "habit", "2025-01-03T00:00:00"), database.operations
+
+    def test_recent_history_is_indexed(self):
+        history, operations = self.query(load_rules())
+        self.assertEqual([record["metrics"]["m"] for record in history], [3, 4, 5])
+        self.assertEqual(len(operations), 1)
+
+    def test_recent_history_without_index_falls_back(self):
+        history, operations = self.query({"rules": {}})
+        self.assertEqual(history, self.query(load_rules())[0])
+        self.assertEqual(len(operations), 2)
+
+    def test_due_users_are_indexed(self):
+        with FakeDatabase(DATA, rules=load_rules()).patch():
+            self.assertEqual(get_due_users("2025-01-10T00:00:00", limit=10), ["later", "late"])
+            self.assertEqual(get_due_users("2025-01-10T00:00:00", limit=1), ["later"])
+
+    def test_due_users_without_index_fall_back(self):
+        with FakeDatabase(DATA, rules={"rules": {}}).patch():
+            self.assertEqual(get_due_users("2025-01-10T00:00:00", limit=10), ["later", "late"])
+            self.assertEqual(get_due_users("2025-01-10T00:00:00", limit=1), ["later"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests of the report generation path (ai.report.report_llm) against the stub Gemini client: the report is built
+from the user context with the static instruction inline, then saved together with the next report date, both
+by the plain and by the streaming variant.
+"""
+import unittest
+from unittest import mock
+
+from ai.report import report_llm
+from ai.test.fake_rtdb import FakeDatabase
+from ai.test.stub_client import STUB_REPORT, StubClient
+from db.report_schedule import REPORT_SCHEDULE_ROOT
+
+DATA = {
+    "name": "Alice",
+    "bio": "Trying to run more.",
+    "habits": {"running": {"description": "Outdoor runs", "metrics": {"distance": {"input": "slider"}}, "history": [
+        {"timestamp": "2025-01-08T08:00:00", "metrics": {"distance": 5}, "notes": "Felt good"},
+    ]}},
+}
+
+
+def embed_texts(texts: list[str], user_id: str | None = None) -> list[list[float]]:
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+class ReportGenerationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = StubClient()
+        self.database = FakeDatabase()
+        for patcher in (
+            self.database.patch(),
+            mock.patch.object(report_llm, "get_client", return_value=self.client),
+            mock.patch.object(report_llm, "embed_texts", side_effect=embed_texts),
+            mock.patch("builtins.print"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertSaved(self, report: dict):
+        self.assertEqual((report["title"], report["content"]), (STUB_REPORT["title"], STUB_REPORT["content"]))
+        saved = self.database.get(f"users/user/reports/{report['date']}")
+        self.assertEqual(saved, {"title": STUB_REPORT["title"], "content": STUB_REPORT["content"]})
+        next_report_date = self.database.get("users/user/newReportDate")
+        self.assertEqual(self.database.get(f"{REPORT_SCHEDULE_ROOT}/user"), next_report_date)
+
+    def test_report_is_generated_and_saved(self):
+        self.assertSaved(report_llm.generate_structured_report(DATA, "user"))
+
+        (request,) = self.client.models.requests
+        self.assertEqual(request["model"], report_llm.REPORT_MODEL)
+        self.assertEqual(request["config"].system_instruction, report_llm.REPORT_SYSTEM_INSTRUCTION)
+        self.assertIn("Name: Alice", request["contents"])
+        self.assertIn("running", request["contents"])
+
+    def test_streamed_report_is_generated_and_saved(self):
+        events = list(report_llm.generate_structured_report_stream(DATA, "user"))
+
+        *fragments, last = events
+        for field in ("title", "content"):
+            text = "".join(event["delta"] for event in fragments if event["field"] == field)
+            self.assertEqual(text, STUB_REPORT[field])
+        self.assertTrue(last["done"])
+        self.assertSaved(last["report"])
+
+
+if __name__ == "__main__":
+    unittest.main()
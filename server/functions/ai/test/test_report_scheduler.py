@@ -0,0 +1,122 @@
+"""
+Tests of the scheduled report runs (ai.report.report_scheduler) against the schedule index in the fake database:
+the run must stop starting reports at its deadline, and survive users whose postponement fails.
+Users scheduled before the index existed are backfilled into it, and users without recent history are dropped
+from it without any Gemini call.
+"""
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from ai.report import report_scheduler
+from ai.test.fake_rtdb import FakeDatabase
+from db.report_schedule import REPORT_SCHEDULE_ROOT, SCHEDULE_BACKFILLED_KEY, backfill_schedule, postpone_report
+
+NOW = datetime(2025, 1, 10)
+USERS = 12
+
+
+def save_report(user_id: str, *args, **kwargs) -> dict:
+    # As a saved report, move the user out of the due range
+    postpone_report(user_id, "2025-02-01T00:00:00")
+    return {}
+
+
+class GenerateDueReportsTest(unittest.TestCase):
+
+    def setUp(self):
+        schedule = {f"user{index:02d}": f"2025-01-0{index % 9 + 1}T00:00:00" for index in range(USERS)}
+        self.database = FakeDatabase({REPORT_SCHEDULE_ROOT: schedule})
+        patcher = self.database.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def due_users(self) -> list[str]:
+        schedule = self.database.get(REPORT_SCHEDULE_ROOT)
+        return [user_id for user_id, date in schedule.items() if date <= NOW.isoformat()]
+
+    def test_all_due_reports_are_generated(self):
+        with mock.patch.object(report_scheduler, "generate_user_report", side_effect=save_report):
+            stats = report_scheduler.generate_due_reports(now=NOW, batch_size=5)
+        self.assertEqual(stats, {"generated": USERS, "failed": 0, "skipped": 0, "idle": 0})
+        self.assertEqual(self.due_users(), [])
+
+    def test_no_report_is_started_after_the_deadline(self):
+        def slow_report(user_id, *args, **kwargs):
+            time.sleep(0.1)
+            return save_report(user_id)
+
+        with mock.patch.object(report_scheduler, "generate_user_report", side_effect=slow_report):
+            stats = report_scheduler.generate_due_reports(now=NOW, max_workers=2, batch_size=USERS,
+                                                          budget_seconds=0.15)
+
+        # The first reports of both workers run past the deadline, the rest of the batch is left for the next run
+        self.assertEqual(stats["generated"], 4)
+        self.assertEqual(stats["skipped"], USERS - 4)
+        self.assertEqual(len(self.due_users()), USERS - 4)
+
+    def test_failed_postponement_does_not_stop_the_run(self):
+        def failing_report(user_id, *args, **kwargs):
+            if user_id in ("user00", "user09"):
+                raise RuntimeError("report failed")
+            return save_report(user_id)
+
+        with mock.patch.object(report_scheduler, "generate_user_report", side_effect=failing_report), \
+                mock.patch.object(report_scheduler, "postpone_report", side_effect=ConnectionError("write failed")):
+            stats = report_scheduler.generate_due_reports(now=NOW, batch_size=3, budget_seconds=5)
+
+        self.assertEqual(stats, {"generated": USERS - 2, "failed": 2, "skipped": 0, "idle": 0})
+        self.assertEqual(sorted(self.due_users()), ["user00", "user09"])
+
+
+    def test_users_scheduled_before_the_index_are_backfilled(self):
+        users = {
+            "old": {"newReportDate": "2025-01-05T00:00:00"},
+            "later": {"newReportDate": "2025-03-01T00:00:00"},
+            "new": {"name": "Never reported"},
+            "user00": {"newReportDate": "2025-03-01T00:00:00"},
+        }
+        self.database.reference("users").set(users)
+
+        with mock.patch.object(report_scheduler, "generate_user_report", side_effect=save_report):
+            stats = report_scheduler.generate_due_reports(now=NOW, batch_size=5)
+        self.assertEqual(stats["generated"], USERS + 1)
+        schedule = self.database.get(REPORT_SCHEDULE_ROOT)
+        self.assertEqual(schedule["later"], "2025-03-01T00:00:00")
+        self.assertNotIn("new", schedule)
+        # Indexed users keep their entry
+        self.assertEqual(schedule["user00"], "2025-02-01T00:00:00")
+
+        # Once done, the backfill only reads its marker
+        self.assertTrue(self.database.get(SCHEDULE_BACKFILLED_KEY))
+        self.database.operations.clear()
+        self.assertEqual(backfill_schedule(), 0)
+        self.assertEqual(self.database.operations, [("get", f"/{SCHEDULE_BACKFILLED_KEY}")])
+
+    def test_users_without_recent_history_are_dropped(self):
+        def report_data(user_id):
+            if user_id == "user00":
+                return {"habits": {"running": {"history": [{"timestamp": "2020-01-01T00:00:00"}]}}}
+            if user_id == "user01":
+                return {"habits": {}}
+            return {"habits": {"running": {"history": [{"timestamp": NOW.isoformat()}]}}}
+
+        def structured_report(data, user_id):
+            return save_report(user_id)
+
+        with mock.patch.object(report_scheduler, "load_user_report_data", side_effect=report_data), \
+                mock.patch.object(report_scheduler, "history_start", return_value="2025-01-01T00:00:00"), \
+                mock.patch.object(report_scheduler, "generate_structured_report",
+                                  side_effect=structured_report) as gemini:
+            stats = report_scheduler.generate_due_reports(now=NOW, batch_size=5)
+
+        self.assertEqual(stats, {"generated": USERS - 2, "failed": 0, "skipped": 0, "idle": 2})
+        self.assertEqual(gemini.call_count, USERS - 2)
+        schedule = self.database.get(REPORT_SCHEDULE_ROOT)
+        self.assertNotIn("user00", schedule)
+        self.assertNotIn("user01", schedule)
+
+
+if __name__ == "__main__":
+    unittest.main()
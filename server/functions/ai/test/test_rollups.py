@@ -0,0 +1,236 @@
+"""
+Tests of the habit rollups (db.rollups) under concurrent submissions: every submission must end up in the rollup,
+which must always match the one recomputed from the history, and failed writes must give the quota back.
+Deletions are subtracted from the rollup without reading the history, unless they make it dirty.
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+import db.db_functions as db_functions
+from ai.test.fake_rtdb import FakeDatabase, FakeReference
+from db.rollups import (ROLLUP_DIRTY_KEY, ROLLUP_KEY, ROLLUP_RECENT_KEY, ROLLUP_REMOVED_KEY, add_to_rollup,
+                        compute_rollup, get_rollup)
+from db.rtdb import generate_push_id
+from db.usage import SUBMISSIONS_KEY
+
+THREADS = 8
+SUBMISSIONS = 64
+HABIT = {"description": "Running", "metrics": {"distance": {"input": "slider"}, "pace": {"input": "time"}}}
+
+
+def submission(index: int) -> dict:
+    # Values out of order, so that min, max and last values depend on every submission
+    value = (index * 37) % SUBMISSIONS
+    record = {
+        "timestamp": f"2025-01-01T{index // 60:02d}:{index % 60:02d}:00",
+        "metrics": {"distance": value, "pace": f"00:{value % 60:02d}:{index % 60:02d}"},
+    }
+    if index % 3 == 0:
+        record["notes"] = f"note {index}"
+    return record
+
+
+def post_submission(record: dict) -> int:
+    environ = EnvironBuilder(method="POST", query_string={"habit": "running"}, json={"submission": record})
+    return db_functions.create_submission(Request(environ.get_environ())).status_code
+
+
+def post_batch(records: list) -> int:
+    environ = EnvironBuilder(method="POST", json={"submissions": {"running": records}})
+    return db_functions.create_submissions_batch(Request(environ.get_environ())).status_code
+
+
+def delete_habit() -> int:
+    environ = EnvironBuilder(method="DELETE", query_string={"habit": "running"})
+    return db_functions.delete_habit(Request(environ.get_environ())).status_code
+
+
+def statistics(rollup: dict | None) -> dict | None:
+    """The rollup without its bookkeeping of recently added and removed submissions."""
+    if rollup is None:
+        return None
+    return {key: value for key, value in rollup.items() if key not in (ROLLUP_RECENT_KEY, ROLLUP_REMOVED_KEY)}
+
+
+def delete_submission(submission_id: str) -> int:
+    environ = EnvironBuilder(method="DELETE", query_string={"habit": "running", "submission": submission_id})
+    return db_functions.delete_submission(Request(environ.get_environ())).status_code
+
+
+class RollupConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase({"users": {"user": {"habits": {"running": HABIT}}}}, latency=0.002)
+        for patcher in (
+            self.database.patch(),
+            mock.patch.object(db_functions, "get_authenticated_user_id", return_value="user"),
+            mock.patch.object(db_functions, "get_habit_definitions", return_value={"running": HABIT}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def habit(self) -> dict:
+        return self.database.get("users/user/habits/running")
+
+    def rollup(self) -> dict | None:
+        return self.database.get("rollups/user/running")
+
+    def assertRollupMatchesHistory(self):
+        # Dirty rollups are recomputed by the read
+        self.assertEqual(statistics(get_rollup("user", "running")), statistics(compute_rollup(self.habit()["history"])))
+
+    def save(self, index: int) -> dict:
+        """Saves a submission in the history, returning it keyed by its push ID."""
+        submission_id, record = generate_push_id(), submission(index)
+        self.database.reference(f"users/user/habits/running/history/{submission_id}").set(record)
+        return {submission_id: record}
+
+    def test_concurrent_additions_are_not_lost(self):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(lambda index: add_to_rollup("user", "running", self.save(index)), range(SUBMISSIONS)))
+
+        self.assertEqual(self.rollup()["count"], SUBMISSIONS)
+        self.assertRollupMatchesHistory()
+
+    def test_missing_rollup_is_computed_from_history(self):
+        for index in range(4):
+            self.save(index)
+        add_to_rollup("user", "running", self.save(4))
+        self.assertEqual(self.rollup()["count"], 5)
+        self.assertRollupMatchesHistory()
+
+    def test_submission_already_in_rollup_is_not_counted_twice(self):
+        saved = self.save(0)
+        add_to_rollup("user", "running", saved)
+        add_to_rollup("user", "running", saved)
+        self.assertEqual(self.rollup()["count"], 1)
+
+    def test_concurrent_submissions(self):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            statuses = list(executor.map(lambda index: post_submission(submission(index)), range(20)))
+
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(len(self.habit()["history"]), 20)
+        self.assertEqual(self.database.get("users/user/usage")[SUBMISSIONS_KEY], 20)
+        self.assertRollupMatchesHistory()
+
+    def test_deletions_during_submissions(self):
+        saved = {}
+        for index in range(10):
+            saved.update(self.save(index))
+        add_to_rollup("user", "running", saved)
+
+        calls = [lambda index=index: post_submission(submission(index)) for index in range(10, 20)]
+        calls += [lambda submission_id=submission_id: delete_submission(submission_id) for submission_id in saved]
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            statuses = list(executor.map(lambda call: call(), calls))
+
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(len(self.habit()["history"]), 10)
+        self.assertRollupMatchesHistory()
+
+    def test_failed_write_gives_the_quota_back(self):
+        set_value = FakeReference.set
+
+        def failing_set(reference, value):
+            if "/history/" in reference.path:
+                raise ConnectionError("write failed")
+            set_value(reference, value)
+
+        with mock.patch.object(FakeReference, "set", failing_set):
+            self.assertEqual(post_submission(submission(0)), 500)
+        self.assertEqual(self.database.get("users/user/usage")[SUBMISSIONS_KEY], 0)
+        self.assertIsNone(self.rollup())
+
+    def test_batch_with_null_notes(self):
+        # Submissions shaped as the speech output carry null notes
+        records = [{**submission(index), "notes": None} for index in range(3)]
+        self.assertEqual(post_batch(records), 200)
+        history = self.habit()["history"]
+        self.assertEqual(len(history), 3)
+        self.assertTrue(all("notes" not in record for record in history.values()))
+        self.assertEqual(self.database.get("users/user/usage")[SUBMISSIONS_KEY], 3)
+        self.assertRollupMatchesHistory()
+
+    def test_failed_batch_write_gives_the_quota_back(self):
+        with mock.patch.object(FakeReference, "update", side_effect=ConnectionError("write failed")):
+            self.assertEqual(post_batch([submission(0), submission(1)]), 500)
+        self.assertEqual(self.database.get("users/user/usage")[SUBMISSIONS_KEY], 0)
+        self.assertIsNone(self.habit().get("history"))
+
+    def test_failed_rollup_update_keeps_the_submission(self):
+        post_submission(submission(0))
+        transaction = FakeReference.transaction
+
+        def failing_transaction(reference, update):
+            if reference.path.startswith("/rollups/"):
+                raise ConnectionError("update failed")
+            return transaction(reference, update)
+
+        with mock.patch.object(FakeReference, "transaction", failing_transaction):
+            self.assertEqual(post_submission(submission(1)), 200)
+
+        # The stale rollup is dropped, and rebuilt from the history by the next submission
+        self.assertIsNone(self.rollup())
+        self.assertEqual(post_submission(submission(2)), 200)
+        self.assertEqual(self.rollup()["count"], 3)
+        self.assertRollupMatchesHistory()
+
+
+    def test_rollup_is_not_in_the_user_data(self):
+        self.assertEqual(post_submission(submission(0)), 200)
+        self.assertNotIn(ROLLUP_KEY, self.habit())
+        self.assertEqual(self.rollup()["count"], 1)
+
+    def old_submissions(self, count: int) -> dict:
+        """Saves submissions older than any request in flight, and their rollup."""
+        with mock.patch("time.time", return_value=1_000_000):
+            saved = {}
+            for index in range(count):
+                saved.update(self.save(index))
+            add_to_rollup("user", "running", saved)
+        return saved
+
+    def test_deletion_is_subtracted_without_reading_the_history(self):
+        # Submission 2 holds neither a min, a max, a last value nor a note
+        submission_id = list(self.old_submissions(10))[2]
+        self.database.operations.clear()
+
+        self.assertEqual(delete_submission(submission_id), 200)
+        self.assertNotIn(("get", "/users/user/habits/running/history"), self.database.operations)
+        self.assertNotIn(ROLLUP_DIRTY_KEY, self.rollup())
+        self.assertEqual(self.rollup()["count"], 9)
+        self.assertEqual(statistics(self.rollup()), statistics(compute_rollup(self.habit()["history"])))
+
+    def test_deletion_of_an_extreme_is_recomputed_on_read(self):
+        # Submission 0 holds the min distance
+        submission_id = list(self.old_submissions(10))[0]
+        self.assertEqual(delete_submission(submission_id), 200)
+        self.assertTrue(self.rollup()[ROLLUP_DIRTY_KEY])
+        self.assertEqual(self.rollup()["count"], 9)
+
+        self.assertRollupMatchesHistory()
+        self.assertNotIn(ROLLUP_DIRTY_KEY, self.rollup())
+
+    def test_deletion_before_the_addition_is_not_counted(self):
+        add_to_rollup("user", "running", self.save(0))
+        saved = self.save(1)
+        (submission_id, _), = saved.items()
+        # The submission is deleted while its addition is still in flight
+        self.assertEqual(delete_submission(submission_id), 200)
+        add_to_rollup("user", "running", saved)
+        self.assertEqual(self.rollup()["count"], 1)
+        self.assertRollupMatchesHistory()
+
+    def test_deleted_habit_loses_its_rollup(self):
+        self.assertEqual(post_submission(submission(0)), 200)
+        self.assertEqual(delete_habit(), 200)
+        self.assertIsNone(self.database.get("rollups/user"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests of the limits of process_speech, with the stub LLM of the load test: users found over their token limit
+are refused before any model call, and requests that take too long are stopped within the function timeout.
+"""
+import time
+import unittest
+from unittest import mock
+
+import ai.ai_functions as ai_functions
+from ai.auxiliary.usage_limit_cache import over_limit_users
+from ai.test.speech_load import StubLLM, build_request
+from db.usage import TOKENS_KEY
+
+
+class SpeechLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.usage = {TOKENS_KEY: 0}
+        self.llm = StubLLM(max_latency=0.01)
+        over_limit_users.clear()
+        self.addCleanup(over_limit_users.clear)
+        for patcher in (
+            mock.patch.object(ai_functions, "get_authenticated_user_id",
+                              side_effect=lambda request: request.headers["Authorization"].removeprefix("Bearer ")),
+            mock.patch.object(ai_functions, "get_usage", side_effect=lambda user_id: self.usage),
+            mock.patch("ai.ai_setup.graph_components.add_tokens"),
+            mock.patch("ai.ai_setup.graph_logic.get_llm", return_value=self.llm),
+            mock.patch("builtins.print"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requests_under_the_limit_are_served(self):
+        self.assertEqual(ai_functions.process_speech(build_request(1, users=1)).status_code, 200)
+
+    def test_known_over_limit_user_never_reaches_the_model(self):
+        self.usage = {TOKENS_KEY: ai_functions.TOKEN_USAGE_LIMIT + 1}
+        self.assertEqual(ai_functions.process_speech(build_request(1, users=1)).status_code, 429)
+
+        with mock.patch.object(self.llm, "ainvoke", wraps=self.llm.ainvoke) as model_call, \
+                mock.patch.object(ai_functions, "get_usage", side_effect=AssertionError("usage read")):
+            self.assertEqual(ai_functions.process_speech(build_request(3, users=1)).status_code, 429)
+        model_call.assert_not_called()
+
+        # Other users are not affected
+        self.usage = {TOKENS_KEY: 0}
+        self.assertEqual(ai_functions.process_speech(build_request(1, users=2)).status_code, 200)
+
+    def test_slow_requests_time_out(self):
+        self.llm.max_latency = 5
+        with mock.patch.object(ai_functions, "SPEECH_TIMEOUT_SECONDS", 0.2), \
+                mock.patch("random.uniform", return_value=5):
+            started = time.monotonic()
+            response = ai_functions.process_speech(build_request(1, users=1))
+        self.assertEqual(response.status_code, 504)
+        self.assertLess(time.monotonic() - started, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Threaded test of the token accounting of the habit graph: concurrent run_graph calls of several users against
+the stub LLM of the load test must each sum the usage of their own model calls only (merge_usage, total_tokens),
+and every user must be charged exactly the tokens of their own requests in the usage counters.
+"""
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from ai.ai_setup.graph_components import merge_usage, total_tokens
+from ai.ai_setup.graph_logic import run_graph
+from ai.test.fake_rtdb import FakeDatabase
+from ai.test.speech_load import STUB_MODEL_NAME, STUB_TOKENS_PER_CALL, StubLLM
+from db.usage import TOKENS_KEY
+
+REQUESTS = 120
+USERS = 6
+THREADS = 16
+
+
+class TwoTurnStubLLM(StubLLM):
+    """Leaves last_action unset on every third request, which then makes a second (final_answer) model call."""
+
+    def _tool_calls(self, index: int) -> list:
+        calls = super()._tool_calls(index)
+        if index % 3 == 0:
+            calls = [{**call, "args": {**call["args"], "last_action": False}} for call in calls]
+        return calls
+
+
+def model_calls(index: int) -> int:
+    return 2 if index % 3 == 0 else 1
+
+
+def graph_data(index: int) -> dict:
+    return {
+        "speech": f"journal{index} entry token{index}",
+        "habits": {f"journal{index}": {"description": "Daily journal", "metrics": {"entry": {"input": "text"}}}},
+        "user_id": f"user{index % USERS}",
+    }
+
+
+class TokenAccountingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(latency=0.002)
+        for patcher in (
+            self.database.patch(),
+            mock.patch("ai.ai_setup.graph_logic.get_llm", return_value=TwoTurnStubLLM(max_latency=0.01)),
+            mock.patch("builtins.print"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_merge_usage_sums_per_model(self):
+        call = {"input_tokens": 10, "output_tokens": 5, "total_tokens": 15}
+        usage = merge_usage(merge_usage({}, {"flash": call}), {"flash": call, "pro": call})
+        self.assertEqual(usage["flash"], {"input_tokens": 20, "output_tokens": 10, "total_tokens": 30})
+        self.assertEqual(total_tokens(usage), 45)
+
+    def test_concurrent_requests_are_charged_to_their_users(self):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            responses = list(executor.map(lambda index: run_graph(graph_data(index)), range(REQUESTS)))
+
+        expected_charges = Counter()
+        for index, response in enumerate(responses):
+            calls = model_calls(index)
+            expected_charges[f"user{index % USERS}"] += calls * STUB_TOKENS_PER_CALL
+            with self.subTest(request=index):
+                self.assertEqual(response["usage_metadata"], {STUB_MODEL_NAME: {
+                    "input_tokens": 10 * calls, "output_tokens": 5 * calls, "total_tokens": STUB_TOKENS_PER_CALL * calls,
+                }})
+                self.assertEqual(total_tokens(response["usage_metadata"]), STUB_TOKENS_PER_CALL * calls)
+                self.assertEqual(set(response["out"]["logging"]) - {f"new{index}"}, {f"journal{index}"})
+
+        charges = {user_id: self.database.get(f"users/{user_id}/usage")[TOKENS_KEY] for user_id in expected_charges}
+        self.assertEqual(charges, dict(expected_charges))
+
+
+if __name__ == "__main__":
+    unittest.main()
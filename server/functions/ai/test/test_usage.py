@@ -0,0 +1,85 @@
+"""
+Concurrency tests of the usage counters (db.usage): many threads apply their changes to the same user
+through the fake database, whose transactions conflict and retry like the real ones.
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from ai.test.fake_rtdb import FakeDatabase
+from db.usage import (SUBMISSIONS_KEY, TODAY_KEY, TOKENS_KEY, UsageLimitError, add_submissions, add_tokens,
+                      apply_usage, get_usage, remove_submission)
+
+THREADS = 8
+CHANGES_PER_THREAD = 25
+
+
+class ApplyUsageConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(latency=0.002)
+        patcher = self.database.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored_usage(self, user_id: str = "user") -> dict:
+        return self.database.get(f"users/{user_id}/usage")
+
+    def test_concurrent_changes_are_not_lost(self):
+        def change(_):
+            apply_usage("user", submissions=1, tokens=7)
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(change, range(THREADS * CHANGES_PER_THREAD)))
+
+        usage = self.stored_usage()
+        self.assertEqual(usage[SUBMISSIONS_KEY], THREADS * CHANGES_PER_THREAD)
+        self.assertEqual(usage[TOKENS_KEY], 7 * THREADS * CHANGES_PER_THREAD)
+
+    def test_tokens_and_submissions_from_different_requests(self):
+        calls = [lambda: add_tokens("user", 11), lambda: add_submissions("user")] * (THREADS * CHANGES_PER_THREAD // 2)
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(lambda call: call(), calls))
+
+        usage = self.stored_usage()
+        self.assertEqual(usage[SUBMISSIONS_KEY], len(calls) // 2)
+        self.assertEqual(usage[TOKENS_KEY], 11 * len(calls) // 2)
+
+    def test_limit_is_never_exceeded(self):
+        limit = 20
+
+        def submit(_):
+            try:
+                add_submissions("user", max_submissions=limit)
+                return True
+            except UsageLimitError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            accepted = sum(executor.map(submit, range(limit * 3)))
+
+        self.assertEqual(accepted, limit)
+        self.assertEqual(self.stored_usage()[SUBMISSIONS_KEY], limit)
+
+    def test_refunds_never_go_below_zero(self):
+        add_submissions("user", count=3)
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(lambda _: remove_submission("user"), range(10)))
+        self.assertEqual(self.stored_usage()[SUBMISSIONS_KEY], 0)
+
+    def test_counters_of_a_previous_day_roll_over(self):
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S")
+        self.database.reference("users/user/usage").set({TODAY_KEY: yesterday, SUBMISSIONS_KEY: 20, TOKENS_KEY: 5000})
+        self.assertEqual(get_usage("user")[TOKENS_KEY], 0)
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(lambda _: add_tokens("user", 10), range(50)))
+
+        usage = self.stored_usage()
+        self.assertEqual(usage[TOKENS_KEY], 500)
+        self.assertEqual(usage[SUBMISSIONS_KEY], 0)
+        self.assertEqual(usage[TODAY_KEY].split("T")[0], datetime.now().strftime("%Y-%m-%d"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Tests that every Vertex AI entry point (the chat model of the graph and the embedding model of the reports)
+initializes the SDK with the project and region of the functions before loading its model.
+"""
+import unittest
+from unittest import mock
+
+from ai.ai_setup import llm_setup
+from ai.report import embeddings
+
+
+class VertexAIInitTest(unittest.TestCase):
+
+    def setUp(self):
+        for resource in (llm_setup.init_vertexai, llm_setup.get_llm, embeddings.get_embedding_model):
+            resource.reset()
+            self.addCleanup(resource.reset)
+        for patcher in (
+            mock.patch("vertexai.init"),
+            mock.patch("builtins.print"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assert_initialized_once(self):
+        import vertexai
+        vertexai.init.assert_called_once_with(
+            project=llm_setup.VERTEXAI_PROJECT, location=llm_setup.VERTEXAI_LOCATION)
+
+    def test_embedding_model_alone_initializes_vertexai(self):
+        with mock.patch.object(embeddings.TextEmbeddingModel, "from_pretrained") as from_pretrained:
+            embeddings.get_embedding_model()
+        from_pretrained.assert_called_once_with(embeddings.EMBEDDING_MODEL_NAME)
+        self.assert_initialized_once()
+
+    def test_llm_and_embeddings_share_the_initialization(self):
+        with mock.patch("langchain_google_vertexai.ChatVertexAI"), \
+                mock.patch.object(embeddings.TextEmbeddingModel, "from_pretrained"):
+            llm_setup.get_llm()
+            embeddings.get_embedding_model()
+        self.assert_initialized_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
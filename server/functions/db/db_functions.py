@@ -8,9 +8,16 @@ as well as user profile information like name, bio and reports.
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from firebase_admin import auth, db
+from firebase_admin import db
 from firebase_functions import https_fn
 
+from db.fanout import map_all
+from db.habit_cache import get_habit_definitions, commit_habit_changes
+from db.rollups import add_to_rollup, remove_from_rollup
+from db.rtdb import generate_push_id
+from db.token_cache import verify_id_token
+from db.usage import UsageLimitError, add_submissions, remove_submission
+
 """Global variables and constants."""
 MAX_HABITS = 10
 MAX_METRICS = 10
@@ -45,8 +52,7 @@ def create_habit(req: https_fn.Request) -> https_fn.Response:
         user_id = get_authenticated_user_id(req)
 
         # Limit habits to 10
-        habits_ref = db.reference(f"users/{user_id}/habits")
-        habits = habits_ref.get() or {}
+        habits = get_habit_definitions(user_id)
 
         if len(habits) >= MAX_HABITS:
             return https_fn.Response("You can only have {MAX_HABITS} habits", status=400)
@@ -101,8 +107,8 @@ def create_habit(req: https_fn.Request) -> https_fn.Response:
                 "A habit can have a maximum of {MAXMETRICS} metrics", status=400
             )
 
-        # Save the habit
-        habits_ref.child(habitname).set(habit)
+        # Save the habit and bump the habit definitions version
+        commit_habit_changes(user_id, {habitname: habit})
         return https_fn.Response("Habit created", status=200)
 
     except Exception as e:
@@ -130,10 +136,9 @@ def delete_habit(req: https_fn.Request) -> https_fn.Response:
             return https_fn.Response("Habit name is required", status=400)
 
         # Check if the habit is not in the db
-        ref = db.reference(f"users/{user_id}/habits/{habitname}")
-        if ref.get() is None:
+        if habitname not in get_habit_definitions(user_id):
             return https_fn.Response("Habit do not exists", status=400)
-        ref.delete()
+        commit_habit_changes(user_id, {habitname: None})
 
         # return 200 OK if there are not errors
         return https_fn.Response("Habit deleted successfully", status=200)
@@ -155,18 +160,12 @@ def create_submission(req: https_fn.Request) -> https_fn.Response:
         
         # Get the user ID from the request
         user_id = get_authenticated_user_id(req)
-        # Initialize user usage and reset daily usage if needed
-        initialize_user_usage(user_id)
-        usage = reset_daily_usage_if_needed(user_id)
 
         # Get the habit name and data from the request
         habitname = req.args.get("habit", "").strip()
         if not habitname:
             return https_fn.Response("Habit name is required", status=400)
 
-        if usage.get("submissions", 0) >= MAX_SUBMISSIONS:
-            return https_fn.Response("Daily submission limit reached", status=429)
-
         # Check if the habit is not already in the db
         data = req.get_json()
         submission = data.get("submission")
@@ -180,7 +179,8 @@ def create_submission(req: https_fn.Request) -> https_fn.Response:
             return https_fn.Response(str(e), status=400)
 
         # Get the habit from the database
-        habit = db.reference(f"users/{user_id}/habits/{habitname}").get()
+        definitions = get_habit_definitions(user_id)
+        habit = definitions.get(habitname)
         if not habit:
             return https_fn.Response("Habit does not exist", status=400)
 
@@ -203,17 +203,110 @@ def create_submission(req: https_fn.Request) -> https_fn.Response:
             except ValueError as e:
                 return https_fn.Response(str(e), status=400)
 
-        history_ref = db.reference(f"users/{user_id}/habits/{habitname}/history")
-        history_ref.push().set(submission)
+        # Count the submission against the daily limit in a single transaction
+        try:
+            add_submissions(user_id, max_submissions=MAX_SUBMISSIONS)
+        except UsageLimitError as e:
+            return https_fn.Response(str(e), status=429)
+
+        # Save the submission
+        submission_id = generate_push_id()
+        try:
+            db.reference(f"users/{user_id}/habits/{habitname}/history/{submission_id}").set(submission)
+        except Exception:
+            # Give the quota back if the submission could not be saved
+            remove_submission(user_id)
+            raise
 
-        usage["submissions"] = usage.get("submissions", 0) + 1
-        db.reference(f"users/{user_id}/usage").set(usage)
+        # Add the saved submission to the habit rollup
+        add_to_rollup(user_id, habitname, {submission_id: submission})
 
         return https_fn.Response("Submission saved successfully", status=200)
     except Exception as e:
         return https_fn.Response(f"Error: {str(e)}", status=500)
 
 
+# MARK: - Create submissions batch
+
+
+@https_fn.on_request(region="europe-west1")
+def create_submissions_batch(req: https_fn.Request) -> https_fn.Response:
+    """
+    Creates many submissions across the habits of the authenticated user.
+    The body maps habit names to lists of submissions, as in the logging output of the speech processing.
+    The quota is reserved first in its own transaction, then all submissions are committed in a single
+    multi-path update, and finally added to the rollups of their habits. The two writes are not atomic:
+    the quota is given back unless the update succeeds, but a crash of the instance between them leaks it
+    until the counters roll over at midnight.
+    """
+    try:
+        # Check if the request method is POST
+        if req.method != "POST":
+            return https_fn.Response("Method not allowed", status=405)
+
+        # Get the user ID from the request
+        user_id = get_authenticated_user_id(req)
+
+        # Get the submissions grouped by habit from the request
+        data = req.get_json(silent=True) or {}
+        submissions = data.get("submissions")
+        if not submissions or not isinstance(submissions, dict):
+            return https_fn.Response("Submissions data is missing", status=400)
+
+        count = sum(len(entries) for entries in submissions.values() if isinstance(entries, list))
+        if count > MAX_SUBMISSIONS:
+            return https_fn.Response(f"A batch can have a maximum of {MAX_SUBMISSIONS} submissions", status=400)
+
+        # Validate every submission against a single fetch of the habit definitions
+        habits = get_habit_definitions(user_id)
+        updates = {}
+        saved = {}
+        for habitname, entries in submissions.items():
+            habit = habits.get(habitname)
+            if not habit:
+                return https_fn.Response(f"Habit '{habitname}' does not exist", status=400)
+            if not isinstance(entries, list):
+                return https_fn.Response(f"Submissions of habit '{habitname}' must be a list", status=400)
+
+            for submission in entries:
+                try:
+                    validate_submission(submission, habit)
+                except ValueError as e:
+                    return https_fn.Response(f"Habit '{habitname}': {str(e)}", status=400)
+                # Null fields, as the notes of the speech output, are absent fields
+                submission = {key: value for key, value in submission.items() if value is not None}
+                submission_id = generate_push_id()
+                updates[f"habits/{habitname}/history/{submission_id}"] = submission
+                saved.setdefault(habitname, {})[submission_id] = submission
+
+        if not updates:
+            return https_fn.Response("Submissions data is missing", status=400)
+        submitted = len(updates)
+
+        # Count the submissions against the daily limit in a single transaction
+        try:
+            add_submissions(user_id, count=submitted, max_submissions=MAX_SUBMISSIONS)
+        except UsageLimitError as e:
+            return https_fn.Response(str(e), status=429)
+
+        # Commit the submissions in one write
+        committed = False
+        try:
+            db.reference(f"users/{user_id}").update(updates)
+            committed = True
+        finally:
+            # Give the quota back if the submissions could not be saved
+            if not committed:
+                remove_submission(user_id, submitted)
+
+        # Add the saved submissions to the rollup of each habit concurrently
+        map_all(lambda habitname: add_to_rollup(user_id, habitname, saved[habitname]), list(saved))
+
+        return https_fn.Response("Submissions saved successfully", status=200)
+    except Exception as e:
+        return https_fn.Response(f"Error: {str(e)}", status=500)
+
+
 # MARK: - Delete submission
 
 
@@ -229,13 +322,6 @@ def delete_submission(req: https_fn.Request) -> https_fn.Response:
         # Get the user ID from the request
         user_id = get_authenticated_user_id(req)
 
-        # Go on usage and remove one submission
-        usage_ref = db.reference(f"users/{user_id}/usage")
-        usage = usage_ref.get() or {}
-        if usage.get("submissions", 0) > 0:
-            usage["submissions"] -= 1
-            usage_ref.set(usage)
-
         # Get the habit name and data from the request
         habitname = req.args.get("habit").strip()
         if not habitname:
@@ -244,11 +330,18 @@ def delete_submission(req: https_fn.Request) -> https_fn.Response:
         if not submission_id:
             return https_fn.Response("Submission ID is required", status=400)
 
-        # Check if the habit is not already in the db
-        ref = db.reference(
-            f"users/{user_id}/habits/{habitname}/history/{submission_id}"
-        )
-        ref.delete()
+        # Read the submission alone, without downloading the history
+        submission_ref = db.reference(f"users/{user_id}/habits/{habitname}/history/{submission_id}")
+        submission = submission_ref.get()
+        if not isinstance(submission, dict):
+            return https_fn.Response("Submission does not exist", status=400)
+
+        # Go on usage and remove one submission
+        remove_submission(user_id)
+
+        # Subtract the submission from the habit rollup, then delete it
+        remove_from_rollup(user_id, habitname, submission_id, submission)
+        submission_ref.delete()
         # return 200 OK if there are not errors
         return https_fn.Response("Submission deleted successfully", status=200)
 
@@ -375,8 +468,8 @@ def get_authenticated_user_id(req: https_fn.Request) -> str:
 
     id_token = auth_header.split("Bearer ")[-1].strip()
 
-    # Verify the ID token using Firebase Admin SDK
-    decoded_token = auth.verify_id_token(id_token)
+    # Verify the ID token using Firebase Admin SDK, reusing recent verifications of the same token
+    decoded_token = verify_id_token(id_token)
     user_id = decoded_token.get("uid")
 
     if user_id is None:
@@ -384,31 +477,22 @@ def get_authenticated_user_id(req: https_fn.Request) -> str:
 
     return user_id
 
-def initialize_user_usage(user_id):
-    """Initializes the user's usage data if it does not exist."""
-    usage_ref = db.reference(f"users/{user_id}/usage")
-    if not usage_ref.get():
-        usage_ref.set({
-            "today": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-            "submissions": 0
-        })
-
-def reset_daily_usage_if_needed(user_id):
-    """Resets the user's daily usage if the date has changed."""
-    usage_ref = db.reference(f"users/{user_id}/usage")
-    usage = usage_ref.get() or {}
-    if usage.get("today", "").split("T")[0] != datetime.now().strftime("%Y-%m-%d"):
-        usage["today"] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-        usage["submissions"] = 0
-        usage_ref.set(usage)
-    return usage
-
 def validate_submission_keys(submission):
     """Validates that the submission contains the required keys."""
     for key in submission:
         if key not in required_keys_in_submission and key != "notes":
             raise ValueError(f"Invalid key '{key}' in submission. Required keys are: {', '.join(required_keys_in_submission)}")
 
+def validate_submission(submission, habit):
+    """Validates a submission against the definition of its habit."""
+    if not isinstance(submission, dict):
+        raise ValueError("Submission data is missing")
+    validate_submission_keys(submission)
+    validate_metrics(submission.get("metrics", {}), habit.get("metrics", {}))
+    validate_timestamp(submission.get("timestamp"))
+    if submission.get("notes") is not None:
+        validate_notes(submission["notes"])
+
 def validate_metrics(submitted_metrics, valid_metrics):
     """Validates that the submitted metrics match the valid metrics for the habit."""
     # Check if the submitted metrics match the valid metrics
@@ -0,0 +1,78 @@
+"""
+This module runs independent Realtime Database operations concurrently on a thread pool shared by
+the whole instance, so that requests touching several habits overlap their round trips instead of
+paying for them one after the other.
+The pool is bounded, and the caller runs any of its operations that no pool thread has started yet,
+so nested fan-outs also use the pool, yet can never wait on a pool that is full of their own callers.
+"""
+
+# MARK: - Imports & Init
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+"""Global variables and constants."""
+FANOUT_MAX_WORKERS = 16
+# Default time limit of each operation, in seconds
+FANOUT_TIMEOUT_SECONDS = 30
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="db-fanout")
+
+# MARK: - Fan-out
+
+
+def run_all(operations, timeout: float | None = FANOUT_TIMEOUT_SECONDS) -> list:
+    """
+    Runs the operations concurrently and returns their results in the same order.
+
+    Args:
+        operations: Callables without arguments, e.g. lambda: db.reference(path).get().
+        timeout: Seconds each operation may take, measured from the start of the fan-out, or None to wait indefinitely.
+
+    Returns:
+        The list of results, one per operation.
+
+    Raises:
+        TimeoutError: If an operation did not complete in time.
+        Exception: The first exception raised by an operation, in order.
+    """
+    operations = list(operations)
+    # A single operation gains nothing from the pool
+    if len(operations) <= 1:
+        return [operation() for operation in operations]
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    futures = [_executor.submit(operation) for operation in operations]
+
+    # Operations still queued run on the calling thread, the last ones first while the pool starts the first ones,
+    # so every operation waited on below is already running on some thread
+    inline = {}
+    for index in reversed(range(len(futures))):
+        if futures[index].cancel():
+            try:
+                inline[index] = (operations[index](), None)
+            except Exception as e:
+                inline[index] = (None, e)
+
+    try:
+        results = []
+        for index, future in enumerate(futures):
+            if index in inline:
+                result, error = inline[index]
+                if error is not None:
+                    raise error
+                results.append(result)
+            else:
+                results.append(future.result(
+                    timeout=None if deadline is None else max(0.0, deadline - time.monotonic())))
+        return results
+    except TimeoutError:
+        raise TimeoutError(f"A database operation did not complete within {timeout} seconds") from None
+    finally:
+        # Operations that did not start yet are dropped once the result is decided
+        for future in futures:
+            future.cancel()
+
+
+def map_all(function, items, timeout: float | None = FANOUT_TIMEOUT_SECONDS) -> list:
+    """Applies the function to each item concurrently and returns the results in the order of the items."""
+    return run_all([lambda item=item: function(item) for item in items], timeout=timeout)
@@ -0,0 +1,137 @@
+"""
+This module keeps an in-process cache of each user's habit definitions (habits without their history),
+so that the write paths can validate requests without downloading the habits subtree every time.
+Cache entries are stamped with the version counter stored in users/{uid}/habitsVersion,
+which is incremented in the same multi-path write as every habit mutation.
+A verified entry is trusted without any read for a few seconds, after which one round trip
+to the version counter is needed to keep serving it.
+"""
+
+# MARK: - Imports & Init
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import db
+
+from db.fanout import map_all
+from db.rollups import rollup_path
+from db.rtdb import list_keys, get_fields
+
+"""Global variables and constants."""
+HABITS_VERSION_KEY = "habitsVersion"
+DEFINITION_FIELDS = ("description", "goal", "metrics")
+CACHE_MAX_USERS = 1024
+CACHE_TTL_SECONDS = 600
+VERSION_CHECK_SECONDS = 30
+
+# MARK: - Cache
+
+
+class HabitSnapshotCache:
+    """Thread-safe LRU cache of habit definitions keyed by user ID, with TTL and version checks."""
+
+    def __init__(self, max_users: int = CACHE_MAX_USERS, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 check_seconds: float = VERSION_CHECK_SECONDS):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.check_seconds = check_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, version: int | None = None):
+        """
+        Returns the cached definitions if they are fresh and match the given version, None otherwise.
+        Without a version, only entries verified within the last check interval are returned.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            cached_version, definitions, stored_at, checked_at = entry
+            now = time.monotonic()
+            if now - stored_at > self.ttl_seconds or (version is not None and cached_version != version):
+                del self._entries[user_id]
+                return None
+            if version is None and now - checked_at > self.check_seconds:
+                return None
+
+            if version is not None:
+                self._entries[user_id] = (cached_version, definitions, stored_at, now)
+            self._entries.move_to_end(user_id)
+            return definitions
+
+    def put(self, user_id: str, version: int, definitions: dict):
+        """Stores the definitions for the user, evicting the least recently used users if full."""
+        with self._lock:
+            now = time.monotonic()
+            self._entries[user_id] = (version, definitions, now, now)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        """Drops the cached definitions of the user."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drops every cached entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+habit_cache = HabitSnapshotCache()
+
+# MARK: - Reads
+
+
+def get_habits_version(user_id: str) -> int:
+    """Reads the habit definitions version counter of the user."""
+    return db.reference(f"users/{user_id}/{HABITS_VERSION_KEY}").get() or 0
+
+
+def get_habit_definitions(user_id: str) -> dict:
+    """
+    Returns the user's habits without their history, served from the cache when the version matches.
+    Entries verified within the last few seconds are served without reads, so mutations made by other
+    instances can go unseen for up to VERSION_CHECK_SECONDS; the ones of this instance are seen at once.
+    """
+    definitions = habit_cache.get(user_id)
+    if definitions is not None:
+        return definitions
+
+    # The version is read before the habits, so a concurrent mutation can only make
+    # the cached data newer than its stamp, and the next read will refetch it
+    version = get_habits_version(user_id)
+    definitions = habit_cache.get(user_id, version)
+    if definitions is not None:
+        return definitions
+
+    # Project the definition fields of each habit so that the history is never downloaded
+    habitnames = list_keys(f"users/{user_id}/habits")
+    habits = map_all(lambda habitname: get_fields(f"users/{user_id}/habits/{habitname}", DEFINITION_FIELDS), habitnames)
+    definitions = {habitname: habit for habitname, habit in zip(habitnames, habits) if habit is not None}
+    habit_cache.put(user_id, version, definitions)
+    return definitions
+
+# MARK: - Writes
+
+
+def version_increment() -> dict:
+    """Server value that atomically increments a counter in a write."""
+    return {".sv": {"increment": 1}}
+
+
+def commit_habit_changes(user_id: str, changes: dict):
+    """
+    Writes the given changes (paths relative to users/{uid}/habits, None to delete)
+    together with the version increment in one multi-path update, then drops the local entry.
+    Habits created or deleted as a whole lose their rollup in the same update.
+    """
+    updates = {f"users/{user_id}/habits/{path}": value for path, value in changes.items()}
+    updates.update({rollup_path(user_id, path): None for path in changes if "/" not in path})
+    updates[f"users/{user_id}/{HABITS_VERSION_KEY}"] = version_increment()
+    db.reference().update(updates)
+    habit_cache.invalidate(user_id)
@@ -0,0 +1,98 @@
+"""
+This module loads the data a report needs directly from the Realtime Database,
+so that clients do not have to upload their whole history with every report request.
+Each habit only contributes its definition, its rollup and the submissions of a recent window,
+and the habits are read concurrently.
+"""
+
+# MARK: - Imports & Init
+import logging
+
+from firebase_admin import db, exceptions
+
+from db.fanout import run_all
+from db.habit_cache import get_habit_definitions
+from db.rollups import ROLLUP_KEY, get_rollup
+from db.rtdb import get_fields
+
+"""Global variables and constants."""
+PROFILE_FIELDS = ("name", "bio")
+
+# MARK: - Reads
+
+
+def get_recent_history(user_id: str, habitname: str, since: str) -> list[dict]:
+    """
+    Reads the submissions of a habit with a timestamp not older than the given one, oldest first.
+    The filter runs on the database, indexed by the ".indexOn" of the history in database.rules.json.
+    If the query is rejected, e.g. the rules are not deployed yet, the history is read whole and filtered here.
+    """
+    ref = db.reference(f"users/{user_id}/habits/{habitname}/history")
+    try:
+        history = ref.order_by_child("timestamp").start_at(since).get() or {}
+        return [submission for submission in history.values() if isinstance(submission, dict)]
+    except exceptions.InvalidArgumentError as e:
+        logging.warning(f"Recent history query of habit {habitname} rejected ({e}), filtering the whole history")
+
+    history = ref.get() or {}
+    records = history.values() if isinstance(history, dict) else history
+    recent = [
+        submission for submission in records
+        if isinstance(submission, dict) and isinstance(submission.get("timestamp"), str)
+        and submission["timestamp"] >= since
+    ]
+    return sorted(recent, key=lambda submission: submission["timestamp"])
+
+
+def load_habit_report_data(user_id: str, habitname: str, definition: dict, since: str) -> dict:
+    """
+    Loads the report data of a single habit: its definition, its rollup and its recent history.
+    Habits without a rollup yet fall back to their whole history, which the report summarizes directly.
+    """
+    habit = dict(definition)
+    rollup = get_rollup(user_id, habitname)
+    if rollup is not None:
+        habit[ROLLUP_KEY] = rollup
+        habit["history"] = get_recent_history(user_id, habitname, since)
+    else:
+        history = db.reference(f"users/{user_id}/habits/{habitname}/history").get() or {}
+        habit["history"] = [submission for submission in history.values() if isinstance(submission, dict)]
+    return habit
+
+
+def has_history_since(data: dict, since: str) -> bool:
+    """Whether any habit of the report data has a submission at or after the given ISO timestamp."""
+    return any(
+        isinstance(submission, dict) and str(submission.get("timestamp") or "") >= since
+        for habit in (data.get("habits") or {}).values()
+        for submission in (habit.get("history") or [])
+    )
+
+
+def load_report_data(user_id: str, since: str, habitnames=None) -> dict:
+    """
+    Loads the name, bio and habits of a user in the same format the client used to upload.
+
+    Args:
+        user_id: The unique identifier for the user.
+        since: ISO timestamp of the oldest submission the report needs.
+        habitnames: The habits to include, all of them if None.
+
+    Returns:
+        A dictionary with the user's name, bio and habits with their rollup and recent history.
+    """
+    definitions = get_habit_definitions(user_id)
+    if habitnames is not None:
+        definitions = {name: definitions[name] for name in habitnames if name in definitions}
+
+    # The profile and every habit are independent reads, so their round trips overlap
+    profile, *habits = run_all(
+        [lambda: get_fields(f"users/{user_id}", PROFILE_FIELDS)] + [
+            lambda habitname=habitname, definition=definition:
+            load_habit_report_data(user_id, habitname, definition, since)
+            for habitname, definition in definitions.items()
+        ]
+    )
+    data = dict(profile or {})
+    data["habits"] = dict(zip(definitions.keys(), habits))
+    return data
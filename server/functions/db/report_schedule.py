@@ -0,0 +1,88 @@
+"""
+This module keeps the index of the next report date of each user in reportSchedule/{uid},
+next to the newReportDate field of the user, so that the report scheduler can find the users
+that are due with an ordered query instead of downloading every user.
+The index also works as the checkpoint of the scheduler: a user leaves the due range as soon as
+their report is saved, or is postponed after a failure, so an interrupted run resumes where it stopped.
+Users whose newReportDate was set before the index existed are added to it once by the backfill,
+and users without any recent history are dropped from it until they save a report again.
+"""
+
+# MARK: - Imports & Init
+import logging
+
+from firebase_admin import db, exceptions
+
+from db.fanout import map_all
+from db.rtdb import list_keys
+
+"""Global variables and constants."""
+REPORT_SCHEDULE_ROOT = "reportSchedule"
+NEW_REPORT_DATE_KEY = "newReportDate"
+# Marker set once the index holds every user scheduled before it existed, kept outside of the index
+# so that the ordered query of the due users only ever sees dates
+SCHEDULE_BACKFILLED_KEY = "reportScheduleBackfilled"
+
+# MARK: - Reads
+
+
+def get_due_users(now: str, limit: int) -> list[str]:
+    """
+    Returns up to limit users whose next report date is not after the given ISO timestamp, most overdue first.
+    The query is indexed by the ".indexOn" of reportSchedule in database.rules.json, if it is rejected
+    the index is read whole and filtered here.
+    """
+    ref = db.reference(REPORT_SCHEDULE_ROOT)
+    try:
+        due = ref.order_by_value().end_at(now).limit_to_first(limit).get() or {}
+        return list(due.keys())
+    except exceptions.InvalidArgumentError as e:
+        logging.warning(f"Due users query rejected ({e}), filtering the whole schedule")
+
+    schedule = ref.get() or {}
+    due = sorted(
+        (date, user_id) for user_id, date in schedule.items() if isinstance(date, str) and date <= now
+    )
+    return [user_id for _, user_id in due[:limit]]
+
+# MARK: - Writes
+
+
+def schedule_updates(user_id: str, next_report_date: str) -> dict:
+    """Returns the root-relative update entries setting the next report date of the user and its index."""
+    return {
+        f"users/{user_id}/{NEW_REPORT_DATE_KEY}": next_report_date,
+        f"{REPORT_SCHEDULE_ROOT}/{user_id}": next_report_date,
+    }
+
+
+def postpone_report(user_id: str, retry_date: str):
+    """Moves the user out of the due range until the given ISO timestamp, without changing newReportDate."""
+    db.reference(f"{REPORT_SCHEDULE_ROOT}/{user_id}").set(retry_date)
+
+
+def unschedule_report(user_id: str):
+    """Drops the user from the index, without changing newReportDate. Saving a report schedules them again."""
+    db.reference(f"{REPORT_SCHEDULE_ROOT}/{user_id}").delete()
+
+
+def backfill_schedule() -> int:
+    """
+    Adds to the index the users with a newReportDate but no entry, i.e. scheduled before the index existed,
+    then sets the backfill marker in the same write. Once the marker is set this costs a single read,
+    and an interrupted backfill is simply done again by the next run.
+
+    Returns:
+        The number of users added to the index.
+    """
+    if db.reference(SCHEDULE_BACKFILLED_KEY).get():
+        return 0
+
+    indexed = set(list_keys(REPORT_SCHEDULE_ROOT))
+    missing = [user_id for user_id in list_keys("users") if user_id not in indexed]
+    dates = map_all(lambda user_id: db.reference(f"users/{user_id}/{NEW_REPORT_DATE_KEY}").get(), missing)
+    updates = {
+        f"{REPORT_SCHEDULE_ROOT}/{user_id}": date for user_id, date in zip(missing, dates) if isinstance(date, str)
+    }
+    db.reference().update({**updates, SCHEDULE_BACKFILLED_KEY: True})
+    return len(updates)
@@ -0,0 +1,305 @@
+"""
+This module maintains the rollup statistics of each habit in rollups/{uid}/{habit}, a server-only node
+outside of the user data, so that reports can summarize a habit without reading its whole history.
+For every metric the rollup keeps count, sum, sum of squares, min and max of its numeric and time values
+(times in seconds), plus the last few values, and for the habit the last few notes. Submissions are added to
+the rollup in a transaction once saved, and subtracted from it when deleted. Deletions that touch a min, max,
+last value or note mark the rollup dirty, and dirty or missing rollups are recomputed from the history on read.
+"""
+
+# MARK: - Imports & Init
+import copy
+import logging
+import time
+
+from firebase_admin import db
+
+from db.fanout import map_all
+from db.rtdb import push_id_time
+
+"""Global variables and constants."""
+ROLLUP_ROOT = "rollups"
+# Key of the rollup in the report data of a habit
+ROLLUP_KEY = "rollup"
+ROLLUP_LAST_VALUES = 5
+# Push IDs of the submissions added to a rollup are kept for this long, longer than any request runs,
+# so that a rollup rebuilt from the history never counts twice a submission that is still being added
+ROLLUP_RECENT_KEY = "recent"
+ROLLUP_RECENT_SECONDS = 600
+# Push IDs of the deleted submissions, with their deletion time, kept as long as the recently added ones,
+# so that neither an addition still in flight nor a rebuild counts them again
+ROLLUP_REMOVED_KEY = "removed"
+ROLLUP_DIRTY_KEY = "dirty"
+NUMERIC = "numeric"
+TIME = "time"
+
+# MARK: - Values
+
+
+def rollup_path(user_id: str, habitname: str) -> str:
+    """Path of the rollup of a habit."""
+    return f"{ROLLUP_ROOT}/{user_id}/{habitname}"
+
+
+def metric_number(value):
+    """
+    Classifies a submitted metric value.
+    Returns (NUMERIC, number), (TIME, seconds) for 'HH:MM:SS' strings, or (None, None) for other values.
+    """
+    if value is None or isinstance(value, (dict, list)):
+        return None, None
+    try:
+        return NUMERIC, float(value)
+    except (ValueError, TypeError):
+        pass
+    try:
+        h, m, s = map(int, str(value).split(":"))
+        return TIME, h * 3600 + m * 60 + s
+    except ValueError:
+        return None, None
+
+
+def _merge_last(last, entries):
+    """Merges new (timestamp, value) entries into the last values, keeping the most recent ones."""
+    merged = [item for item in (last or []) if isinstance(item, dict)]
+    merged += [{"timestamp": timestamp, "value": value} for timestamp, value in entries]
+    merged.sort(key=lambda item: str(item.get("timestamp", "")))
+    return merged[-ROLLUP_LAST_VALUES:]
+
+
+def _notes(submissions) -> list:
+    """Returns the (timestamp, notes) entries of the submissions with notes."""
+    return [(submission.get("timestamp"), submission["notes"]) for submission in submissions if submission.get("notes")]
+
+
+def _accumulate(submissions) -> dict:
+    """Accumulates the statistics and the timestamped values of each metric over the submissions."""
+    metrics = {}
+    for submission in submissions:
+        timestamp = submission.get("timestamp")
+        for metric_name, value in (submission.get("metrics") or {}).items():
+            metric = metrics.setdefault(metric_name, {"last": []})
+            metric["last"].append((timestamp, value))
+
+            kind, number = metric_number(value)
+            if kind is None:
+                continue
+            stats = metric.setdefault(kind, {"count": 0, "sum": 0.0, "sumSq": 0.0, "min": number, "max": number})
+            stats["count"] += 1
+            stats["sum"] += number
+            stats["sumSq"] += number * number
+            stats["min"] = min(stats["min"], number)
+            stats["max"] = max(stats["max"], number)
+    return metrics
+
+# MARK: - Incremental updates
+
+
+def _recent_cutoff() -> float:
+    return (time.time() - ROLLUP_RECENT_SECONDS) * 1000
+
+
+def _recent_keys(recent, keys=()) -> dict:
+    """Adds the given push IDs to the recently added ones, dropping those older than ROLLUP_RECENT_SECONDS."""
+    cutoff = _recent_cutoff()
+    recent = {key: added for key, added in (recent or {}).items() if isinstance(added, (int, float))}
+    recent.update((key, added) for key in keys if (added := push_id_time(key)) is not None)
+    return {key: added for key, added in recent.items() if added >= cutoff}
+
+
+def _removed_keys(removed, keys=()) -> dict:
+    """Adds the given push IDs to the removed ones, dropping those removed before ROLLUP_RECENT_SECONDS."""
+    cutoff = _recent_cutoff()
+    removed = {key: at for key, at in (removed or {}).items() if isinstance(at, (int, float)) and at >= cutoff}
+    removed.update((key, time.time() * 1000) for key in keys)
+    return removed
+
+
+def merge_rollup(rollup, submissions: dict) -> dict:
+    """
+    Returns a copy of the rollup with the submissions, keyed by their history push IDs, added to its statistics,
+    last values and notes. Submissions among the recently added ones of the rollup are already in it, and
+    the removed ones must not be in it, so both are skipped.
+    """
+    rollup = copy.deepcopy(rollup) if isinstance(rollup, dict) else {}
+    recent = rollup.get(ROLLUP_RECENT_KEY) or {}
+    removed = rollup.get(ROLLUP_REMOVED_KEY) or {}
+    submissions = {key: submission for key, submission in submissions.items()
+                   if key not in recent and key not in removed}
+    rollup[ROLLUP_RECENT_KEY] = _recent_keys(recent, submissions)
+    records = list(submissions.values())
+    rollup["count"] = rollup.get("count", 0) + len(records)
+    metrics = rollup.setdefault("metrics", {})
+
+    for metric_name, change in _accumulate(records).items():
+        metric = metrics.setdefault(metric_name, {})
+        for kind in (NUMERIC, TIME):
+            stats = change.get(kind)
+            if stats is None:
+                continue
+            current = metric.get(kind)
+            if not current:
+                metric[kind] = stats
+                continue
+            for key in ("count", "sum", "sumSq"):
+                current[key] = current.get(key, 0) + stats[key]
+            current["min"] = min(current.get("min", stats["min"]), stats["min"])
+            current["max"] = max(current.get("max", stats["max"]), stats["max"])
+        metric["last"] = _merge_last(metric.get("last"), change["last"])
+
+    notes = _notes(records)
+    if notes:
+        rollup["notes"] = _merge_last(rollup.get("notes"), notes)
+    return rollup
+
+
+def subtract_from_rollup(rollup, submission_id: str, submission: dict) -> dict | None:
+    """
+    Returns a copy of the rollup without the given submission, keyed by its history push ID.
+    Counts and sums are subtracted exactly; if the submission held a min, max, last value or note of the rollup,
+    the rollup is marked dirty, to be recomputed from the history by the next read. Submissions still being
+    added are only recorded as removed, so that their addition skips them, and removing twice is a no-op.
+    """
+    if not isinstance(rollup, dict):
+        return None
+    rollup = copy.deepcopy(rollup)
+    recent = rollup.get(ROLLUP_RECENT_KEY) or {}
+    removed = rollup.get(ROLLUP_REMOVED_KEY) or {}
+    if submission_id in removed:
+        return rollup
+    rollup[ROLLUP_REMOVED_KEY] = _removed_keys(removed, [submission_id])
+
+    # A recent submission missing from the recently added ones has not been added yet
+    added = push_id_time(submission_id)
+    if submission_id not in recent and added is not None and added >= _recent_cutoff():
+        return rollup
+    rollup[ROLLUP_RECENT_KEY] = {key: at for key, at in recent.items() if key != submission_id}
+
+    rollup["count"] = rollup.get("count", 0) - 1
+    if rollup["count"] <= 0:
+        return None
+
+    def touches(entries, last) -> bool:
+        return any({"timestamp": timestamp, "value": value} in (last or []) for timestamp, value in entries)
+
+    dirty = touches(_notes([submission]), rollup.get("notes"))
+    metrics = rollup.setdefault("metrics", {})
+    for metric_name, change in _accumulate([submission]).items():
+        metric = metrics.get(metric_name)
+        if metric is None:
+            continue
+        for kind in (NUMERIC, TIME):
+            stats, current = change.get(kind), metric.get(kind)
+            if stats is None or not current:
+                continue
+            for key in ("count", "sum", "sumSq"):
+                current[key] = current.get(key, 0) - stats[key]
+            if current["count"] <= 0:
+                del metric[kind]
+            elif stats["min"] <= current.get("min", stats["min"]) or stats["max"] >= current.get("max", stats["max"]):
+                dirty = True
+        dirty = dirty or touches(change["last"], metric.get("last"))
+
+    if dirty:
+        rollup[ROLLUP_DIRTY_KEY] = True
+    return rollup
+
+
+def _update_rollup(user_id: str, habitname: str, update) -> dict | None:
+    """
+    Runs the update function in a transaction on the rollup of the habit, so that concurrent updates never
+    overwrite each other. The rollup is derived data: if it cannot be updated it is dropped, and rebuilt
+    from the history later, so that submissions already saved are not reported as failed.
+    """
+    ref = db.reference(rollup_path(user_id, habitname))
+    try:
+        return ref.transaction(update)
+    except Exception:
+        logging.exception(f"Could not update the rollup of habit {habitname} of user {user_id}, dropping it")
+        try:
+            ref.delete()
+        except Exception:
+            logging.exception(f"Could not drop the rollup of habit {habitname} of user {user_id}")
+        return None
+
+
+def add_to_rollup(user_id: str, habitname: str, submissions: dict) -> None:
+    """
+    Adds submissions already saved in the history, keyed by their push IDs, to the rollup of the habit.
+    Habits without a rollup (e.g. created before rollups existed) get one computed from their history,
+    which already includes the submissions, recorded as recently added so that they are not counted twice.
+    """
+    def update(rollup):
+        if rollup is None:
+            rollup = compute_rollup(_get_history(user_id, habitname))
+        return merge_rollup(rollup, submissions)
+
+    _update_rollup(user_id, habitname, update)
+
+
+def remove_from_rollup(user_id: str, habitname: str, submission_id: str, submission: dict) -> None:
+    """Subtracts a submission from the rollup of the habit, before it is deleted from the history."""
+    _update_rollup(user_id, habitname, lambda rollup: subtract_from_rollup(rollup, submission_id, submission))
+
+
+def rebuild_rollup(user_id: str, habitname: str) -> dict | None:
+    """
+    Recomputes a dirty rollup of the habit from its history, leaving out the removed submissions.
+    Returns the rollup, which another request may have recomputed already.
+    """
+    def update(rollup):
+        if isinstance(rollup, dict) and not rollup.get(ROLLUP_DIRTY_KEY):
+            return rollup
+        removed = rollup.get(ROLLUP_REMOVED_KEY) if isinstance(rollup, dict) else None
+        return compute_rollup(_get_history(user_id, habitname), removed)
+
+    return _update_rollup(user_id, habitname, update)
+
+# MARK: - Recompute
+
+
+def _get_history(user_id: str, habitname: str) -> dict:
+    history = db.reference(f"users/{user_id}/habits/{habitname}/history").get() or {}
+    return history if isinstance(history, dict) else dict(enumerate(history))
+
+
+def compute_rollup(history, removed=None) -> dict | None:
+    """
+    Computes the rollup of a habit from scratch, given its history (dict of submissions or list).
+    Push IDs of the history recent enough to be still in flight are recorded as recently added,
+    and the given removed push IDs, still being deleted from the history, are left out and kept.
+    """
+    removed = _removed_keys(removed)
+    if isinstance(history, dict):
+        history = {key: record for key, record in history.items() if key not in removed}
+    records = history.values() if isinstance(history, dict) else (history or [])
+    records = [record for record in records if isinstance(record, dict)]
+    if not records:
+        return None
+
+    metrics = _accumulate(records)
+    for metric in metrics.values():
+        metric["last"] = _merge_last([], metric["last"])
+    rollup = {"count": len(records), "metrics": metrics, "notes": _merge_last([], _notes(records))}
+    if isinstance(history, dict):
+        rollup[ROLLUP_RECENT_KEY] = _recent_keys({}, history)
+    if removed:
+        rollup[ROLLUP_REMOVED_KEY] = removed
+    return rollup
+
+# MARK: - Reads
+
+
+def get_rollup(user_id: str, habitname: str) -> dict | None:
+    """Reads the rollup of the habit, recomputing it from the history first if it is dirty."""
+    rollup = db.reference(rollup_path(user_id, habitname)).get()
+    if isinstance(rollup, dict) and rollup.get(ROLLUP_DIRTY_KEY):
+        rollup = rebuild_rollup(user_id, habitname)
+    return rollup
+
+
+def get_rollups(user_id: str, habitnames) -> dict:
+    """Reads the rollups of the given habits, habits without a rollup are left out."""
+    habitnames = list(habitnames)
+    rollups = map_all(lambda habitname: get_rollup(user_id, habitname), habitnames)
+    return {habitname: rollup for habitname, rollup in zip(habitnames, rollups) if rollup is not None}
@@ -0,0 +1,91 @@
+"""
+This module contains small Realtime Database access helpers that avoid downloading whole subtrees.
+Shallow reads only return the direct children of a node, with nested objects replaced by True,
+so key listings, existence checks and field projections cost O(keys) instead of O(subtree).
+"""
+
+# MARK: - Imports & Init
+import secrets
+import threading
+import time
+
+from firebase_admin import db
+
+from db.fanout import map_all
+
+"""Global variables and constants."""
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+_push_lock = threading.Lock()
+_last_push_time = 0
+_last_random = [0] * 12
+
+# MARK: - Shallow reads
+
+
+def list_keys(path: str) -> list[str]:
+    """Lists the child keys of the node at the given path without downloading their content."""
+    children = db.reference(path).get(shallow=True)
+    if not isinstance(children, dict):
+        return []
+    return list(children.keys())
+
+
+def get_fields(path: str, fields) -> dict | None:
+    """
+    Projects the given fields of the node at the given path.
+    Leaf fields come with the shallow read, nested fields are then fetched concurrently,
+    so a projection costs two round trips whatever the number of fields.
+    Returns None if the node does not exist.
+    """
+    ref = db.reference(path)
+    children = ref.get(shallow=True)
+    if children is None:
+        return None
+    if not isinstance(children, dict):
+        return {}
+
+    projection = {field: children[field] for field in fields if field in children}
+    # Shallow reads replace nested objects with True
+    nested = [field for field, value in projection.items() if value is True]
+    for field, value in zip(nested, map_all(lambda field: ref.child(field).get(), nested)):
+        projection[field] = value
+    return projection
+
+# MARK: - Push IDs
+
+
+def generate_push_id() -> str:
+    """
+    Generates a chronologically ordered key with the same format as push(), without a round trip,
+    so that new children can be written as part of a multi-path update.
+    """
+    global _last_push_time, _last_random
+    with _push_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            # Same millisecond: increment the random part to keep keys unique and ordered
+            for i in range(11, -1, -1):
+                if _last_random[i] < 63:
+                    _last_random[i] += 1
+                    break
+                _last_random[i] = 0
+        else:
+            _last_push_time = now
+            _last_random = [secrets.randbelow(64) for _ in range(12)]
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[i] for i in _last_random)
+
+
+def push_id_time(key: str) -> int | None:
+    """Returns the creation time, in milliseconds, encoded in a push ID, or None for other keys."""
+    if not isinstance(key, str) or len(key) != 20 or any(char not in PUSH_CHARS for char in key):
+        return None
+    now = 0
+    for char in key[:8]:
+        now = now * 64 + PUSH_CHARS.index(char)
+    return now
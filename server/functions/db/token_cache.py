@@ -0,0 +1,104 @@
+"""
+This module caches the result of Firebase ID token verification, so that the bursts of requests
+a client sends with the same token only pay for the signature check once.
+Entries are keyed by a hash of the token and never outlive the token's own expiration.
+"""
+
+# MARK: - Imports & Init
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import auth
+
+"""Global variables and constants."""
+CACHE_MAX_TOKENS = 2048
+# Bounds how long a revoked or disabled account keeps being accepted by a warm instance
+CACHE_MAX_TTL_SECONDS = 300
+# Tokens this close to their expiration are not cached
+EXPIRY_LEEWAY_SECONDS = 5
+
+# MARK: - Cache
+
+
+class TokenVerificationCache:
+    """Thread-safe LRU cache of decoded ID tokens keyed by the SHA-256 of the token."""
+
+    def __init__(self, max_tokens: int = CACHE_MAX_TOKENS, max_ttl_seconds: float = CACHE_MAX_TTL_SECONDS):
+        self.max_tokens = max_tokens
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def token_key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+    def get(self, id_token: str):
+        """Returns the decoded token if it has been verified and is not expired, None otherwise."""
+        key = self.token_key(id_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            decoded_token, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return decoded_token
+
+    def put(self, id_token: str, decoded_token: dict):
+        """Stores a verified token until its expiration, capped by the maximum TTL."""
+        now = time.time()
+        expires_at = min(decoded_token.get("exp", 0) - EXPIRY_LEEWAY_SECONDS, now + self.max_ttl_seconds)
+        if expires_at <= now:
+            return
+
+        key = self.token_key(id_token)
+        with self._lock:
+            self._entries[key] = (decoded_token, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_tokens:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, id_token: str):
+        """Drops the cached verification of the token."""
+        with self._lock:
+            self._entries.pop(self.token_key(id_token), None)
+
+    def clear(self):
+        """Drops every cached entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenVerificationCache()
+
+# MARK: - Verification
+
+
+def verify_id_token(id_token: str, check_revoked: bool = False) -> dict:
+    """
+    Verifies the Firebase ID token, reusing a previous verification when possible.
+    Revocation checks always hit Firebase Auth, and a failed check drops the cached entry.
+    """
+    if check_revoked:
+        try:
+            decoded_token = auth.verify_id_token(id_token, check_revoked=True)
+        except Exception:
+            token_cache.invalidate(id_token)
+            raise
+        token_cache.put(id_token, decoded_token)
+        return decoded_token
+
+    decoded_token = token_cache.get(id_token)
+    if decoded_token is not None:
+        return decoded_token
+
+    decoded_token = auth.verify_id_token(id_token)
+    token_cache.put(id_token, decoded_token)
+    return decoded_token
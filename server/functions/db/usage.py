@@ -0,0 +1,99 @@
+"""
+This module tracks the daily usage counters of a user (submissions and LLM tokens) in users/{uid}/usage.
+Every change is applied in a single database transaction, which rolls the counters over
+when the day has changed, so concurrent requests never lose increments.
+"""
+
+# MARK: - Imports & Init
+import random
+import time
+from datetime import datetime
+
+from firebase_admin import db
+
+"""Global variables and constants."""
+TODAY_KEY = "today"
+SUBMISSIONS_KEY = "submissions"
+TOKENS_KEY = "tokens"
+# Transactions aborted after exhausting the SDK retries (requests of the same user racing) are run again,
+# after a random pause that spreads the contenders out
+TRANSACTION_ATTEMPTS = 4
+TRANSACTION_BACKOFF_SECONDS = 0.05
+
+
+class UsageLimitError(ValueError):
+    """Raised when a change would exceed a daily usage limit, aborting the transaction."""
+
+# MARK: - Helpers
+
+
+def _now() -> datetime:
+    return datetime.now()
+
+
+def _is_current(usage, now: datetime) -> bool:
+    """Checks whether the stored usage refers to the given day."""
+    return isinstance(usage, dict) and usage.get(TODAY_KEY, "").split("T")[0] == now.strftime("%Y-%m-%d")
+
+
+def _rolled_over(usage, now: datetime) -> dict:
+    """Returns a copy of the usage, with counters reset if they refer to a previous day."""
+    usage = dict(usage) if isinstance(usage, dict) else {}
+    if not _is_current(usage, now):
+        usage = {TODAY_KEY: now.strftime("%Y-%m-%dT%H:%M:%S"), SUBMISSIONS_KEY: 0, TOKENS_KEY: 0}
+    usage.setdefault(SUBMISSIONS_KEY, 0)
+    usage.setdefault(TOKENS_KEY, 0)
+    return usage
+
+# MARK: - Reads
+
+
+def get_usage(user_id: str) -> dict:
+    """Reads the user's usage for today, counters of a previous day are reported as zero."""
+    usage = db.reference(f"users/{user_id}/usage").get()
+    return _rolled_over(usage, _now())
+
+# MARK: - Atomic updates
+
+
+def apply_usage(user_id: str, submissions: int = 0, tokens: int = 0, max_submissions: int | None = None) -> dict:
+    """
+    Atomically rolls the usage over to today and adds the given deltas to the counters.
+    Submission counts never go below zero. If max_submissions is given and the new
+    submission count would exceed it, UsageLimitError is raised and nothing is written.
+    Returns the usage as committed.
+    """
+    now = _now()
+
+    def update(current):
+        usage = _rolled_over(current, now)
+        new_submissions = max(usage[SUBMISSIONS_KEY] + submissions, 0)
+        if max_submissions is not None and submissions > 0 and new_submissions > max_submissions:
+            raise UsageLimitError("Daily submission limit reached")
+        usage[SUBMISSIONS_KEY] = new_submissions
+        usage[TOKENS_KEY] = usage[TOKENS_KEY] + tokens
+        return usage
+
+    ref = db.reference(f"users/{user_id}/usage")
+    for attempt in range(TRANSACTION_ATTEMPTS):
+        try:
+            return ref.transaction(update)
+        except db.TransactionAbortedError:
+            if attempt == TRANSACTION_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, TRANSACTION_BACKOFF_SECONDS * 2 ** attempt))
+
+
+def add_submissions(user_id: str, count: int = 1, max_submissions: int | None = None) -> dict:
+    """Counts new submissions for today, enforcing the daily limit if given."""
+    return apply_usage(user_id, submissions=count, max_submissions=max_submissions)
+
+
+def remove_submission(user_id: str, count: int = 1) -> dict:
+    """Gives back submissions of today's quota."""
+    return apply_usage(user_id, submissions=-count)
+
+
+def add_tokens(user_id: str, tokens: int) -> dict:
+    """Counts LLM tokens consumed today."""
+    return apply_usage(user_id, tokens=tokens)
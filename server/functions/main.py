@@ -2,12 +2,15 @@ from firebase_admin import initialize_app
 
 from ai.ai_functions import \
     process_speech, \
-    generate_report
+    generate_report, \
+    generate_report_stream, \
+    generate_scheduled_reports
 
 from db.db_functions import \
     create_habit, \
     delete_habit, \
     create_submission, \
+    create_submissions_batch, \
     delete_submission, \
     update_name, \
     update_bio, \
@@ -17,9 +20,12 @@ initialize_app()
 
 __all__ = ["process_speech",
            "generate_report",
+           "generate_report_stream",
+           "generate_scheduled_reports",
            "create_habit",
            "delete_habit",
            "create_submission",
+           "create_submissions_batch",
            "delete_submission",
            "update_name",
            "update_bio",